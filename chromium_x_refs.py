@@ -2,13 +2,14 @@
 # Use of this source code is governed by the Apache license found in the LICENSE
 # file.
 
-import datetime
+import concurrent.futures
 import html
 import html.parser
 import imp
 import os.path
 import re
 import sys
+import threading
 import time
 from pprint import pprint
 import sublime, sublime_plugin
@@ -16,15 +17,26 @@ import sublime, sublime_plugin
 import ChromiumXRefs.third_party.codesearch as codesearch
 
 g_cs = None
-g_last_gcd_g_cs = datetime.datetime.now()
 
 
 def fullprint(obj):
-  pprint(vars(obj))
+  if isinstance(obj, codesearch.Message):
+    pprint(obj.Fields())
+  else:
+    pprint(vars(obj))
+
+# Cross references change slowly compared to an editing session. Expired
+# responses younger than this are shown right away and refreshed in the
+# background.
+CACHE_MAX_STALENESS_IN_SECONDS = 4 * 60 * 60
+
+# Upper bound on the memory held by files and their annotations. Least recently
+# used files are dropped beyond this, so a single CodeSearch instance can be
+# kept around for the whole session.
+FILE_INFO_CACHE_MAX_BYTES = 128 * 1024 * 1024
 
 def getCS(path=None):
   global g_cs
-  global g_last_gcd_g_cs
 
   create = False
 
@@ -33,18 +45,74 @@ def getCS(path=None):
       print("No g_cs found and unable to create one.")
       return None
     create = True
-  if not path is None and (datetime.datetime.now() - g_last_gcd_g_cs).seconds > 60 * 10:
-    # The codesearch object collects cruft over time. The easiest way to deal with that is to periodically delete it.
+  elif not path is None and path != g_cs.source_root:
+    # Switched to a different checkout.
     create = True
 
   if create:
-    g_cs = codesearch.CodeSearch(should_cache=True, source_root=path)
-    g_last_gcd_g_cs = datetime.datetime.now()
+    if g_cs is not None:
+      # Release the cache, background threads and connections of the previous
+      # checkout. Lookups that are still running against it miss the cache.
+      g_cs.TeardownCache()
+    g_cs = codesearch.CodeSearch(should_cache=True, source_root=path,
+                                 connection_pool_size=4,
+                                 cache_max_staleness_in_seconds=CACHE_MAX_STALENESS_IN_SECONDS,
+                                 file_info_cache_max_bytes=FILE_INFO_CACHE_MAX_BYTES,
+                                 lazy_decoding=getSetting('lazy_decoding', False),
+                                 compact_messages=getSetting('compact_messages', False))
 
   return g_cs
 
 g_last_xref_cmd = None  # The last chromium cmd that ran
 
+# The maximum number of codesearch lookups that run concurrently while
+# resolving callers.
+MAX_RESOLVER_THREADS = 8
+g_executor = None
+
+def getExecutor():
+  global g_executor
+  if g_executor is None:
+    g_executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_RESOLVER_THREADS)
+  return g_executor
+
+# Once the panel is shown, the files that the user is likely to look at next
+# are fetched in the background. That is the files containing references and
+# callers, followed by the callers of the first few callers. Prefetching stops
+# after this many files or seconds, or when a new lookup starts.
+PREFETCH_MAX_FILES = 100
+PREFETCH_MAX_SECONDS = 30
+PREFETCH_MAX_CALLERS = 10
+PREFETCH_BATCH_SIZE = 10
+g_prefetch_executor = None
+
+# Prefetching runs on a thread of its own so that it doesn't hold up lookups
+# on the resolver thread pool.
+def getPrefetchExecutor():
+  global g_prefetch_executor
+  if g_prefetch_executor is None:
+    g_prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+  return g_prefetch_executor
+
+# Reference lists are shown one file at a time. Files are collapsed unless the
+# list has no more than REFS_EXPANDED_MAX entries in total. Expanded files show
+# REFS_PER_PAGE references and REFS_GROUPS_PER_PAGE files are listed at first.
+# More can be shown on demand.
+REFS_EXPANDED_MAX = 20
+REFS_PER_PAGE = 20
+REFS_GROUPS_PER_PAGE = 50
+
+# While the cross references are being received, the panel is updated with
+# the ones found so far at most every XREFS_PROGRESS_INTERVAL seconds.
+XREFS_PROGRESS_INTERVAL = 0.25
+
+# Like map(), but runs |fn| for each item on the resolver thread pool. Results
+# are returned in the same order as |items|.
+def mapInParallel(fn, items):
+  if len(items) < 2:
+    return [fn(item) for item in items]
+  return list(getExecutor().map(fn, items))
+
 def getLocationString(path, line_number):
   return path + ":" + str(line_number)
 
@@ -73,6 +141,68 @@ def getRoot(cmd, path):
       return 'src' + path.split(rootPath)[1]
   return ''
 
+SETTINGS_FILE = 'ChromiumXRefs.sublime-settings'
+
+def getSetting(name, default=None):
+  return sublime.load_settings(SETTINGS_FILE).get(name, default)
+
+# With the "prefetch_on_open" setting, the file info and annotations of a
+# Chromium file are fetched in the background when it's opened or brought to
+# the front, so that the first lookup in it doesn't have to wait for them. A
+# file is only fetched once it has stayed in front for
+# PREFETCH_ON_OPEN_DELAY_MS, which skips over files that are flipped through,
+# and at most one file is fetched every PREFETCH_ON_OPEN_MIN_INTERVAL seconds.
+PREFETCH_ON_OPEN_DELAY_MS = 1000
+PREFETCH_ON_OPEN_MIN_INTERVAL = 2
+g_prefetch_on_open_file = None
+g_last_prefetch_on_open = 0
+
+def schedulePrefetchOnOpen(view):
+  global g_prefetch_on_open_file
+  if not getSetting('prefetch_on_open', False) or view.file_name() is None:
+    return
+  abs_file = posixPath(os.path.abspath(os.path.realpath(view.file_name())))
+  g_prefetch_on_open_file = abs_file
+  sublime.set_timeout_async(lambda: prefetchOnOpen(abs_file),
+                            PREFETCH_ON_OPEN_DELAY_MS)
+
+def prefetchOnOpen(abs_file):
+  global g_last_prefetch_on_open
+  if g_prefetch_on_open_file != abs_file:
+    # Another file has been brought to the front since.
+    return
+
+  wait = g_last_prefetch_on_open + PREFETCH_ON_OPEN_MIN_INTERVAL - time.time()
+  if wait > 0:
+    sublime.set_timeout_async(lambda: prefetchOnOpen(abs_file),
+                              int(wait * 1000))
+    return
+
+  root_path = getRoot(None, abs_file)
+  if root_path == '':
+    return
+  src_path = abs_file.split(root_path)[0]
+
+  # Don't throw away the cache of the checkout that lookups are being made in
+  # just because a file from another one was opened.
+  if g_cs is not None and g_cs.source_root != src_path:
+    return
+
+  cs = getCS(src_path)
+  cs_file = cs.file_info_cache.get(root_path)
+  if cs_file is not None and cs_file.HasAnnotations():
+    return
+
+  g_last_prefetch_on_open = time.time()
+
+  def prefetch():
+    try:
+      cs.GetFileInfos([abs_file])
+    except Exception as e:
+      print("Failed to prefetch %s: %s" % (root_path, e))
+
+  getPrefetchExecutor().submit(prefetch)
+
 g_open_callbacks_on_load = {}
 
 class EventListener(sublime_plugin.EventListener):
@@ -82,6 +212,11 @@ class EventListener(sublime_plugin.EventListener):
         if view.file_name() in g_open_callbacks_on_load:
             g_open_callbacks_on_load[view.file_name()]()
             del g_open_callbacks_on_load[view.file_name()]
+        schedulePrefetchOnOpen(view)
+
+    # Called when a view gains focus.
+    def on_activated_async(self, view):
+        schedulePrefetchOnOpen(view)
 
 
 def goToLocation(cmd, src_path, caller, view):
@@ -132,6 +267,30 @@ class CXRefs:
   def __init__(self):
     self.data = {}
     self.in_mojo = False
+    # Incremented to cancel a running prefetch.
+    self.prefetch_generation = 0
+    # Incremented when a new lookup starts. Lookups that have been superseded
+    # stop updating the panel.
+    self.lookup_generation = 0
+    # Protects the panel state below, which is updated from both the UI thread
+    # and the worker thread. The caller tree and the reference windows are
+    # never modified in place, so that each render can work on a snapshot. See
+    # takeSnapshot().
+    self.lock = threading.Lock()
+    self.selected_word = ''
+    self.xrefs = {}
+    self.callers = []
+    self.show_tests = True
+    # What is still being looked up, shown at the top of the panel. None once
+    # the lookup is done.
+    self.loading = None
+    # Rendered pieces of the panel, keyed by (path, show_tests). See
+    # genHtmlImpl(). |html_generation| is incremented whenever pieces are
+    # dropped, so that renders that started before don't put them back.
+    self.html_fragments = {}
+    self.html_generation = 0
+    # Which parts of each reference list are shown. See getRefWindow().
+    self.ref_windows = {}
 
   def getWord(self, view):
     for region in view.sel():
@@ -189,7 +348,8 @@ class CXRefs:
 
     if link_type == 'filter':
       if link.split(':')[1] == 'test':
-        self.show_tests = False;
+        with self.lock:
+          self.show_tests = False;
         doc = self.genHtml();
         self.updatePhantom(self.createPhantom(doc, view), view);
         return;
@@ -199,7 +359,8 @@ class CXRefs:
 
     if link_type == 'nofilter':
       if link.split(':')[1] == 'test':
-        self.show_tests = True;
+        with self.lock:
+          self.show_tests = True;
         doc = self.genHtml()
         self.updatePhantom(self.createPhantom(doc, view), view);
         return;
@@ -211,37 +372,143 @@ class CXRefs:
       self.destroyPhantom(view);
       return;
 
+    if link_type in ('group', 'more', 'moregroups'):
+      parts = link.split(':')
+      index = int(parts[2]) if len(parts) > 2 else None
+      self.updateRefWindow(link_type, parts[1], index)
+      doc = self.genHtml()
+      self.updatePhantom(self.createPhantom(doc, view), view);
+      return;
+
     str_loc = link.split(':')[1]
     loc = [int(x) for x in str_loc.split(',')]
-    cur_callers = callers
-    caller = None
-    for i in loc:
-      caller = cur_callers[i]
-      if 'callers' in caller:
-        cur_callers = caller['callers']
+    caller = self.getCallerAt(callers, loc)
+    if caller is None:
+      return
 
     if (link_type == 'target'):
       goToLocation(self, self.src_path, caller, view);
 
     elif (link_type == 'expand'):
-      caller['callers'] = self.getCallGraphFor(caller['calling_signature'])
-      doc = self.genHtml()
-      self.updatePhantom(self.createPhantom(doc, view), view);
+      # Looking up the callers takes a while. Do it on the worker thread like
+      # displayXRefs() does.
+      generation = self.lookup_generation
+      signature = caller['calling_signature']
+      view.window().status_message("Looking up callers...")
+
+      def expand():
+        expanded = self.getCallGraphFor(signature)
+        if generation != self.lookup_generation:
+          return
+        if not self.updateCallerAt(loc, signature, lambda c: dict(c, callers=expanded)):
+          return
+        self.showXRefs(view, generation)
+        self.startPrefetch(expanded)
+
+      sublime.set_timeout_async(expand, 0)
 
     elif (link_type == 'shrink'):
-      caller.pop('callers')
+      def shrink(caller):
+        caller = dict(caller)
+        caller.pop('callers', None)
+        return caller
+      self.updateCallerAt(loc, caller['calling_signature'], shrink)
       doc = self.genHtml()
       self.updatePhantom(self.createPhantom(doc, view), view);
 
     # DO something
     link = 1
 
-  def genHtmlImpl(self, callers, location):
+  # Returns the caller at |location| in the caller tree |callers|, or None if
+  # there is none.
+  def getCallerAt(self, callers, location):
+    caller = None
+    for i in location:
+      if callers is None or i >= len(callers):
+        return None
+      caller = callers[i]
+      callers = caller.get('callers')
+    return caller
+
+  # Returns a copy of the caller tree |callers| in which the caller at
+  # |location| is replaced by update(caller). Only the lists and callers along
+  # the path are copied.
+  def replaceCallerAt(self, callers, location, update):
+    callers = list(callers)
+    i = location[0]
+    if len(location) == 1:
+      callers[i] = update(callers[i])
+    else:
+      callers[i] = dict(callers[i], callers=self.replaceCallerAt(
+        callers[i]['callers'], location[1:], update))
+    return callers
+
+  # Replaces the caller at |location| in the panel by update(caller), unless
+  # the caller there no longer is the one for |signature|. Returns True if it
+  # was replaced.
+  def updateCallerAt(self, location, signature, update):
+    with self.lock:
+      caller = self.getCallerAt(self.callers, location)
+      if caller is None or caller['calling_signature'] != signature:
+        return False
+      self.callers = self.replaceCallerAt(self.callers, location, update)
+      self.dropFragments(lambda path: path == tuple(location[:len(path)]) or
+                         path[:len(location)] == tuple(location))
+    return True
+
+  # Replaces the panel state given by |state| and forgets all rendered HTML.
+  def resetPanel(self, **state):
+    with self.lock:
+      for name, value in state.items():
+        setattr(self, name, value)
+      self.dropFragments(lambda path: True)
+
+  # Forgets the rendered HTML for the paths that |matches|. Called with |lock|
+  # held.
+  def dropFragments(self, matches):
+    self.html_fragments = dict((key, fragment)
+      for key, fragment in self.html_fragments.items() if not matches(key[0]))
+    self.html_generation += 1
+
+  # Returns the panel state for a render. The render adds what it renders to
+  # its own copy of the rendered HTML and reference windows, which are merged
+  # back by storeSnapshot().
+  def takeSnapshot(self):
+    with self.lock:
+      return {
+        'xrefs': self.xrefs,
+        'callers': self.callers,
+        'show_tests': self.show_tests,
+        'loading': self.loading,
+        'selected_word': self.selected_word,
+        'html_fragments': dict(self.html_fragments),
+        'html_generation': self.html_generation,
+        'ref_windows': dict(self.ref_windows),
+      }
+
+  def storeSnapshot(self, state):
+    with self.lock:
+      if state['html_generation'] != self.html_generation:
+        return
+      self.html_fragments.update(state['html_fragments'])
+      for name, window in state['ref_windows'].items():
+        self.ref_windows.setdefault(name, window)
+
+  # Returns the HTML for |callers|, which is the list of callers at |location|
+  # in the caller tree of |state|. Rendered subtrees are cached until they are
+  # dropped by updateCallerAt() or resetPanel().
+  def genHtmlImpl(self, state, callers, location):
     if not callers:
       return ""
 
+    fragments = state['html_fragments']
+    key = (tuple(location), state['show_tests'])
+    fragment = fragments.get(key)
+    if fragment is not None:
+      return fragment
+
     loc = 0
-    body = "<ul>"
+    body = ["<ul>"]
     for caller in callers:
       full_loc = location + [loc]
       str_loc = ','.join([str(x) for x in full_loc])
@@ -253,17 +520,113 @@ class CXRefs:
       calling_method = caller['display_name'].split('(')[0]
 
       link_target = "<a href=target:%s>%s</a>" % (str_loc, html.escape(calling_method))
-      if self.show_tests or not 'test' in calling_method.lower():
-        body += "<li>%s %s</li>" % (link_expander, link_target)
+      if state['show_tests'] or not 'test' in calling_method.lower():
+        body.append("<li>%s %s</li>" % (link_expander, link_target))
         if 'callers' in caller:
-          body += self.genHtmlImpl(caller['callers'], location + [loc])
+          body.append(self.genHtmlImpl(state, caller['callers'], location + [loc]))
       loc += 1
 
-    body += "</ul>"
-    return body
+    body.append("</ul>")
+    fragment = ''.join(body)
+    fragments[key] = fragment
+    return fragment
+
+  # Splits |refs| into runs of references to the same file.
+  def groupRefsByFile(self, refs):
+    groups = []
+    for ref in refs:
+      if not groups or groups[-1][0]['filename'] != ref['filename']:
+        groups.append([])
+      groups[-1].append(ref)
+    return groups
+
+  # Returns the display state of the reference list |name| in |state|,
+  # creating it if necessary. Groups are collapsed unless the whole list is
+  # small.
+  def getRefWindow(self, state, name, refs):
+    window = state['ref_windows'].get(name)
+    if window is None:
+      window = {
+        'groups': self.groupRefsByFile(refs),
+        # Indices of the groups that are expanded.
+        'expanded': set(),
+        # Number of references shown for an expanded group, by group index.
+        'shown': {},
+        # Number of groups shown.
+        'shown_groups': REFS_GROUPS_PER_PAGE,
+      }
+      if len(refs) <= REFS_EXPANDED_MAX:
+        window['expanded'] = set(range(len(window['groups'])))
+      state['ref_windows'][name] = window
+    return window
+
+  # Returns the HTML for a list of references grouped by file, skipping tests
+  # unless |show_tests| is set. Only the expanded groups list their references,
+  # a page at a time.
+  def genRefsHtml(self, state, name, refs, show_tests):
+    window = self.getRefWindow(state, name, refs)
+    body = []
+    shown_groups = 0
+    for index, group in enumerate(window['groups']):
+      filename = group[0]['filename']
+      if not show_tests and 'test' in filename.lower():
+        continue
+      if shown_groups == window['shown_groups']:
+        body.append("<li><a href=moregroups:%s>[more files]</a></li>" % name)
+        break
+      shown_groups += 1
 
+      expanded = index in window['expanded']
+      expander = "<a id=chromium_x_ref_expander href=group:%s:%d>%s</a>" % (
+        name, index, '-' if expanded else '+')
+      body.append('<li>%s %s (%d)</li>' % (expander, html.escape(filename), len(group)))
+      if not expanded:
+        continue
 
+      shown = window['shown'].get(index, REFS_PER_PAGE)
+      body.append('<ul>')
+      for ref in group[:shown]:
+        body.append("<li><a href=ref:%d:%s>%s</a></li>" % (ref['line'], html.escape(ref['filename']), html.escape(ref['text'])))
+      if len(group) > shown:
+        body.append("<li><a href=more:%s:%d>[%d more]</a></li>" % (name, index, len(group) - shown))
+      body.append('</ul>')
+    return ''.join(body)
+
+  # Like genRefsHtml(), but cached under |name|.
+  def genCachedRefsHtml(self, state, name, refs, show_tests):
+    key = ((name,), show_tests)
+    fragment = state['html_fragments'].get(key)
+    if fragment is None:
+      fragment = self.genRefsHtml(state, name, refs, show_tests)
+      state['html_fragments'][key] = fragment
+    return fragment
+
+  # Handles the links that expand, collapse or page through the reference list
+  # |name|. The window is replaced rather than modified, since renders may be
+  # looking at it.
+  def updateRefWindow(self, link_type, name, index):
+    with self.lock:
+      window = self.ref_windows.get(name)
+      if window is None:
+        return
+      window = dict(window, expanded=set(window['expanded']), shown=dict(window['shown']))
+      if link_type == 'group':
+        window['expanded'] ^= set([index])
+      elif link_type == 'more':
+        window['shown'][index] = window['shown'].get(index, REFS_PER_PAGE) + REFS_PER_PAGE
+      elif link_type == 'moregroups':
+        window['shown_groups'] += REFS_GROUPS_PER_PAGE
+      self.ref_windows[name] = window
+      self.dropFragments(lambda path: path == (name,))
+
+  # Renders the panel from a snapshot of its state. See takeSnapshot().
   def genHtml(self):
+    state = self.takeSnapshot()
+    doc = self.genHtmlFrom(state)
+    self.storeSnapshot(state)
+    return doc
+
+  def genHtmlFrom(self, state):
     body = """
     <body id=chromium_x_refs_body>
     <style>
@@ -299,9 +662,9 @@ class CXRefs:
 
     tab = '&nbsp;' * 4;
     body += "<div class=navbar>";
-    xrefs = self.xrefs;
+    xrefs = state['xrefs'];
 
-    body += '<b> <a href=selected_word>' + self.selected_word + '</a></b>' + tab
+    body += '<b> <a href=selected_word>' + state['selected_word'] + '</a></b>' + tab
     if 'declaration' in xrefs:
       body += '<a href=declared:>Declaration</a>' + tab
     if 'definition' in xrefs:
@@ -312,63 +675,48 @@ class CXRefs:
 
     body += tab;
 
-    if self.show_tests:
+    if state['show_tests']:
       body += '<a id=chromium_x_ref_filter href=filter:test>[-Tests]</a>'
     else:
       body += '<a id=chromium_x_ref_filter href=nofilter:test>[+Tests]</a>'
 
     body += tab
     body += '<a href=killPhantom>[X]</a>'
+    if state['loading']:
+      body += tab + '<i>Loading %s...</i>' % html.escape(state['loading'])
     body += "</div>"
 
     # Add a horizontal line
     body += '<div id=hline>.</div>'
 
-    if self.callers:
-      body += '<p><b>Callers:</b><br>'
-      body += self.genHtmlImpl(self.callers, [])
-      body += '</p>'
+    parts = [body]
+    if state['callers']:
+      parts.append('<p><b>Callers:</b><br>')
+      parts.append(self.genHtmlImpl(state, state['callers'], []))
+      parts.append('</p>')
 
 
     if 'references' in xrefs:
-      body += '<p><b>References:</b><br><ul>'
-
-      last_file = ''
-      for ref in xrefs['references']:
-        if not self.show_tests and 'test' in ref['filename'].lower():
-          continue
-        if ref['filename'] != last_file:
-            if last_file != '':
-              body += '</ul>';
-            body += '<li>' + ref['filename'] + '</li><ul>';
-            last_file = ref['filename'];
-        body += "<li><a href=ref:%d:%s>%s</a></li>" % (ref['line'], html.escape(ref['filename']), html.escape(ref['text']));
-      if last_file:
-        body += '</ul>'
-      body += '</ul></p>'
+      parts.append('<p><b>References:</b><br><ul>')
+      parts.append(self.genCachedRefsHtml(state, 'references', xrefs['references'], state['show_tests']))
+      parts.append('</ul></p>')
 
     if 'overridden' in xrefs:
-      body += '<p><b>Overridden by:</b><br><ul>'
-
-      last_file = ''
-      for ref in xrefs['overridden']:
-        if ref['filename'] != last_file:
-            if last_file != '':
-              body += '</ul>';
-            body += '<li>' + ref['filename'] + '</li><ul>';
-            last_file = ref['filename'];
-        body += "<li><a href=ref:%d:%s>%s</a></li>" % (ref['line'], html.escape(ref['filename']), html.escape(ref['text']));
-      if last_file:
-        body += '</ul>'
-      body += '</ul></p>'
+      parts.append('<p><b>Overridden by:</b><br><ul>')
+      # Overrides are always shown, tests or not.
+      parts.append(self.genCachedRefsHtml(state, 'overridden', xrefs['overridden'], True))
+      parts.append('</ul></p>')
 
-    body += "</body>"
-    return body
+    parts.append("</body>")
+    return ''.join(parts)
 
 
   # Scans the annotations in the file for the closest signature to the current
   # position with matching text.
   def getSignatureForSelection(self, edit, view):
+    # Make way for the new lookup.
+    self.cancelPrefetch()
+
     self.signature = ''
     self.selected_word = self.getWord(view);
     abs_file = posixPath(os.path.abspath(os.path.realpath(view.file_name())))
@@ -385,9 +733,10 @@ class CXRefs:
 
     signature = ''
     file_info = g_cs.GetFileInfo(abs_file)
-    closest_line = 99999999
+    index = file_info.GetAnnotationIndex()
     print("Searching for signature: %s" % self.selected_word)
-    for annotation in file_info.GetAnnotations():
+
+    def getSignature(annotation):
       sig = ''
       if hasattr(annotation, 'xref_signature'):
         sig = annotation.xref_signature.signature
@@ -395,14 +744,20 @@ class CXRefs:
       if hasattr(annotation, 'internal_link'):
         sig = annotation.internal_link.signature
 
-      if not sig:
-        continue
+      if not sig or not file_info.TextContains(annotation.range, self.selected_word):
+        return ''
+      return sig
+
+    # An annotation under the cursor wins. Otherwise take the one closest to
+    # the selected line.
+    for annotation in index.AnnotationsAt(self.selection_line, self.selection_column):
+      signature = getSignature(annotation) or signature
 
-      if self.selected_word in file_info.Text(annotation.range):
-        annotation_line = annotation.range.start_line
-        if abs(annotation_line - self.selection_line) < closest_line or annotation.range.Contains(self.selection_line, self.selection_column):
-          signature = sig
-          closest_line = abs(annotation_line - self.selection_line)
+    if not signature:
+      for annotation in index.AnnotationsNear(self.selection_line):
+        signature = getSignature(annotation)
+        if signature:
+          break
 
     self.signature = signature
     return self.signature != ''
@@ -415,21 +770,22 @@ class CXRefs:
              'line': node.single_match.line_number,
              'text': node.single_match.line_text }
 
-  def getXrefsFor(self, signature):
+  # If |on_progress| is given, it is called with a copy of the cross references
+  # found so far while the response is still being received.
+  def getXrefsFor(self, signature, on_progress=None):
     g_cs = getCS(self.src_path);
 
     results = {'overridden':[], 'references':[]}
+    last_progress = time.time()
 
     node = codesearch.XrefNode.FromSignature(g_cs, signature);
-    refs = node.Traverse([codesearch.KytheXrefKind.DEFINITION,
+    # Matches of other kinds are skipped while the response is being parsed.
+    refs = node.TraverseIncrementally([codesearch.KytheXrefKind.DEFINITION,
       codesearch.KytheXrefKind.DECLARATION,
       codesearch.KytheXrefKind.OVERRIDES,
       codesearch.KytheXrefKind.OVERRIDDEN_BY,
       codesearch.KytheXrefKind.REFERENCE]);
 
-    if not refs:
-      return results
-
     xref_nodes = []
     seen_xrefs = set()
 
@@ -453,6 +809,11 @@ class CXRefs:
         results['references'].append(xref)
         xref_nodes.append(n)
 
+      if on_progress and time.time() - last_progress >= XREFS_PROGRESS_INTERVAL:
+        last_progress = time.time()
+        on_progress(dict(results, overridden=list(results['overridden']),
+                         references=list(results['references'])))
+
     return (results, xref_nodes)
 
   # For a given reference, finds the nearest function annotation to it in the file.
@@ -469,43 +830,20 @@ class CXRefs:
     line = edge.single_match.line_number
     snippet = edge.single_match.line_text
 
-    annotations = csfile.GetAnnotations()
-    closest_line = -1
-    closest_node = None
-    for annotation in annotations:
-      if not annotation.kythe_xref_kind == codesearch.KytheNodeKind.FUNCTION:
-        continue
+    def isDefinedHere(annotation):
       if not hasattr(annotation, 'xref_signature'):
-        continue
-      if '\\.h' in annotation.xref_signature.signature:
-        # We want methods defined in this file, that make the xref
-        continue
-      annotation_line = annotation.range.start_line
-      if annotation_line > closest_line and annotation_line < line:
-        closest_line = annotation_line
-        closest_node = annotation
+        return False
+      # We want methods defined in this file, that make the xref
+      return not '\\.h' in annotation.xref_signature.signature
 
-    return closest_node
+    return csfile.GetAnnotationIndex().ClosestBefore(
+        line, codesearch.KytheNodeKind.FUNCTION, isDefinedHere)
 
   def GetSignaturesForSearchSymbol(self, g_cs, filename, symbol, xref_kind=None):
     print("Processing file: %s" % filename.name)
     file_info = g_cs.GetFileInfo(filename)
-    signatures = set()
-    for annotation in file_info.GetAnnotations():
-      if not hasattr(annotation, 'xref_signature'):
-        continue
-      if not annotation.kythe_xref_kind == codesearch.KytheNodeKind.FUNCTION:
-        continue
-
-      if annotation.xref_signature.signature in signatures:
-        continue
-
-      if not symbol in annotation.xref_signature.signature:
-        continue
-
-      signatures.add(annotation.xref_signature.signature)
-
-    return list(signatures)
+    return file_info.GetSymbolIndex().XrefSignaturesContaining(
+        symbol, codesearch.KytheNodeKind.FUNCTION)
 
 
   def SearchForSymbol(self, g_cs, symbol):
@@ -526,6 +864,10 @@ class CXRefs:
     if not hasattr(search_response, 'search_result'):
       return []
 
+    # Fetch the file info and annotations for all of the results at once.
+    self.prefetchFiles(g_cs, [result.top_file.file for result in
+      search_response.search_result if hasattr(result, 'top_file')])
+
     signatures = []
     for result in search_response.search_result:
 
@@ -537,22 +879,13 @@ class CXRefs:
 
     return signatures
 
-  def GetMojoCaller(self, caller, results, signature):
-      if self.in_mojo:
-        # Prevent infinite recursion. We call getCallGraphFor later in this
-        # call and it can easily wind up back here.
-        return True
-      self.in_mojo = True
-      g_cs = getCS(self.src_path);
-      csfile = g_cs.GetFileInfo(self.src_path+caller.file_path)
-      line = caller.call_site_range.start_line
-
+  # Returns the signature of the method that the client end of the Mojo call
+  # dispatched by |caller| calls, or None if it can't be found.
+  def GetMojoSignature(self, g_cs, caller, signature):
       service_method = signature.split('(')[0].split('::')[-1]
       service_class = caller.display_name.split('::AcceptWithResponder(')[0].split('::')[-1].replace('StubDispatch', '')
       search_term = service_class + '::' + service_method
 
-
-
       print("Mojo caller: %s" % caller)
       print("Signature: %s" % signature)
       print("search term: %s" % search_term)
@@ -561,97 +894,115 @@ class CXRefs:
 
       # We may have multiple symbols, e.g., one for background_sync.mojom.h and one for background_sync.mojom-blink.h
       # Dear god what a hack, let's go with the longer one...
-      longest = 0
-      final_sig = None
-      print("SIg options: ")
       for sig in sigs:
         if not '.mojom-' in sig:
           continue
         if not 'decl' in sig:
           continue
-        final_sig = sig
-        break
-
-      if not final_sig:
-        return False
+        print("Final sig: %s" % sig)
+        return sig
 
-      # Now we have the function that the client end of the mojo call should call
-      # Recurse!
-      print("Final sig: %s" % final_sig)
-      callers = self.getCallGraphFor(final_sig, references=None)
-      for caller in callers:
-        caller['display_name'] = "mojo: " + caller['display_name']
-        caller['calling_method'] = "mojo: " + caller['calling_method']
-        results.append(caller)
+      return None
 
-      self.in_mojo = False
-      return len(callers) > 0
+  # Returns a list with the callers found for each of the Mojo stubs in
+  # |callers|. The list for a stub is empty if its callers couldn't be found.
+  # Returns None if Mojo callers are already being looked up further up the
+  # stack, in which case the stubs should be left out of the results.
+  def GetMojoCallers(self, callers, signature):
+      if self.in_mojo:
+        # Prevent infinite recursion. We call getCallGraphFor later in this
+        # call and it can easily wind up back here.
+        return None
+      results = [[] for caller in callers]
+      if not callers:
+        return results
+      self.in_mojo = True
+      try:
+        g_cs = getCS(self.src_path);
+        final_sigs = mapInParallel(
+          lambda caller: self.GetMojoSignature(g_cs, caller, signature), callers)
+
+        # Now we have the functions that the client ends of the mojo calls
+        # should call. Get all of their callers and references at once, then
+        # recurse!
+        targets = []
+        for final_sig in final_sigs:
+          if final_sig and not final_sig in targets:
+            targets.append(final_sig)
+        children = self.getCallGraphsChildren(g_cs, targets)
+        references = self.getXrefsForSignatures(
+          g_cs, targets, codesearch.KytheXrefKind.REFERENCE)
+
+        target_callers = {}
+        for final_sig in targets:
+          target_callers[final_sig] = self.getCallGraphFor(final_sig,
+            references=references[final_sig], children=children[final_sig])
+
+        for i, final_sig in enumerate(final_sigs):
+          for caller in target_callers.get(final_sig, []):
+            caller = dict(caller)
+            caller['display_name'] = "mojo: " + caller['display_name']
+            caller['calling_method'] = "mojo: " + caller['calling_method']
+            results[i].append(caller)
+      finally:
+        self.in_mojo = False
+      return results
 
-  def GetDoLoopCaller(self, caller, results):
+  # Returns the signature of the state enum constant that the DoLoop |caller|
+  # switches on, or None if there isn't one.
+  def GetDoLoopState(self, caller):
       g_cs = getCS(self.src_path);
       csfile = g_cs.GetFileInfo(self.src_path+caller.file_path)
       line = caller.call_site_range.start_line
 
-      annotations = csfile.GetAnnotations()
-      closest_line = -1
-      closest_enum = None
+      def isStateEnum(annotation):
+        if not hasattr(annotation, 'internal_link'):
+          return False
+        return 'STATE' in annotation.internal_link.signature
+
+      closest_enum = csfile.GetAnnotationIndex().ClosestBefore(
+          line, codesearch.KytheNodeKind.CONSTANT, isStateEnum)
+      if closest_enum is None:
+        return None
+      return closest_enum.internal_link.signature
+
+  # |refs| are the references to the state enum constant of a DoLoop caller
+  # as found by GetDoLoopState(). This is the closest enum constant to the
+  # doloop caller, assume that this is the state enum that gets us here. The
+  # places where the state is set are our callers.
+  def GetDoLoopCaller(self, refs, results):
       found = False
-      for annotation in annotations:
-        if not annotation.kythe_xref_kind == codesearch.KytheNodeKind.CONSTANT:
+
+      for ref in refs:
+        if not ref.single_match.node_type == 'USAGE':
           continue
-        if not hasattr(annotation, 'internal_link'):
+        if 'case' in ref.single_match.line_text:
           continue
-        if not 'STATE' in annotation.internal_link.signature:
+        if '==' in ref.single_match.line_text:
           continue
-        # if not hasattr(annotation, 'xref_signature'):
-        #   continue
-
-        #if '\\.h' in annotation.xref_signature.signature:
-        #  # We want methods defined in this file, that make the xref
-        #  continue
-        annotation_line = annotation.range.start_line
-        if annotation_line > closest_line and annotation_line < line:
-          closest_line = annotation_line
-          closest_enum = annotation
-
-      if closest_line > -1:
-        # This is the closest enum constant to the doloop caller, assume
-        # that this is the state enum that gets us here. Now figure out
-        # where the state is set, that's our caller.
-        node = codesearch.XrefNode.FromSignature(g_cs, closest_enum.internal_link.signature);
-
-        refs = node.Traverse([codesearch.KytheXrefKind.REFERENCE], max_num_results=100);
-
-        for ref in refs:
-          if not ref.single_match.node_type == 'USAGE':
-            continue
-          if 'case' in ref.single_match.line_text:
-            continue
-          if '==' in ref.single_match.line_text:
-            continue
-
-          method = self.getEnclosingMethod(ref)
-          if method is None:
-            continue
-          print(method)
-
-          method_name = method.xref_signature.signature.split("(")[0]
-          method_name = method_name.replace("class-", "")
-          method_name = method_name.replace("cpp:", "")
-          method_name = "doloop: " + method_name
 
-          call = {
-            'filename': ref.filespec.name,
-            'line': ref.single_match.line_number,
-            'col': 0,
-            'calling_signature': method.xref_signature.signature,
-            'text': ref.single_match.line_text,
-            'display_name': method_name,
-            'calling_method': method_name
-          }
+        method = self.getEnclosingMethod(ref)
+        if method is None:
+          continue
+        print(method)
 
-          results.append(call)
-          found = True
+        method_name = method.xref_signature.signature.split("(")[0]
+        method_name = method_name.replace("class-", "")
+        method_name = method_name.replace("cpp:", "")
+        method_name = "doloop: " + method_name
+
+        call = {
+          'filename': ref.filespec.name,
+          'line': ref.single_match.line_number,
+          'col': 0,
+          'calling_signature': method.xref_signature.signature,
+          'text': ref.single_match.line_text,
+          'display_name': method_name,
+          'calling_method': method_name
+        }
+
+        results.append(call)
+        found = True
 
       return found
 
@@ -663,26 +1014,15 @@ class CXRefs:
 
     # Get the signature for the message
     csfile = reference.GetFile()
-    # Replace GetAnnotationsForFile code with csfile.GetAnnotations() once LINK_TO_DEFINITION is in the library
-    response = g_cs.GetAnnotationsForFile(csfile.GetFileSpec(),
-      [codesearch.AnnotationType(id=codesearch.AnnotationTypeValue.LINK_TO_DEFINITION)])
-    if not hasattr(response.annotation_response[0], 'annotation'):
-      return False
-    annotations = response.annotation_response[0].annotation
 
-    closest_line = -1
-    message_ref = None
-    for annotation in annotations:
-      if not annotation.kythe_xref_kind == codesearch.KytheNodeKind.TALIAS:
-        continue
-      if not hasattr(annotation, 'internal_link'):
-        continue
-      annotation_line = annotation.range.start_line
-      if annotation_line > closest_line and annotation_line <= line:
-        closest_line = annotation_line
-        message_ref = annotation
+    def isLinkToDefinition(annotation):
+      return (annotation.type.id == codesearch.AnnotationTypeValue.LINK_TO_DEFINITION and
+              hasattr(annotation, 'internal_link'))
+
+    message_ref = csfile.GetAnnotationIndex().ClosestBefore(
+        line, codesearch.KytheNodeKind.TALIAS, isLinkToDefinition, inclusive=True)
 
-    if closest_line == -1:
+    if message_ref is None:
       return False
 
     found = False
@@ -861,6 +1201,12 @@ class CXRefs:
     file_name = file_info.Path().split('/')[-1]
     file_name = file_name.replace('.cc','').strip()
 
+    # Work on a copy. |range| belongs to a cached annotation or response which
+    # may be in use by other resolver threads.
+    range = codesearch.TextRange(start_line=range.start_line,
+                                 start_column=range.start_column,
+                                 end_line=range.end_line,
+                                 end_column=range.end_column)
     range.end_column = range.start_column + 100
     caller_text = file_info.Text(range).strip()
     if not caller_text:
@@ -873,10 +1219,71 @@ class CXRefs:
     caller_text = caller_text.split('(')[0]
     return file_name + '::' + caller_text
 
-  def getCallGraphFor(self, signature, references=None):
-    g_cs = getCS(self.src_path);
-    results = []
+  # Retrieves the file info and annotations for |files| in a single request.
+  # This is only an optimization, the individual lookups will retry anything
+  # that fails here.
+  def prefetchFiles(self, g_cs, files):
+    if not files:
+      return
+    try:
+      g_cs.GetFileInfos(files)
+    except Exception as e:
+      print("Failed to prefetch files: %s" % e)
+
+  # Starts fetching the files for |callers| and |references| in the
+  # background, followed by the call graphs of the first few |callers|. Cancels
+  # any prefetch that is still running.
+  def startPrefetch(self, callers, references=None):
+    self.prefetch_generation += 1
+    generation = self.prefetch_generation
+
+    files = []
+    for item in (references or []) + callers:
+      path = self.src_path + item['filename']
+      if not path in files:
+        files.append(path)
+    signatures = [caller['calling_signature'] for caller in callers
+                  if 'calling_signature' in caller][:PREFETCH_MAX_CALLERS]
+    getPrefetchExecutor().submit(self.prefetch, generation, self.src_path,
+                                 files, signatures)
+
+  def cancelPrefetch(self):
+    self.prefetch_generation += 1
+
+  def prefetch(self, generation, src_path, files, signatures):
+    deadline = time.time() + PREFETCH_MAX_SECONDS
+    def cancelled():
+      return generation != self.prefetch_generation or time.time() > deadline
+
+    g_cs = getCS()
+    if g_cs is None or g_cs.source_root != src_path:
+      return
+
+    try:
+      budget = PREFETCH_MAX_FILES
+      for signature in [None] + signatures:
+        if signature is not None:
+          # The next level of the call graph. These are the same requests
+          # that getCallGraphFor() makes when the caller is expanded.
+          children = self.getCallGraphChildren(g_cs, signature)
+          if cancelled():
+            return
+          files = self.getCallerFiles(
+            src_path, children, self.getReferencesFor(g_cs, signature))
+
+        files = files[:budget]
+        budget -= len(files)
+        for i in range(0, len(files), PREFETCH_BATCH_SIZE):
+          if cancelled():
+            return
+          self.prefetchFiles(g_cs, files[i:i + PREFETCH_BATCH_SIZE])
+        if budget <= 0 or cancelled():
+          return
+    except Exception as e:
+      print("Prefetch failed: %s" % e)
 
+  # Retrieves the callers of |signature| according to the call graph.
+  def getCallGraphChildren(self, g_cs, signature):
     # TODO: Is it really necessary to make this request? It seems like the
     # references could have the necessary callers (e.g., by calling Traverse).
     response = g_cs.SendRequestToServer(
@@ -886,60 +1293,174 @@ class CXRefs:
         signature=signature)
       ]))
 
-    last_signature = ''
-    calling_ranges = set()
-
     if response.call_graph_response:
       node = response.call_graph_response[0].node
       if hasattr(node, 'children'):
+        return node.children
+    return []
+
+  # Like getCallGraphChildren(), but for each of |signatures| using a single
+  # request. Returns a dict from signature to its callers.
+  def getCallGraphsChildren(self, g_cs, signatures):
+    children = dict((signature, []) for signature in signatures)
+    for signature, response in zip(signatures, g_cs.GetCallGraphs(signatures)):
+      node = getattr(response, 'node', None)
+      if hasattr(node, 'children'):
+        children[signature] = node.children
+    return children
+
+  # Retrieves the cross references of kind |xref_kind| for each of
+  # |signatures| using a single request. Returns a dict from signature to a list
+  # of XrefNodes.
+  def getXrefsForSignatures(self, g_cs, signatures, xref_kind, max_num_results=500):
+    xrefs = dict((signature, []) for signature in signatures)
+    results = g_cs.GetXrefsForSignatures(signatures, max_num_results)
+    for signature, result in zip(signatures, results):
+      nodes = codesearch.XrefNode.FromSearchResults(g_cs, list(result))
+      xrefs[signature] = [node for node in nodes
+                          if node.single_match.type_id == xref_kind]
+    return xrefs
+
+  # Returns the first few references to |signature|, which are also shown as
+  # callers.
+  def getReferencesFor(self, g_cs, signature, references=None):
+    if references is None:
+      # Only the first few references are needed, but the whole response is
+      # retrieved so that it's cached. Stopping a streamed response early
+      # would throw it away, along with the connection it was received on.
+      signature_node = codesearch.XrefNode.FromSignature(g_cs, signature);
+      references = signature_node.Traverse(codesearch.KytheXrefKind.REFERENCE)
+
+    return [reference for reference in references
+      if reference.single_match.type_id == codesearch.KytheXrefKind.REFERENCE][:10]
+
+  # Returns the files that the heuristics in getCallGraphFor() need to look at
+  # for the callers in |children| and |references|.
+  def getCallerFiles(self, src_path, children, references):
+    files = []
+    for caller in children:
+      if not caller.snippet_file_path:
+        continue
+      files.append(src_path + caller.snippet_file_path)
+      if 'DoLoop' in caller.identifier:
+        files.append(src_path + caller.file_path)
+    files.extend([reference.filespec for reference in references if reference.filespec])
+    return files
+
+  # If |on_progress| is given, it is called with the callers found so far
+  # after each of the resolver stages. |references| and |children| are the
+  # references to |signature| and its callers according to the call graph, and
+  # are looked up if not given.
+  def getCallGraphFor(self, signature, references=None, on_progress=None,
+                      children=None):
+    g_cs = getCS(self.src_path);
+    results = []
 
-        for caller in node.children:
-          if caller.signature == last_signature:
-            continue
-          if not caller.snippet_file_path:
-            continue
-
-          last_signature = caller.signature
-
-          handled = False
-          if 'DoLoop' in caller.identifier:
-            handled = self.GetDoLoopCaller(caller, results)
-
-          calling_method = self.getCallingMethodNameFromSignature(caller)
-
-          if not handled and 'Dispatch::AcceptWithResponder' in calling_method:
-            handled = self.GetMojoCaller(caller, results, signature)
+    last_signature = ''
+    calling_ranges = set()
 
-          if not handled:
-            call = { 'filename': caller.file_path,
-                     'line': caller.call_site_range.start_line,
-                     'col': caller.call_site_range.start_column,
-                     'text': caller.snippet.text.text,
-                     'calling_method': caller.identifier,
-                     'calling_signature': caller.signature,
-                     'display_name': calling_method
-                   }
-            calling_ranges.add(getLocationString(caller.file_path, caller.call_site_range.start_line))
-            results.append(call)
+    if children is None:
+      children = self.getCallGraphChildren(g_cs, signature)
 
     # Add x-refs as callers too
-    signature_node = codesearch.XrefNode.FromSignature(g_cs, signature);
-    if references is None:
-      references = signature_node.Traverse()
+    references = self.getReferencesFor(g_cs, signature, references)
 
-    refs_processed = 0
-    for reference in references:
-      if reference.single_match.type_id != codesearch.KytheXrefKind.REFERENCE:
+    # All of the heuristics below need the file info and annotations of the
+    # files containing the callers. Get them all in one go instead of one
+    # request at a time.
+    self.prefetchFiles(g_cs, self.getCallerFiles(self.src_path, children, references))
+
+    callers = []
+    for caller in children:
+      if caller.signature == last_signature:
+        continue
+      if not caller.snippet_file_path:
         continue
-      if refs_processed == 10:
-        break
-      refs_processed += 1
 
+      last_signature = caller.signature
+      callers.append(caller)
+
+    # The references to the states of all DoLoop callers are retrieved in one
+    # request, along with the files containing them.
+    def getDoLoopState(caller):
+      if not 'DoLoop' in caller.identifier:
+        return None
+      return self.GetDoLoopState(caller)
+
+    states = mapInParallel(getDoLoopState, callers)
+    state_signatures = []
+    for state in states:
+      if state and not state in state_signatures:
+        state_signatures.append(state)
+    state_refs = self.getXrefsForSignatures(g_cs, state_signatures,
+      codesearch.KytheXrefKind.REFERENCE, max_num_results=100)
+    self.prefetchFiles(g_cs, [ref.filespec for refs in state_refs.values()
+                              for ref in refs if ref.filespec])
+
+    # The lookups for each caller are independent of each other. Run them
+    # concurrently and then assemble the results in the original order.
+    def resolveCaller(item):
+      (caller, state) = item
+      doloop_results = []
+      handled = False
+      if state:
+        handled = self.GetDoLoopCaller(state_refs[state], doloop_results)
+      return (handled, doloop_results, self.getCallingMethodNameFromSignature(caller))
+
+    resolved = mapInParallel(resolveCaller, list(zip(callers, states)))
+
+    # Mojo callers are looked up together so that the callers of their client
+    # ends can be retrieved in one go.
+    mojo_callers = [caller for caller, (handled, _, calling_method)
+                    in zip(callers, resolved)
+                    if not handled and 'Dispatch::AcceptWithResponder' in calling_method]
+    mojo_callers_found = self.GetMojoCallers(mojo_callers, signature)
+    if mojo_callers_found is None:
+      # We're already inside a Mojo lookup. Leave the stubs out instead of
+      # listing them as callers.
+      mojo_callers_found = [None] * len(mojo_callers)
+    mojo_results = dict(zip([id(caller) for caller in mojo_callers],
+                            mojo_callers_found))
+
+    for caller, (handled, doloop_results, calling_method) in zip(callers, resolved):
+      results.extend(doloop_results)
+
+      if id(caller) in mojo_results:
+        mojo_callers_for_stub = mojo_results[id(caller)]
+        if mojo_callers_for_stub is None:
+          handled = True
+        else:
+          results.extend(mojo_callers_for_stub)
+          handled = len(mojo_callers_for_stub) > 0
+
+      if not handled:
+        call = { 'filename': caller.file_path,
+                 'line': caller.call_site_range.start_line,
+                 'col': caller.call_site_range.start_column,
+                 'text': caller.snippet.text.text,
+                 'calling_method': caller.identifier,
+                 'calling_signature': caller.signature,
+                 'display_name': calling_method
+               }
+        calling_ranges.add(getLocationString(caller.file_path, caller.call_site_range.start_line))
+        results.append(call)
+
+    if on_progress and references:
+      on_progress(list(results))
+
+    def resolveReference(reference):
       method_node = self.getEnclosingMethod(reference)
-      if not method_node is None:
+      if method_node is None:
+        return None
+      closest_sig = method_node.xref_signature.signature
+      return (closest_sig, self.getCallingMethodName(closest_sig, reference.GetFile(), method_node.range))
+
+    resolved = mapInParallel(resolveReference, references)
+
+    for reference, method in zip(references, resolved):
+      if not method is None:
         # This is the closest method to the line that the xref is on
-        closest_sig = method_node.xref_signature.signature
-        method_name = self.getCallingMethodName(closest_sig, reference.GetFile(), method_node.range)
+        (closest_sig, method_name) = method
 
         file_name = reference.GetFile().file_info.name
         range_hash = getLocationString(reference.GetFile().Path(), reference.single_match.line_number)
@@ -980,29 +1501,78 @@ class CXRefs:
       xref_data['panel'] = window.create_output_panel("chromium_x_refs", False);
       xref_data['phantom_set'] = sublime.PhantomSet(xref_data['panel'], "phantoms");
 
+  # Starts a lookup for the selection in |view|. The lookup runs on Sublime's
+  # worker thread so that the UI stays responsive. The panel is updated as
+  # results come in.
   def displayXRefs(self, edit, view):
+    self.lookup_generation += 1
+    generation = self.lookup_generation
+    self.cancelPrefetch()
+    view.window().status_message("Looking up cross references...")
+    sublime.set_timeout_async(lambda: self.displayXRefsAsync(view, generation), 0)
 
-    self.show_tests = True;
+  def displayXRefsAsync(self, view, generation):
+    if generation != self.lookup_generation:
+      return
 
-    if not self.getSignatureForSelection(edit, view):
+    if not self.getSignatureForSelection(None, view):
       self.log("Could not find signature for: " + self.selected_word, view);
       return;
-
-    g_cs = getCS();
-
-    (self.xrefs, xref_nodes) = self.getXrefsFor(self.signature);
-    if not self.xrefs:
+    signature = self.signature
+
+    # Show the references as they arrive, and then the callers as they are
+    # resolved.
+    def showReferences(xrefs, loading):
+      self.resetPanel(show_tests=True, xrefs=xrefs, callers=[], loading=loading,
+                      ref_windows={})
+      self.showXRefs(view, generation)
+
+    def onXrefsProgress(xrefs):
+      if generation == self.lookup_generation:
+        showReferences(xrefs, 'references')
+
+    (xrefs, xref_nodes) = self.getXrefsFor(signature, onXrefsProgress);
+    if generation != self.lookup_generation:
+      return
+    if not xrefs:
       self.log("Could not find xrefs for: " + self.selected_word, view);
       return;
 
-    self.callers = self.getCallGraphFor(self.signature, xref_nodes);
-    doc = self.genHtml();
+    showReferences(xrefs, 'callers')
 
-    window = view.window();
-    self.initWindow(window);
+    def onProgress(callers):
+      if generation != self.lookup_generation:
+        return
+      self.resetPanel(callers=callers, loading='callers of references')
+      self.showXRefs(view, generation)
 
-    self.updatePhantom(self.createPhantom(doc, view), view);
-    window.run_command("show_panel", {"panel": "output.chromium_x_refs"})
+    try:
+      callers = self.getCallGraphFor(signature, xref_nodes, onProgress);
+    except Exception as e:
+      # Keep whatever was found so far rather than leaving the panel loading.
+      self.log("Failed to look up callers: %s" % e, view);
+      callers = self.callers
+    if generation != self.lookup_generation:
+      return
+    self.resetPanel(callers=callers, loading=None)
+    self.showXRefs(view, generation)
+
+    self.startPrefetch(callers, xrefs.get('references', []))
+
+  # Renders the panel on the UI thread, unless the lookup for |generation| has
+  # been superseded by then.
+  def showXRefs(self, view, generation):
+    doc = self.genHtml()
+
+    def show():
+      if generation != self.lookup_generation:
+        return
+      window = view.window();
+      self.initWindow(window);
+      self.updatePhantom(self.createPhantom(doc, view), view);
+      window.run_command("show_panel", {"panel": "output.chromium_x_refs"})
+
+    sublime.set_timeout(show, 0)
 
   def recallXRefs(self, edit, view):
     window = view.window();
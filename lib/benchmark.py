@@ -0,0 +1,460 @@
+# Copyright 2017 Josh Karlin. All rights reserved.
+# Use of this source code is governed by the Apache license found in the LICENSE
+# file.
+
+"""End-to-end benchmarks for cross-reference lookups.
+
+Replays the responses recorded in third_party/codesearch/testdata through a
+local server, optionally adding a fixed latency to each request, and times
+common codesearch library calls as well as the full flow behind the x-refs
+panel with Sublime Text stubbed out.
+
+For each scenario, reports the wall time, the number of requests made, the
+number of response bytes received and the time spent parsing responses. Each
+scenario is run against a fresh CodeSearch instance ("cold") and then again
+against the same instance ("warm").
+
+Results can be saved as a baseline and later runs compared against it:
+
+    python3 lib/benchmark.py --latency-ms 50 --save-baseline /tmp/before.json
+    <make changes>
+    python3 lib/benchmark.py --latency-ms 50 --baseline /tmp/before.json
+
+Requests without a recorded response fail the scenario and leave a .missing
+record behind in a temporary directory, which is printed at the end. Run
+third_party/codesearch/testing_support.py with that directory as argument and
+with network access to record them, then copy the new responses into
+third_party/codesearch/testdata/responses.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The name that Sublime Text imports the plugin under.
+PACKAGE_NAME = 'ChromiumXRefs'
+
+# Source root and file used by the scenarios. Their responses are part of the
+# recorded test data.
+SOURCE_ROOT = '/chrome/'
+SOURCE_FILE = SOURCE_ROOT + 'src/net/http/http_auth.h'
+SYMBOL = 'ChooseBestChallenge'
+
+def installSublimeStubs():
+  """Installs minimal stand-ins for the sublime and sublime_plugin modules,
+  which are only available inside Sublime Text."""
+  sublime = types.ModuleType('sublime')
+  sublime.LAYOUT_INLINE = 0
+  sublime.LAYOUT_BELOW = 1
+  sublime.LAYOUT_BLOCK = 2
+
+  class Region(object):
+    def __init__(self, a, b=None):
+      self.a = a
+      self.b = a if b is None else b
+
+    def empty(self):
+      return self.a == self.b
+
+  class Phantom(object):
+    def __init__(self, region, content, layout, on_navigate=None):
+      self.region = region
+      self.content = content
+      self.layout = layout
+      self.on_navigate = on_navigate
+
+  class PhantomSet(object):
+    def __init__(self, view, key=''):
+      self.view = view
+      self.key = key
+      self.phantoms = []
+
+    def update(self, phantoms):
+      self.phantoms = phantoms
+
+  sublime.Region = Region
+  sublime.Phantom = Phantom
+  sublime.PhantomSet = PhantomSet
+  sublime.set_timeout = lambda callback, delay=0: callback()
+  sublime.set_timeout_async = lambda callback, delay=0: callback()
+  sublime.status_message = lambda message: None
+
+  class Settings(object):
+    def __init__(self):
+      self.values = {}
+
+    def get(self, name, default=None):
+      return self.values.get(name, default)
+
+    def set(self, name, value):
+      self.values[name] = value
+
+  settings = {}
+  sublime.load_settings = lambda name: settings.setdefault(name, Settings())
+
+  sublime_plugin = types.ModuleType('sublime_plugin')
+
+  class EventListener(object):
+    pass
+
+  class TextCommand(object):
+    def __init__(self, view):
+      self.view = view
+
+  class WindowCommand(object):
+    def __init__(self, window):
+      self.window = window
+
+  sublime_plugin.EventListener = EventListener
+  sublime_plugin.TextCommand = TextCommand
+  sublime_plugin.WindowCommand = WindowCommand
+
+  sys.modules.setdefault('sublime', sublime)
+  sys.modules.setdefault('sublime_plugin', sublime_plugin)
+
+def importPlugin():
+  """Imports chromium_x_refs.py the way Sublime Text does, i.e. as a module of
+  the ChromiumXRefs package."""
+  installSublimeStubs()
+  if PACKAGE_NAME not in sys.modules:
+    package = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules[PACKAGE_NAME] = package
+  return importlib.import_module(PACKAGE_NAME + '.chromium_x_refs')
+
+class FakeWindow(object):
+  def id(self):
+    return 1
+
+  def status_message(self, message):
+    pass
+
+  def run_command(self, command, args=None):
+    pass
+
+  def create_output_panel(self, name, unlisted=False):
+    return FakeView(None, '', 0, 0, self)
+
+  def destroy_output_panel(self, name):
+    pass
+
+class FakeView(object):
+  """A view of |path| with the cursor on |word|, which starts at the 0-based
+  |line| and |column|."""
+
+  def __init__(self, path, word, line, column, window=None):
+    self.path = path
+    self.selected_word = word
+    self.line = line
+    self.column = column
+    self.fake_window = window or FakeWindow()
+
+  def file_name(self):
+    return self.path
+
+  def sel(self):
+    sublime = sys.modules['sublime']
+    return [sublime.Region(1)]
+
+  def word(self, region):
+    sublime = sys.modules['sublime']
+    return sublime.Region(1, 1 + len(self.selected_word))
+
+  def rowcol(self, point):
+    return (self.line, self.column)
+
+  def substr(self, region):
+    return self.selected_word
+
+  def window(self):
+    return self.fake_window
+
+class Counters(object):
+  """Accumulates the time spent parsing responses across all threads."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.parse_seconds = 0.0
+
+  def add(self, seconds):
+    with self.lock:
+      self.parse_seconds += seconds
+
+def instrumentParsing(codesearch, counters):
+  """Wraps the entry points that parse response bodies so that the time spent
+  in them is added to |counters|. Lazily decoded fields are converted outside
+  of these and are not counted."""
+  messages = sys.modules[codesearch.__name__ + '.messages']
+  streaming = sys.modules[codesearch.__name__ + '.streaming']
+
+  from_json_string = messages.Message.__dict__['FromJsonString'].__func__
+
+  def FromJsonString(cls, s, lazy=False, compact=False):
+    start = time.perf_counter()
+    try:
+      return from_json_string(cls, s, lazy, compact)
+    finally:
+      counters.add(time.perf_counter() - start)
+
+  feed = streaming.ArrayElementDecoder.Feed
+
+  def Feed(self, text):
+    start = time.perf_counter()
+    try:
+      return feed(self, text)
+    finally:
+      counters.add(time.perf_counter() - start)
+
+  messages.Message.FromJsonString = classmethod(FromJsonString)
+  streaming.ArrayElementDecoder.Feed = Feed
+
+class Benchmark(object):
+  def __init__(self, latency_ms):
+    self.plugin = importPlugin()
+    self.codesearch = self.plugin.codesearch
+    testing_support = sys.modules[self.codesearch.__name__ + '.testing_support']
+    # Laid out like the testdata directory, which is what testing_support.py
+    # expects when it's asked to record the missing responses.
+    self.missing_dir = tempfile.mkdtemp(prefix='cxrefs-benchmark-')
+    os.mkdir(os.path.join(self.missing_dir, 'responses'))
+    self.server = testing_support.RecordedResponseServer(
+        latency_in_seconds=latency_ms / 1000.0,
+        missing_dir=os.path.join(self.missing_dir, 'responses'))
+    self.counters = Counters()
+    instrumentParsing(self.codesearch, self.counters)
+
+    # Every CodeSearch instance, including the one created by the plugin,
+    # talks to the local server.
+    benchmark = self
+    base = self.codesearch.CodeSearch
+
+    class ReplayCodeSearch(base):
+      def __init__(self, **kwargs):
+        kwargs['codesearch_host'] = benchmark.server.Host()
+        base.__init__(self, **kwargs)
+
+    self.codesearch.CodeSearch = ReplayCodeSearch
+
+  def close(self):
+    self.resetPlugin()
+    self.server.Stop()
+    if not self.server.missing:
+      shutil.rmtree(self.missing_dir, ignore_errors=True)
+
+  def newCodeSearch(self, source_root=SOURCE_ROOT):
+    # Same options as the plugin uses. See getCS().
+    return self.codesearch.CodeSearch(
+        should_cache=True, source_root=source_root, connection_pool_size=4,
+        cache_max_staleness_in_seconds=(
+            self.plugin.CACHE_MAX_STALENESS_IN_SECONDS),
+        file_info_cache_max_bytes=self.plugin.FILE_INFO_CACHE_MAX_BYTES,
+        lazy_decoding=self.plugin.getSetting('lazy_decoding', False),
+        compact_messages=self.plugin.getSetting('compact_messages', False))
+
+  def resetPlugin(self):
+    if self.plugin.g_cs is not None:
+      self.plugin.g_cs.TeardownCache()
+      self.plugin.g_cs = None
+
+  # Scenarios. Each takes a CodeSearch instance, or None for the plugin flow,
+  # which creates its own.
+
+  def getFileInfo(self, cs):
+    cs.GetFileInfo(SOURCE_FILE)
+
+  def getAnnotations(self, cs):
+    cs.GetFileInfo(SOURCE_FILE).GetAnnotations()
+
+  def traverse(self, cs):
+    cs_file = cs.GetFileInfo(SOURCE_FILE)
+    block = cs_file.FindCodeBlock(
+        name=SYMBOL, type=self.codesearch.CodeBlockType.FUNCTION)
+    node = self.codesearch.XrefNode.FromSignature(
+        cs, cs_file.GetSignatureForCodeBlock(block))
+    node.Traverse(self.codesearch.KytheXrefKind.REFERENCE)
+    node.Traverse(self.codesearch.KytheXrefKind.CALLED_BY)
+
+  def searchForSymbol(self, cs):
+    cs.SearchForSymbol('URLRequestJob', self.codesearch.NodeEnumKind.CLASS)
+
+  def xrefsReferences(self, cs):
+    """The x-refs panel up to the point where it shows the references, before
+    the callers are resolved."""
+    self.xrefsPanel(cs, callers=False)
+
+  def xrefsPanel(self, cs, callers=True):
+    """The work done by the x-refs panel, minus the Sublime Text bits."""
+    cs = self.newCodeSearch()
+    try:
+      lines = cs.GetFileInfo(SOURCE_FILE).lines
+    finally:
+      cs.TeardownCache()
+    line = [i for i, text in enumerate(lines) if SYMBOL in text][0]
+    view = FakeView(SOURCE_FILE, SYMBOL, line, lines[line].index(SYMBOL))
+
+    cxrefs = self.plugin.CXRefs()
+    if not cxrefs.getSignatureForSelection(None, view):
+      raise RuntimeError('no signature found for ' + SYMBOL)
+    (cxrefs.xrefs, xref_nodes) = cxrefs.getXrefsFor(cxrefs.signature)
+    cxrefs.callers = []
+    if callers:
+      cxrefs.callers = cxrefs.getCallGraphFor(cxrefs.signature, xref_nodes)
+    cxrefs.show_tests = True
+    cxrefs.genHtml()
+
+  def scenarios(self):
+    """Returns a list of (name, scenario, source root) tuples. The source root
+    has to match the one that the responses were recorded with."""
+    return [
+        ('GetFileInfo', self.getFileInfo, SOURCE_ROOT),
+        ('GetAnnotations', self.getAnnotations, SOURCE_ROOT),
+        ('XrefNode.Traverse', self.traverse, SOURCE_ROOT),
+        ('SearchForSymbol', self.searchForSymbol, '.'),
+        ('CXRefs references', self.xrefsReferences, None),
+        ('CXRefs panel', self.xrefsPanel, None),
+    ]
+
+  def measure(self, scenario, cs):
+    """Runs |scenario| once and returns its measurements."""
+    requests = self.server.request_count
+    received = self.server.bytes_served
+    parse_seconds = self.counters.parse_seconds
+    start = time.perf_counter()
+    scenario(cs)
+    return {
+        'wall_ms': (time.perf_counter() - start) * 1000,
+        'parse_ms': (self.counters.parse_seconds - parse_seconds) * 1000,
+        'requests': self.server.request_count - requests,
+        'bytes': self.server.bytes_served - received,
+    }
+
+  def run(self, name, scenario, source_root, iterations):
+    """Returns a dictionary mapping the names of the cold and warm variants of
+    |scenario| to their measurements, or to an error message. |scenario| is
+    passed a CodeSearch instance for |source_root|, or None if |source_root| is
+    None."""
+    runs = {'cold': [], 'warm': []}
+    for _ in range(iterations):
+      self.resetPlugin()
+      cs = None if source_root is None else self.newCodeSearch(source_root)
+      missing = len(self.server.missing)
+      try:
+        runs['cold'].append(self.measure(scenario, cs))
+        runs['warm'].append(self.measure(scenario, cs))
+      except Exception as e:
+        if len(self.server.missing) > missing:
+          error = 'missing recorded responses'
+        else:
+          error = '{}: {}'.format(type(e).__name__, e)
+        return {name + ' (cold)': error, name + ' (warm)': error}
+      finally:
+        if cs is not None:
+          cs.TeardownCache()
+
+    results = {}
+    for variant, measurements in runs.items():
+      # The wall and parse times vary from run to run. The request and byte
+      # counts don't.
+      results['{} ({})'.format(name, variant)] = {
+          'wall_ms': statistics.median(m['wall_ms'] for m in measurements),
+          'parse_ms': statistics.median(m['parse_ms'] for m in measurements),
+          'requests': measurements[-1]['requests'],
+          'bytes': measurements[-1]['bytes'],
+      }
+    return results
+
+def formatDelta(value, baseline):
+  if not baseline:
+    return ''
+  return '{:+.0f}%'.format((value - baseline) * 100.0 / baseline)
+
+def printResults(results, order, baseline=None):
+  columns = ['wall ms', 'parse ms', 'requests', 'bytes']
+  keys = ['wall_ms', 'parse_ms', 'requests', 'bytes']
+  header = '{:<28}'.format('scenario') + ''.join(
+      '{:>12}'.format(c) for c in columns)
+  if baseline:
+    header += ''.join('{:>12}'.format('d ' + c.split()[0]) for c in columns)
+  print(header)
+
+  for name in order:
+    result = results[name]
+    if not isinstance(result, dict):
+      print('{:<28}  {}'.format(name, result))
+      continue
+    line = '{:<28}{:>12.1f}{:>12.1f}{:>12d}{:>12d}'.format(
+        name, *[result[k] for k in keys])
+    previous = (baseline or {}).get(name)
+    if isinstance(previous, dict):
+      line += ''.join(
+          '{:>12}'.format(formatDelta(result[k], previous[k])) for k in keys)
+    print(line)
+
+def main():
+  parser = argparse.ArgumentParser(
+      description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--latency-ms', type=float, default=0,
+                      help='Simulated latency added to each request.')
+  parser.add_argument('--iterations', type=int, default=5,
+                      help='Number of times each scenario is run. The median '
+                      'time is reported.')
+  parser.add_argument('--filter', default='',
+                      help='Only run scenarios whose name contains this.')
+  parser.add_argument('--save-baseline', metavar='FILE',
+                      help='Save the results to FILE.')
+  parser.add_argument('--baseline', metavar='FILE',
+                      help='Compare the results against those saved in FILE.')
+  args = parser.parse_args()
+
+  baseline = None
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if baseline.get('latency_ms') != args.latency_ms:
+      print('Warning: the baseline was recorded with a latency of {} ms'.format(
+          baseline.get('latency_ms')))
+    baseline = baseline['results']
+
+  benchmark = Benchmark(args.latency_ms)
+  results = {}
+  order = []
+  try:
+    for name, scenario, source_root in benchmark.scenarios():
+      if args.filter not in name:
+        continue
+      scenario_results = benchmark.run(name, scenario, source_root,
+                                       args.iterations)
+      order.extend(sorted(scenario_results.keys()))
+      results.update(scenario_results)
+  finally:
+    benchmark.close()
+
+  print('Latency: {} ms per request, {} iterations'.format(
+      args.latency_ms, args.iterations))
+  printResults(results, order, baseline)
+
+  if benchmark.server.missing:
+    print('\n{} requests had no recorded response. To record them, run\n'
+          '  python third_party/codesearch/testing_support.py {}\n'
+          'and copy the .json files from {} into\n'
+          'third_party/codesearch/testdata/responses.'.format(
+              len(benchmark.server.missing), benchmark.missing_dir,
+              os.path.join(benchmark.missing_dir, 'responses')))
+
+  if args.save_baseline:
+    with open(args.save_baseline, 'w') as f:
+      json.dump({'latency_ms': args.latency_ms, 'results': results}, f,
+                indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+  main()
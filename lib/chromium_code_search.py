@@ -5,13 +5,15 @@
 import argparse
 import datetime
 import getopt
+import http.client
 import json
 import sys
 import tempfile
 import threading
 import time
-import urllib.request
+import urllib.error
 import urllib.parse
+import urllib.request
 
 gFileCache = None;
 
@@ -53,6 +55,101 @@ def cacheResponses(should_cache):
     return
   gFileCache = FileCache();
 
+# Keep-alive connections, keyed by (scheme, host). Requests made by this script
+# are sequential and all go to the same host, so one connection per host is
+# enough to avoid a new TCP and TLS handshake for every request.
+gConnections = {}
+
+def getConnection(scheme, host):
+  key = (scheme, host)
+  if not key in gConnections:
+    if scheme == 'https':
+      gConnections[key] = http.client.HTTPSConnection(host, timeout=3)
+    else:
+      gConnections[key] = http.client.HTTPConnection(host, timeout=3)
+  return gConnections[key]
+
+def closeConnection(scheme, host):
+  connection = gConnections.pop((scheme, host), None)
+  if connection:
+    connection.close()
+
+# Redirects are followed like urlopen() does, up to this many times.
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Like urlopen(), follow these with a GET without a body.
+REDIRECT_TO_GET_CODES = (301, 302, 303)
+
+# Errors that mean the server closed an idle keep-alive connection.
+RETRYABLE_ERRORS = (ConnectionResetError, BrokenPipeError,
+                    http.client.RemoteDisconnected, http.client.BadStatusLine)
+
+# True if urlopen() would send requests for |url| through a proxy.
+def usesProxy(url):
+  parsed = urllib.parse.urlparse(url)
+  if not parsed.scheme in urllib.request.getproxies():
+    return False
+  return not urllib.request.proxy_bypass(parsed.hostname)
+
+# Sends a single request on the keep-alive connection for the host of |url|.
+# Returns the response status, reason, headers and body.
+def sendRequestOnce(url, data):
+  parsed = urllib.parse.urlparse(url)
+  path = parsed.path
+  if parsed.query:
+    path += '?' + parsed.query
+  method = 'GET' if data is None else 'POST'
+  headers = {}
+  if data is not None:
+    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+  # A connection that has been idle for a while may have been closed by the
+  # server. In that case try once more with a new connection. Anything else,
+  # including a timeout, is raised right away since the server may already
+  # have seen the request.
+  for attempt in range(2):
+    reused = (parsed.scheme, parsed.netloc) in gConnections
+    connection = getConnection(parsed.scheme, parsed.netloc)
+    try:
+      connection.request(method, path, body=data, headers=headers)
+      response = connection.getresponse()
+      result = response.read()
+    except RETRYABLE_ERRORS:
+      closeConnection(parsed.scheme, parsed.netloc)
+      if not reused or attempt == 1:
+        raise
+      continue
+    except:
+      closeConnection(parsed.scheme, parsed.netloc)
+      raise
+    if response.will_close:
+      closeConnection(parsed.scheme, parsed.netloc)
+    return response.status, response.reason, response.headers, result
+
+def sendRequest(url, data):
+  # The keep-alive connections talk to the server directly. Leave requests that
+  # need to go through a proxy to urlopen().
+  if usesProxy(url):
+    response = urllib.request.urlopen(url, data=data, timeout=3)
+    try:
+      return response.read()
+    finally:
+      response.close()
+
+  for redirect in range(MAX_REDIRECTS + 1):
+    status, reason, headers, result = sendRequestOnce(url, data)
+    location = headers.get('Location')
+    if status in REDIRECT_CODES and location:
+      url = urllib.parse.urljoin(url, location)
+      if status in REDIRECT_TO_GET_CODES:
+        data = None
+      continue
+    if status >= 400:
+      raise urllib.error.HTTPError(url, status, reason, headers, None)
+    return result
+
+  raise urllib.error.HTTPError(url, status, 'too many redirects', headers, None)
+
 # Retrieve the url by first trying to cache and falling back to the network.
 def retrieve(url):
   global gFileCache
@@ -62,19 +159,16 @@ def retrieve(url):
     if (cached_response):
       return cached_response.decode('utf8');
 
-  response = None
-
   try:
     if len(url) > 1500:
       short_url = url.split('?')[0]
       data = url.split('?')[1]
-      response = urllib.request.urlopen(short_url, data=data.encode('utf-8'), timeout=3)
+      result = sendRequest(short_url, data.encode('utf-8'))
     else:
-      response = urllib.request.urlopen(url, timeout=3)
+      result = sendRequest(url, None)
 
-  except error:
+  except (http.client.HTTPException, urllib.error.URLError, OSError):
     return ''
-  result = response.read()
   if gFileCache:
     gFileCache.put(url, result);
   return result.decode('utf8');
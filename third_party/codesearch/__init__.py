@@ -6,10 +6,12 @@
 
 from __future__ import absolute_import
 
+import sys
+
 from .client_api import CodeSearch, XrefNode
 from .messages import Message, AnnotationTypeValue, AnnotationType, \
-        InternalLink, XrefSignature, NodeEnumKind, KytheNodeKind, KytheXrefKind, \
-        Annotation, FileSpec, FormatType, FormatRange, AnnotatedText, \
+        TextRange, InternalLink, XrefSignature, NodeEnumKind, KytheNodeKind, \
+        KytheXrefKind, Annotation, FileSpec, FormatType, FormatRange, AnnotatedText, \
         CodeBlockType, Modifiers, CodeBlock, FileInfo, FileInfoResponse, \
         FileInfoRequest, AnnotationResponse, MatchReason, Snippet, Node, \
         CallGraphResponse, CallGraphRequest, EdgeEnumKind, XrefTypeCount, \
@@ -21,6 +23,10 @@ from .messages import Message, AnnotationTypeValue, AnnotationType, \
         CodeSearchProtoJsonEncoder, CodeSearchProtoJsonSymbolizedEncoder
 from .paths import GetPackageRelativePath, GetSourceRoot, NoSourceRootError
 
+# The asyncio client relies on syntax that is only available on Python 3.5+.
+if sys.version_info >= (3, 5):
+  from .async_client_api import AsyncCodeSearch
+
 # Only useful for testing against this library.
 from .testing_support import DisableNetwork, EnableNetwork, \
         InstallTestRequestHandler
@@ -34,6 +34,16 @@ def print_result(results, args):
     print(json.dumps(results, cls=CodeSearchProtoJsonEncoder))
 
 
+def stream_xrefs(cs, args):
+  """Prints cross references one at a time as they are received."""
+  if args.all or args.type:
+    parser.error('--stream cannot be combined with --all or --type')
+  for filespec, match in cs.GetXrefsIncrementally(
+      get_signature(cs, args), max_num_results=100):
+    print_result({'file': filespec, 'match': match}, args)
+    sys.stdout.flush()
+
+
 def get_signature(cs, args):
   if args.signature:
     return args.signature
@@ -117,17 +127,23 @@ xrefs_command.add_argument(
     '--all', '-A', help='Include all outgoing references', action='store_true')
 xrefs_command.add_argument(
     '--type', '-T', help='Include references of this type', action='append')
-xrefs_command.set_defaults(func=lambda cs, a: cs.SendRequestToServer(
-    CompoundRequest(
-        xref_search_request=[
-            XrefSearchRequest(
-                query=get_signature(cs, a),
-                file_spec=cs.GetFileSpec('.'),
-                edge_filter=get_edge_filter(a),
-                max_num_results=100
-            )
-        ]
-    )))
+xrefs_command.add_argument(
+    '--stream',
+    help='Print each reference as soon as it is received',
+    action='store_true')
+xrefs_command.set_defaults(
+    func=lambda cs, a: stream_xrefs(cs, a) if a.stream else
+    cs.SendRequestToServer(
+        CompoundRequest(
+            xref_search_request=[
+                XrefSearchRequest(
+                    query=get_signature(cs, a),
+                    file_spec=cs.GetFileSpec('.'),
+                    edge_filter=get_edge_filter(a),
+                    max_num_results=100
+                )
+            ]
+        )))
 
 # callers
 callers_command = subcommands.add_parser(
@@ -258,7 +274,9 @@ try:
       a_path_inside_source_dir=os.getcwd(),
       cache_dir=arguments.cache if arguments.cache else None)
   setup_logging(codesearch_instance, arguments)
-  print_result(arguments.func(codesearch_instance, arguments), arguments)
+  result = arguments.func(codesearch_instance, arguments)
+  if result is not None:
+    print_result(result, arguments)
 except Exception as e:
   print e
 finally:
@@ -0,0 +1,196 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""Positional lookups over the annotations of a file.
+
+Annotation lists for large files run into tens of thousands of entries.
+Finding the annotation under the cursor, or the function that encloses a
+reference, by scanning the whole list is fine once. It isn't when it's done for
+every reference in an xref panel.
+
+AnnotationIndex sorts the annotations by starting line once, and answers these
+queries using binary search. Annotations are also grouped by
+|kythe_xref_kind| so that a query for the closest FUNCTION doesn't have to
+step over the thousands of USAGE annotations between it and the reference.
+Annotations that span several lines are kept in an interval tree so that
+finding the ones that cover a line doesn't depend on how many start before it.
+
+Where several annotations satisfy a query equally well, the one that comes
+first in the original list wins. This matches the behavior of a linear scan.
+"""
+
+import bisect
+
+
+class _IntervalTree(object):
+  """A centered interval tree over (start_line, end_line, position) tuples."""
+
+  def __init__(self, intervals):
+    self.root = _IntervalTree._Build(intervals)
+
+  @staticmethod
+  def _Build(intervals):
+    """Returns a (center, by_start, by_end, left, right) tuple for |intervals|
+    or None if there are none.
+
+    |by_start| and |by_end| hold the intervals that contain |center|, sorted by
+    ascending start line and by descending end line respectively. |left| and
+    |right| are the subtrees for the intervals that end before and start after
+    |center|.
+    """
+    if not intervals:
+      return None
+    endpoints = sorted([i[0] for i in intervals] + [i[1] for i in intervals])
+    center = endpoints[len(endpoints) // 2]
+    left = [i for i in intervals if i[1] < center]
+    right = [i for i in intervals if i[0] > center]
+    here = [i for i in intervals if i[0] <= center <= i[1]]
+    return (center, sorted(here), sorted(here, key=lambda i: -i[1]),
+            _IntervalTree._Build(left), _IntervalTree._Build(right))
+
+  def Covering(self, line):
+    """Yields the positions of the intervals that contain |line|, in no
+    particular order."""
+    node = self.root
+    while node is not None:
+      center, by_start, by_end, left, right = node
+      if line < center:
+        for start_line, _, position in by_start:
+          if start_line > line:
+            break
+          yield position
+        node = left
+      elif line > center:
+        for _, end_line, position in by_end:
+          if end_line < line:
+            break
+          yield position
+        node = right
+      else:
+        for _, _, position in by_start:
+          yield position
+        node = None
+
+
+class AnnotationIndex(object):
+  """An index over |annotations|, which is a list of Annotation objects.
+
+  Annotations without a valid range are not indexed. The list must not be
+  modified while the index is in use.
+  """
+
+  def __init__(self, annotations):
+    self.annotations = annotations
+
+    # Sorted list of (start_line, position) tuples for all annotations, where
+    # |position| is the index of the annotation in |annotations|.
+    self.by_line = []
+
+    # Same as |by_line|, but keyed by |kythe_xref_kind|.
+    self.by_kind = {}
+
+    # (start_line, end_line, position) tuples for annotations that span more
+    # than one line.
+    multiline = []
+
+    for position, annotation in enumerate(annotations):
+      if not hasattr(annotation, 'range') or not annotation.range.IsValid():
+        continue
+      entry = (annotation.range.start_line, position)
+      self.by_line.append(entry)
+      self.by_kind.setdefault(getattr(annotation, 'kythe_xref_kind', None),
+                              []).append(entry)
+      if annotation.range.end_line > annotation.range.start_line:
+        multiline.append((annotation.range.start_line,
+                          annotation.range.end_line, position))
+
+    # enumerate() yields positions in ascending order, so sorting on the tuples
+    # keeps annotations that start on the same line in their original order.
+    self.by_line.sort()
+    for entries in self.by_kind.values():
+      entries.sort()
+
+    # Interval tree over the annotations that span more than one line.
+    self.multiline = _IntervalTree(multiline)
+
+  def AnnotationsAt(self, line, column):
+    """Returns the list of annotations whose range contains |line| and
+    |column|, in their original order."""
+    positions = []
+
+    lo = bisect.bisect_left(self.by_line, (line, -1))
+    hi = bisect.bisect_left(self.by_line, (line + 1, -1))
+    for _, position in self.by_line[lo:hi]:
+      if self.annotations[position].range.Contains(line, column):
+        positions.append(position)
+
+    # Annotations that started on an earlier line.
+    for position in self.multiline.Covering(line):
+      annotation = self.annotations[position]
+      if annotation.range.start_line < line and \
+          annotation.range.Contains(line, column):
+        positions.append(position)
+
+    return [self.annotations[position] for position in sorted(positions)]
+
+  def ClosestBefore(self, line, kythe_xref_kind=None, predicate=None,
+                    inclusive=False):
+    """Returns the annotation that starts on the line closest to, but before,
+    |line|. Returns None if there is no such annotation.
+
+    If |inclusive| is True, annotations starting on |line| are also
+    considered. Only annotations of kind |kythe_xref_kind| are considered
+    unless it is None. If |predicate| is not None, only annotations for which
+    it returns True are considered.
+    """
+    if kythe_xref_kind is None:
+      entries = self.by_line
+    else:
+      entries = self.by_kind.get(kythe_xref_kind, [])
+
+    i = bisect.bisect_left(entries, (line + 1 if inclusive else line, -1))
+    found = None
+    while i > 0:
+      i -= 1
+      start_line, position = entries[i]
+      if found is not None and start_line != found[0]:
+        break
+      annotation = self.annotations[position]
+      if predicate is None or predicate(annotation):
+        # Keep going in case an earlier annotation starts on the same line.
+        found = (start_line, annotation)
+    return found[1] if found is not None else None
+
+  def AnnotationsNear(self, line):
+    """Yields annotations in order of increasing distance between their first
+    line and |line|.
+
+    Annotations at the same distance, whether they start before or after
+    |line|, are yielded in their original order.
+    """
+    before = bisect.bisect_left(self.by_line, (line, -1))
+    after = before
+    while before > 0 or after < len(self.by_line):
+      distance = None
+      if before > 0:
+        distance = line - self.by_line[before - 1][0]
+      if after < len(self.by_line):
+        after_distance = self.by_line[after][0] - line
+        if distance is None or after_distance < distance:
+          distance = after_distance
+
+      positions = []
+      if before > 0 and line - self.by_line[before - 1][0] == distance:
+        lo = bisect.bisect_left(self.by_line, (line - distance, -1), 0, before)
+        positions.extend(position for _, position in self.by_line[lo:before])
+        before = lo
+      if after < len(self.by_line) and \
+          self.by_line[after][0] - line == distance:
+        hi = bisect.bisect_left(self.by_line, (line + distance + 1, -1), after)
+        positions.extend(position for _, position in self.by_line[after:hi])
+        after = hi
+
+      for position in sorted(positions):
+        yield self.annotations[position]
@@ -0,0 +1,517 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""An asyncio based client for the CodeSearch backend.
+
+AsyncCodeSearch exposes awaitable versions of the commonly used CodeSearch
+methods. Requests are made over non-blocking connections on the running event
+loop so that a single thread can drive many concurrent lookups. The number of
+requests that are in flight at any given time is bounded by
+|max_concurrency|.
+
+AsyncCodeSearch wraps a regular CodeSearch object and shares its FileCache,
+|file_info_cache| and |stats|. Hence results obtained via one are available to
+the other.
+
+AsyncConnectionPool connects to the server directly. If a proxy is configured
+for the CodeSearch host, requests are instead made using urlopen() on worker
+threads of the event loop's default executor.
+
+Requires Python 3.5 or later.
+"""
+
+import asyncio
+import time
+
+from .cache_key import RequestCacheKey
+from .client_api import CodeSearch, XrefNode
+from .connection_pool import DEFAULT_CHUNK_SIZE, MAX_REDIRECTS, \
+        REDIRECT_CODES, REDIRECT_TO_GET_CODES, UsesProxy
+from .messages import AnnotationRequest, CallGraphRequest, CompoundRequest, \
+        CompoundResponse, FileInfoRequest, KytheXrefKind, XrefSearchRequest
+
+from urllib.error import HTTPError
+from urllib.parse import urljoin, urlparse
+
+
+class AsyncConnectionPool(object):
+  """The asyncio counterpart of ConnectionPool.
+
+  Keeps up to |pool_size| idle keep-alive connections per host and event loop.
+  Connections idle for longer than |idle_timeout_in_seconds| are discarded. If
+  a reused connection turns out to have been closed by the server, the request
+  is retried once on a new connection.
+
+  Like the socket timeout used by ConnectionPool, |timeout_in_seconds| applies
+  to each read and write on a connection rather than the whole exchange. A
+  large response that keeps arriving doesn't time out.
+
+  Like ConnectionPool, AsyncConnectionPool doesn't support proxies.
+  """
+
+  def __init__(self,
+               pool_size=4,
+               idle_timeout_in_seconds=60,
+               timeout_in_seconds=3):
+    self.pool_size = pool_size
+    self.idle_timeout_in_seconds = idle_timeout_in_seconds
+    self.timeout_in_seconds = timeout_in_seconds
+
+    # Map from (event loop, scheme, host, port) to a list of
+    # (reader, writer, last_used) tuples.
+    self.idle = {}
+
+    self.connections_created = 0
+
+  async def Open(self, url, data=None, headers={}):
+    """Send a request for |url| and return the response body as bytes.
+
+    The request is a POST if |data| is not None, and a GET otherwise. Throws
+    an HTTPError if the server responds with an error status.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+      status, reason, response_headers, body = await self._Send(
+          url, data, headers)
+      location = response_headers.get('location')
+      if status in REDIRECT_CODES and location:
+        url = urljoin(url, location)
+        if status in REDIRECT_TO_GET_CODES:
+          data = None
+        continue
+
+      if status >= 400:
+        raise HTTPError(url, status, reason, response_headers, None)
+      return body
+
+    raise HTTPError(url, status, 'too many redirects', response_headers, None)
+
+  def close(self):
+    """Close all idle connections."""
+    idle = self.idle
+    self.idle = {}
+    for key, connections in idle.items():
+      # Connections belonging to an event loop that has since been closed
+      # can't be closed cleanly. Their transports went away with the loop.
+      if key[0].is_closed():
+        continue
+      for _, writer, _ in connections:
+        writer.close()
+
+  async def _Send(self, url, data, headers):
+    parsed = urlparse(url)
+    key = (asyncio.get_event_loop(), parsed.scheme, parsed.hostname,
+           parsed.port)
+    path = parsed.path or '/'
+    if parsed.query:
+      path = '{}?{}'.format(path, parsed.query)
+
+    request = self._FormatRequest(parsed, path, data, headers)
+
+    connection, reused = self._Acquire(key)
+    if connection is None:
+      connection = await self._Connect(key)
+
+    try:
+      try:
+        response = await self._Exchange(connection, request)
+      except (ConnectionError, asyncio.IncompleteReadError):
+        connection[1].close()
+        if not reused:
+          raise
+        # The server closed an idle connection. Try once more on a new
+        # connection.
+        connection = await self._Connect(key)
+        response = await self._Exchange(connection, request)
+    except:
+      connection[1].close()
+      raise
+
+    status, reason, response_headers, body, will_close = response
+    if will_close:
+      connection[1].close()
+    else:
+      self._Release(key, connection)
+    return status, reason, response_headers, body
+
+  def _FormatRequest(self, parsed, path, data, headers):
+    host = parsed.hostname
+    if parsed.port:
+      host = '{}:{}'.format(host, parsed.port)
+
+    lines = [
+        '{} {} HTTP/1.1'.format('GET' if data is None else 'POST', path),
+        'Host: {}'.format(host),
+        'Accept-Encoding: identity',
+    ]
+    for k, v in headers.items():
+      lines.append('{}: {}'.format(k, v))
+    if data is not None:
+      lines.append('Content-Type: application/x-www-form-urlencoded')
+      lines.append('Content-Length: {}'.format(len(data)))
+    request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+    if data is not None:
+      request += data
+    return request
+
+  def _Wait(self, awaitable):
+    return asyncio.wait_for(awaitable, self.timeout_in_seconds)
+
+  async def _ReadExactly(self, reader, size):
+    chunks = []
+    while size > 0:
+      chunk = await self._Wait(reader.read(min(size, DEFAULT_CHUNK_SIZE)))
+      if not chunk:
+        raise asyncio.IncompleteReadError(b''.join(chunks), size)
+      chunks.append(chunk)
+      size -= len(chunk)
+    return b''.join(chunks)
+
+  async def _Exchange(self, connection, request):
+    reader, writer = connection
+    writer.write(request)
+    await self._Wait(writer.drain())
+
+    status_line = await self._Wait(reader.readline())
+    if not status_line:
+      raise ConnectionResetError('connection closed by server')
+    version, status, reason = (status_line.decode('latin-1').rstrip('\r\n') +
+                               '  ').split(' ', 2)
+    status = int(status)
+
+    response_headers = {}
+    while True:
+      line = await self._Wait(reader.readline())
+      if line in (b'\r\n', b'\n', b''):
+        break
+      k, _, v = line.decode('latin-1').partition(':')
+      response_headers[k.strip().lower()] = v.strip()
+
+    will_close = version == 'HTTP/1.0' or response_headers.get(
+        'connection', '').lower() == 'close'
+
+    if 'chunked' in response_headers.get('transfer-encoding', '').lower():
+      chunks = []
+      while True:
+        line = await self._Wait(reader.readline())
+        size = int(line.split(b';')[0].strip(), 16)
+        if size == 0:
+          # Skip trailers.
+          while line not in (b'\r\n', b'\n', b''):
+            line = await self._Wait(reader.readline())
+          break
+        chunks.append(await self._ReadExactly(reader, size))
+        await self._Wait(reader.readline())
+      body = b''.join(chunks)
+    elif 'content-length' in response_headers:
+      body = await self._ReadExactly(reader,
+                                     int(response_headers['content-length']))
+    else:
+      chunks = []
+      while True:
+        chunk = await self._Wait(reader.read(DEFAULT_CHUNK_SIZE))
+        if not chunk:
+          break
+        chunks.append(chunk)
+      body = b''.join(chunks)
+      will_close = True
+
+    return (status, reason.strip(), response_headers, body, will_close)
+
+  def _Acquire(self, key):
+    now = time.time()
+    connections = self.idle.get(key, [])
+    while connections:
+      reader, writer, last_used = connections.pop()
+      if now - last_used > self.idle_timeout_in_seconds or reader.at_eof():
+        writer.close()
+        continue
+      return (reader, writer), True
+    return None, False
+
+  def _Release(self, key, connection):
+    connections = self.idle.setdefault(key, [])
+    if len(connections) < self.pool_size:
+      connections.append(connection + (time.time(),))
+      return
+    connection[1].close()
+
+  async def _Connect(self, key):
+    _, scheme, host, port = key
+    if port is None:
+      port = 443 if scheme == 'https' else 80
+    self.connections_created += 1
+    return await asyncio.wait_for(
+        asyncio.open_connection(host, port, ssl=(scheme == 'https') or None),
+        self.timeout_in_seconds)
+
+
+class AsyncCodeSearch(object):
+  """Awaitable interface to the CodeSearch backend.
+
+  E.g.:
+  >>> acs = AsyncCodeSearch(source_root='.')
+  >>> cs_file = await acs.GetFileInfo('src/net/http/http_auth.h')
+  >>> annotations = await acs.GetAnnotations(cs_file)
+
+  Objects returned by AsyncCodeSearch (CsFile, XrefNode etc.) are the same
+  types returned by CodeSearch. They are bound to the wrapped CodeSearch object
+  which is available as |cs|. Calling their blocking methods will work, but
+  will only avoid the network if the required data has already been retrieved
+  via AsyncCodeSearch.
+  """
+
+  def __init__(self, cs=None, max_concurrency=32, pool_size=8, **kwargs):
+    """Construct an AsyncCodeSearch object.
+
+    Arguments:
+        cs -- The CodeSearch object to wrap. If None, a new CodeSearch object is
+            constructed using |kwargs|. See CodeSearch.__init__() for the
+            supported arguments.
+
+        max_concurrency -- Maximum number of requests that will be in flight at
+            any given time. Additional requests wait for a slot.
+
+        pool_size -- Number of idle keep-alive connections to retain.
+    """
+    if cs is None:
+      cs = CodeSearch(**kwargs)
+    assert isinstance(cs, CodeSearch)
+
+    self.cs = cs
+    self.max_concurrency = max_concurrency
+
+    # None if requests need to go through a proxy.
+    self.connection_pool = None
+    if not UsesProxy(cs.codesearch_host):
+      self.connection_pool = AsyncConnectionPool(
+          pool_size=pool_size,
+          idle_timeout_in_seconds=60,
+          timeout_in_seconds=cs.request_timeout_in_seconds)
+
+    # Map from event loop to the semaphore that limits concurrency on that
+    # loop.
+    self.semaphores = {}
+
+    # Map from (event loop, URL) to a future for each request that is currently
+    # in flight.
+    self.in_flight = {}
+
+  def close(self):
+    if self.connection_pool:
+      self.connection_pool.close()
+
+  def _Semaphore(self):
+    loop = asyncio.get_event_loop()
+    if loop not in self.semaphores:
+      self.semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+    return self.semaphores[loop]
+
+  async def _Retrieve(self, url, cache_key=None):
+    """Retrieve the URL, optionally using the cache of the wrapped CodeSearch
+    object. See CodeSearch._Retrieve() for a description of |cache_key|."""
+    self.cs.logger.debug('Fetching %s', url)
+
+    if cache_key is None:
+      cache_key = RequestCacheKey(url)
+
+    cached_response, is_stale = self.cs._GetCachedResponse(cache_key)
+    if cached_response:
+      if is_stale:
+        cache_key.served_stale = True
+        self._RefreshInBackground(url, cache_key)
+      return cached_response
+
+    return await asyncio.shield(self._FetchOnce(url, cache_key))
+
+  def _FetchOnce(self, url, cache_key):
+    """Returns a future for the response to |url|. Concurrent requests for the
+    same URL on the current event loop share a single future."""
+    key = (asyncio.get_event_loop(), url)
+    if key in self.in_flight:
+      self.cs.stats.coalesced_requests += 1
+      return self.in_flight[key]
+
+    self.cs.stats.cache_misses += 1
+    future = asyncio.ensure_future(self._Fetch(url, cache_key))
+    self.in_flight[key] = future
+    future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+    return future
+
+  def _RefreshInBackground(self, url, cache_key):
+    """Fetch |url| without waiting for it unless it is already in flight."""
+    if (asyncio.get_event_loop(), url) in self.in_flight:
+      return
+    self.cs.stats.background_refreshes += 1
+
+    def LogError(future):
+      if not future.cancelled() and future.exception() is not None:
+        self.cs.logger.debug('Background refresh of %s failed: %s', url,
+                             future.exception())
+
+    self._FetchOnce(url, cache_key).add_done_callback(LogError)
+
+  async def _Fetch(self, url, cache_key):
+    if self.connection_pool is None:
+      # CodeSearch._Fetch() uses urlopen(), which knows how to use the proxy.
+      async with self._Semaphore():
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.cs._Fetch, url, cache_key)
+
+    request_url, data = CodeSearch._SplitLongUrl(url)
+    async with self._Semaphore():
+      result = await self.connection_pool.Open(
+          request_url, data=data, headers=self.cs.extra_headers)
+
+    return self.cs._CacheResponse(cache_key, result)
+
+  async def SendRequestToServer(self, compound_request):
+    url = self.cs._UrlForRequest(compound_request)
+    cache_key = RequestCacheKey.ForRequest(compound_request,
+                                           self.cs.codesearch_host)
+    response = self.cs._GetDecodedResponse(cache_key)
+    if response is not None:
+      return response
+    result = await self._Retrieve(url, cache_key)
+    response = CompoundResponse.FromJsonString(result, self.cs.lazy_decoding,
+                                               self.cs.compact_messages)
+    self.cs._CacheDecodedResponse(cache_key, response, len(result))
+    return response
+
+  async def GetFileInfo(self, filename):
+    """Return a CsFile object corresponding to the file named by |filename|.
+
+    See CodeSearch.GetFileInfo(). Only the default set of fields are
+    retrieved."""
+    file_spec = self.cs.GetFileSpec(filename)
+    cs_file = self.cs.file_info_cache.get(file_spec.name)
+    if cs_file is not None:
+      return cs_file
+
+    result = await self.SendRequestToServer(
+        CompoundRequest(file_info_request=[
+            FileInfoRequest(
+                file_spec=file_spec,
+                fetch_html_content=False,
+                fetch_outline=True,
+                fetch_folding=False,
+                fetch_generated_from=False)
+        ]))
+
+    file_info = self.cs._CsFileFromResponse(result.file_info_response[0],
+                                            filename)
+    self.cs.file_info_cache.put(file_spec.name, file_info)
+    return file_info
+
+  async def GetAnnotationsForFile(
+      self, filename, annotation_types=CodeSearch.DEFAULT_ANNOTATION_TYPES):
+    return await self.SendRequestToServer(
+        CompoundRequest(annotation_request=[
+            AnnotationRequest(
+                file_spec=self.cs.GetFileSpec(filename), type=annotation_types)
+        ]))
+
+  async def GetAnnotations(self, cs_file):
+    """Awaitable version of CsFile.GetAnnotations()."""
+    if not cs_file.HasAnnotations():
+      response = await self.GetAnnotationsForFile(cs_file.GetFileSpec())
+      cs_file.SetAnnotationsFromResponse(response.annotation_response[0])
+    return cs_file.annotations
+
+  async def _GetFileAndAnnotations(self, filename):
+    cs_file = await self.GetFileInfo(filename)
+    await self.GetAnnotations(cs_file)
+    return cs_file
+
+  async def GetXrefsFor(self, signature, max_num_results=500):
+    refs = await self.SendRequestToServer(
+        CompoundRequest(xref_search_request=[
+            XrefSearchRequest(
+                file_spec=self.cs.GetFileSpec(),
+                query=signature,
+                max_num_results=max_num_results)
+        ]))
+    if not refs or not hasattr(refs.xref_search_response[0], 'search_result'):
+      return []
+    return refs.xref_search_response[0].search_result
+
+  async def GetCallGraph(self, signature, max_num_results=500):
+    return await self.SendRequestToServer(
+        CompoundRequest(call_graph_request=[
+            CallGraphRequest(
+                file_spec=self.cs.GetFileSpec(),
+                max_num_results=max_num_results,
+                signature=signature)
+        ]))
+
+  async def SearchForSymbol(self,
+                            symbol,
+                            xref_kind=None,
+                            max_results_to_analyze=5,
+                            return_all_results=False):
+    """Awaitable version of CodeSearch.SearchForSymbol().
+
+    Resolving the signatures for a search result requires the FileInfo and
+    annotations of the matching file. These are retrieved before resolving the
+    result so that the resolution doesn't need to touch the network. Errors
+    encountered while retrieving them are propagated.
+
+    As with CodeSearch.SearchForSymbol(), results are resolved in order and
+    only up to the first one that yields a signature unless
+    |return_all_results| is True. In the latter case the files for all results
+    are retrieved concurrently.
+    """
+    search_response = (await self.SendRequestToServer(
+        self.cs._SearchRequestForSymbol(
+            symbol, xref_kind, max_results_to_analyze))).search_response[0]
+
+    results = [
+        r for r in getattr(search_response, 'search_result', [])
+        if hasattr(r, 'top_file') and hasattr(r, 'snippet')
+    ]
+
+    if return_all_results:
+      await asyncio.gather(
+          *[self._GetFileAndAnnotations(r.top_file.file.name) for r in results])
+
+    signatures = set()
+    for result in results:
+      if not return_all_results:
+        await self._GetFileAndAnnotations(result.top_file.file.name)
+      signatures.update(self.cs._SignaturesFromSearchResult(result, symbol))
+      if not return_all_results and len(signatures) > 0:
+        break
+
+    return [XrefNode.FromSignature(self.cs, signature=s) for s in signatures]
+
+  async def Traverse(self, node, xref_kinds=None, max_num_results=500):
+    """Awaitable version of XrefNode.Traverse() for |node|."""
+    assert isinstance(node, XrefNode)
+
+    signature = node.single_match.signature
+    xrset = None if xref_kinds is None else XrefNode._XrefKindSet(xref_kinds)
+
+    if xrset is not None and KytheXrefKind.CALLED_BY in xrset:
+      results, cg_response = await asyncio.gather(
+          self.GetXrefsFor(signature, max_num_results),
+          self.GetCallGraph(signature, max_num_results))
+    else:
+      results = await self.GetXrefsFor(signature, max_num_results)
+      cg_response = None
+
+    if not results:
+      return []
+
+    results = XrefNode.FromSearchResults(self.cs, results, node)
+    if xrset is None:
+      return results
+
+    cg = []
+    if cg_response is not None:
+      cg.extend([
+          XrefNode.FromNode(self.cs, n)
+          for n in node._CallGraphNodeFromResponse(cg_response).children
+      ])
+
+    return XrefNode._FilterByXrefKind(results, xrset) + cg
@@ -0,0 +1,208 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""Tests for async_client_api.py.
+
+These use syntax that is only available on Python 3.5+. They are loaded by
+test_async_client_api.py on versions that support them, and the name of this
+file keeps test discovery from importing it elsewhere.
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from .async_client_api import AsyncCodeSearch, AsyncConnectionPool
+from .client_api import CodeSearch, CsFile, XrefNode
+from .messages import Annotation, CodeBlockType, CompoundResponse, \
+        KytheXrefKind, NodeEnumKind
+from .testing_support import RecordedResponseServer
+
+SOURCE_ROOT = '/src/chrome/'
+
+
+def Run(acs, coroutine):
+  """Runs |coroutine| to completion on a new event loop. Pooled connections of
+  |acs| are closed before the loop goes away."""
+
+  async def RunAndClose():
+    try:
+      return await coroutine
+    finally:
+      acs.close()
+
+  loop = asyncio.new_event_loop()
+  try:
+    return loop.run_until_complete(RunAndClose())
+  finally:
+    loop.close()
+
+
+class TestAsyncCodeSearch(unittest.TestCase):
+
+  def setUp(self):
+    # Keep records of unknown requests out of the source tree.
+    self.missing_dir = tempfile.mkdtemp()
+    self.server = RecordedResponseServer(missing_dir=self.missing_dir)
+
+  def tearDown(self):
+    self.server.Stop()
+    shutil.rmtree(self.missing_dir)
+
+  def CodeSearch(self, source_root=SOURCE_ROOT, **kwargs):
+    return AsyncCodeSearch(
+        source_root=source_root, codesearch_host=self.server.Host(), **kwargs)
+
+  def test_get_file_info(self):
+    acs = self.CodeSearch()
+
+    async def Test():
+      cs_file = await acs.GetFileInfo('/src/chrome/src/net/http/http_auth.h')
+      annotations = await acs.GetAnnotations(cs_file)
+      return cs_file, annotations
+
+    cs_file, annotations = Run(acs, Test())
+
+    self.assertIsInstance(cs_file, CsFile)
+    self.assertEqual('src/net/http/http_auth.h', cs_file.Path())
+    self.assertNotEqual(0, len(annotations))
+    self.assertIsInstance(annotations[0], Annotation)
+
+    # The results are shared with the wrapped CodeSearch object.
+    self.assertIs(cs_file,
+                  acs.cs.GetFileInfo('/src/chrome/src/net/http/http_auth.h'))
+    self.assertIs(annotations, cs_file.GetAnnotations())
+    self.assertEqual(2, self.server.request_count)
+
+  def test_traverse(self):
+    acs = self.CodeSearch()
+
+    async def Test():
+      cs_file = await acs.GetFileInfo('/src/chrome/src/net/http/http_auth.h')
+      await acs.GetAnnotations(cs_file)
+      sig = cs_file.GetSignatureForCodeBlock(
+          cs_file.FindCodeBlock(
+              name='ChooseBestChallenge', type=CodeBlockType.FUNCTION))
+      node = XrefNode.FromSignature(acs.cs, sig)
+      return await asyncio.gather(
+          acs.Traverse(node, KytheXrefKind.CALLED_BY),
+          acs.Traverse(node, KytheXrefKind.REFERENCE),
+          acs.Traverse(node, KytheXrefKind.DECLARATION))
+
+    callers, refs, decl = Run(acs, Test())
+
+    self.assertEqual(2, len(callers))
+    self.assertIsInstance(callers[0], XrefNode)
+    self.assertEqual(2, len(refs))
+    self.assertEqual(1, len(decl))
+
+  def test_search_for_symbol(self):
+    acs = self.CodeSearch(source_root='.', max_concurrency=2)
+
+    async def Test():
+      return await asyncio.gather(
+          acs.SearchForSymbol('URLRequestJob', NodeEnumKind.CLASS),
+          acs.SearchForSymbol(
+              'BackgroundSyncService::Register',
+              NodeEnumKind.METHOD,
+              return_all_results=True))
+
+    job, register = Run(acs, Test())
+
+    self.assertEqual(1, len(job))
+    self.assertIsInstance(job[0], XrefNode)
+    self.assertEqual(2, len(register))
+    self.assertEqual(set(), self.server.missing)
+
+  def test_proxy_falls_back_to_urlopen(self):
+    names = ['http_proxy', 'https_proxy', 'no_proxy', 'HTTP_PROXY',
+             'HTTPS_PROXY', 'NO_PROXY']
+    saved = dict((name, os.environ.pop(name, None)) for name in names)
+    try:
+      os.environ['https_proxy'] = 'http://proxy.example.com:3128'
+      acs = AsyncCodeSearch(source_root='.')
+      self.assertIsNone(acs.connection_pool)
+      acs.close()
+    finally:
+      for name, value in saved.items():
+        os.environ.pop(name, None)
+        if value is not None:
+          os.environ[name] = value
+
+  def test_coalesce_identical_requests(self):
+    acs = self.CodeSearch()
+
+    async def Test():
+      return await asyncio.gather(*[
+          acs.GetFileInfo('/src/chrome/src/net/http/http_auth.h')
+          for _ in range(3)
+      ])
+
+    Run(acs, Test())
+    self.assertEqual(1, self.server.request_count)
+    self.assertEqual(1, acs.cs.stats.cache_misses)
+    self.assertEqual(2, acs.cs.stats.coalesced_requests)
+
+  def test_shared_cache(self):
+    cs = CodeSearch(
+        source_root='.', codesearch_host=self.server.Host(), should_cache=True)
+    acs = AsyncCodeSearch(cs)
+    try:
+      nodes = cs.SearchForSymbol('HttpAuth::ChooseBestChallenge',
+                                 NodeEnumKind.FUNCTION)
+      self.assertEqual(1, len(nodes))
+      request_count = self.server.request_count
+      cache_misses = cs.stats.cache_misses
+
+      response = Run(acs, acs.GetCallGraph(nodes[0].GetSignature()))
+      self.assertIsInstance(response, CompoundResponse)
+      self.assertEqual(cache_misses + 1, cs.stats.cache_misses)
+
+      # Served from the shared FileCache.
+      cache_hits = cs.stats.cache_hits
+      cs.GetCallGraph(nodes[0].GetSignature())
+      self.assertEqual(cache_hits + 1, cs.stats.cache_hits)
+      self.assertEqual(request_count + 1, self.server.request_count)
+    finally:
+      cs.TeardownCache()
+
+
+class TestAsyncConnectionPool(unittest.TestCase):
+
+  def test_timeout_applies_to_each_read(self):
+    pool = AsyncConnectionPool(timeout_in_seconds=0.5)
+    body = b'0123456789'
+
+    # Sends the response body a byte at a time. Receiving the whole body takes
+    # longer than the timeout, but no single read does.
+    async def Handle(reader, writer):
+      await reader.readuntil(b'\r\n\r\n')
+      writer.write('HTTP/1.1 200 OK\r\nContent-Length: {}\r\n\r\n'.format(
+          len(body)).encode('latin-1'))
+      for i in range(len(body)):
+        await asyncio.sleep(0.1)
+        writer.write(body[i:i + 1])
+        await writer.drain()
+      writer.close()
+
+    async def Test():
+      server = await asyncio.start_server(Handle, '127.0.0.1', 0)
+      try:
+        port = server.sockets[0].getsockname()[1]
+        return await pool.Open('http://127.0.0.1:{}/'.format(port))
+      finally:
+        pool.close()
+        server.close()
+        await server.wait_closed()
+
+    loop = asyncio.new_event_loop()
+    try:
+      self.assertEqual(body, loop.run_until_complete(Test()))
+    finally:
+      loop.close()
@@ -0,0 +1,110 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""Micro-benchmark for decoding and encoding CodeSearch responses.
+
+Decodes each of the recorded responses in testdata/responses using each of
+the decoding modes supported by Message.FromShallowDict() and reports the
+time taken per pass over all of the responses. JSON parsing is timed
+separately since it is the same for all modes. Encoding the decoded responses
+back into JSON is timed using the plain encoder and using the symbolized and
+indented output of the command line interface.
+
+Run from the directory containing the codesearch package:
+
+    python -m codesearch.benchmark_messages [--repeat N] [--number N]
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import io
+import json
+import os
+import timeit
+
+from .messages import CodeSearchProtoJsonEncoder, \
+    CodeSearchProtoJsonSymbolizedEncoder, CompoundResponse, Message
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+RESPONSES_DIR = os.path.join(SCRIPT_DIR, 'testdata', 'responses')
+
+
+def LoadResponses():
+  """Returns a list of the recorded responses as JSON strings."""
+  responses = []
+  for name in sorted(os.listdir(RESPONSES_DIR)):
+    if not name.endswith('.json'):
+      continue
+    with io.open(os.path.join(RESPONSES_DIR, name), encoding='utf-8') as f:
+      responses.append(f.read())
+  return responses
+
+
+def Walk(o):
+  """Accesses every field of every message reachable from |o|."""
+  if isinstance(o, Message):
+    for v in o.Fields().values():
+      Walk(v)
+  elif isinstance(o, list):
+    for v in o:
+      Walk(v)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument(
+      '--repeat',
+      type=int,
+      default=5,
+      help='Number of times to repeat each measurement. The best is reported.')
+  parser.add_argument(
+      '--number',
+      type=int,
+      default=3,
+      help='Number of passes over all responses per measurement.')
+  args = parser.parse_args()
+
+  responses = LoadResponses()
+  documents = [json.loads(r) for r in responses]
+  total_bytes = sum(len(r) for r in responses)
+
+  def Decode(lazy, compact, walk=False):
+
+    def Run():
+      for d in documents:
+        response = CompoundResponse.FromShallowDict(d, lazy, compact)
+        if walk:
+          Walk(response)
+
+    return Run
+
+  decoded = [CompoundResponse.FromShallowDict(d) for d in documents]
+
+  def Encode(cls, **kwargs):
+    return lambda: [json.dumps(r, cls=cls, **kwargs) for r in decoded]
+
+  cases = [
+      ('json.loads', lambda: [json.loads(r) for r in responses]),
+      ('eager', Decode(False, False)),
+      ('compact', Decode(False, True)),
+      ('lazy', Decode(True, False)),
+      ('lazy, all fields accessed', Decode(True, False, True)),
+      ('lazy+compact, all fields accessed', Decode(True, True, True)),
+      ('encode', Encode(CodeSearchProtoJsonEncoder)),
+      ('encode, symbolized and indented',
+       Encode(CodeSearchProtoJsonSymbolizedEncoder, indent=4)),
+  ]
+
+  print('{} responses, {:.1f} MiB'.format(
+      len(responses), total_bytes / (1024.0 * 1024.0)))
+  for name, run in cases:
+    seconds = min(timeit.repeat(
+        run, repeat=args.repeat, number=args.number)) / args.number
+    print('{:<36} {:8.2f} ms'.format(name, seconds * 1000))
+
+
+if __name__ == '__main__':
+  main()
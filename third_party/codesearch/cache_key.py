@@ -0,0 +1,193 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""Cache keys for CodeSearch requests.
+
+Requests that mean the same thing can be spelled in many ways. Fields may be
+left out or set to their default value, and some repeated fields are sets in
+disguise. Keying the cache on the request URL means that each spelling gets
+its own cache entry.
+
+RequestCacheKey instead derives the key from a normalized form of the
+request:
+
+  * Fields that are unset or empty (None or []) are dropped. Neither is sent
+    to the server, so they are the only values known to mean the same as
+    leaving the field out. Explicit values like False or 0 are kept since the
+    server may not treat them as the default.
+  * Fields are ordered by name.
+  * Repeated fields listed in UNORDERED_FIELDS are sorted and deduplicated.
+  * Result limits (|max_num_results|) are not part of the key. They are kept
+    alongside the key instead, so that a cached response that was fetched with
+    a higher limit can answer a request with a lower one. Such a response is
+    cut down to the lower limit first. See TruncateResponse().
+
+The order of the sub-requests in a CompoundRequest is significant since the
+responses are matched up with the requests by position.
+"""
+
+import json
+
+from .messages import AnnotationRequest, Message, XrefSearchRequest
+
+# Repeated fields whose order has no bearing on the response, keyed by the
+# class in which they appear.
+UNORDERED_FIELDS = {
+    AnnotationRequest: {'type'},
+    XrefSearchRequest: {'edge_filter'},
+}
+
+# Fields that limit the number of results in a response.
+LIMIT_FIELD = 'max_num_results'
+
+# Sub-requests that have a limit, keyed by their field in CompoundRequest. Each
+# maps to the field in CompoundResponse holding the matching responses and the
+# path to the list of results within a response.
+LIMITED_REQUESTS = {
+    'call_graph_request': ('call_graph_response', ('node', 'children')),
+    'search_request': ('search_response', ('search_result',)),
+    'xref_search_request': ('xref_search_response', ('search_result',)),
+}
+
+# Cached responses are prefixed with this marker followed by the JSON encoded
+# list of limits that the request was made with.
+_LIMITS_MARKER = b'#limits='
+
+
+def _IsUnset(value):
+  return value is None or value == []
+
+
+def _Canonicalize(o):
+  """Returns a JSON serializable normalized form of |o|."""
+  if isinstance(o, Message):
+    unordered = UNORDERED_FIELDS.get(o.__class__, ())
+
+    rv = {}
+    for k, v in sorted(o.Fields().items()):
+      if k == LIMIT_FIELD:
+        continue
+      v = _Canonicalize(v)
+      if _IsUnset(v):
+        continue
+      if k in unordered:
+        v = [
+            json.loads(s)
+            for s in sorted(set(json.dumps(x, sort_keys=True) for x in v))
+        ]
+      rv[k] = v
+    return rv
+
+  if isinstance(o, list):
+    return [_Canonicalize(v) for v in o]
+
+  return o
+
+
+class RequestCacheKey(object):
+  """The cache key for a request.
+
+  |key| is a string identifying the request without regard to its result
+  limits. |limits| is a list containing the result limit of each limited
+  sub-request, or None if the key doesn't track limits. A limit of None stands
+  for the server default. |limited_requests| lists the (CompoundRequest field,
+  index) of the sub-request that each limit belongs to.
+  """
+
+  def __init__(self, key, limits=None, limited_requests=None):
+    self.key = key
+    self.limits = limits
+    self.limited_requests = limited_requests
+
+    # Set by the CodeSearch client if the request was answered using a stale
+    # cached response.
+    self.served_stale = False
+
+    # Set by the CodeSearch client to the time at which the cached response
+    # used to answer the request was written. None if the request wasn't
+    # answered from the cache.
+    self.cached_at = None
+
+  @staticmethod
+  def ForRequest(compound_request, host):
+    canonical = _Canonicalize(compound_request)
+    key = json.dumps([host, canonical],
+                     sort_keys=True,
+                     separators=(',', ':'))
+    limits = []
+    limited_requests = []
+    for field in sorted(LIMITED_REQUESTS.keys()):
+      requests = getattr(compound_request, field, None) or []
+      for index, request in enumerate(requests):
+        limits.append(getattr(request, LIMIT_FIELD, None) or None)
+        limited_requests.append((field, index))
+    return RequestCacheKey(key, limits, limited_requests)
+
+  def IsSatisfiedBy(self, cached_limits):
+    """Returns True if a response fetched with |cached_limits| can be used to
+    answer this request."""
+    if self.limits is None or cached_limits is None:
+      return True
+    if len(self.limits) != len(cached_limits):
+      return False
+    for requested, cached in zip(self.limits, cached_limits):
+      if requested == cached:
+        continue
+      if requested is None or cached is None or cached < requested:
+        return False
+    return True
+
+  def TruncateResponse(self, body, cached_limits):
+    """Returns the JSON response |body| cut down to the limits of this request.
+
+    |body| is a str containing a response that was fetched with
+    |cached_limits|. It must satisfy this request as determined by
+    IsSatisfiedBy(). Lists of results that are longer than the requested limit
+    are shortened. |body| is returned as is if there's nothing to remove.
+    """
+    if self.limits is None or cached_limits is None or \
+        self.limited_requests is None:
+      return body
+    cuts = [(request, limit)
+            for request, limit, cached in zip(self.limited_requests,
+                                              self.limits, cached_limits)
+            if limit is not None and limit != cached]
+    if not cuts:
+      return body
+
+    response = json.loads(body)
+    truncated = False
+    for (field, index), limit in cuts:
+      response_field, path = LIMITED_REQUESTS[field]
+      responses = response.get(response_field) or []
+      if index >= len(responses):
+        continue
+      container = responses[index]
+      for name in path[:-1]:
+        container = container.get(name) if isinstance(container, dict) else None
+      if not isinstance(container, dict):
+        continue
+      results = container.get(path[-1])
+      if isinstance(results, list) and len(results) > limit:
+        container[path[-1]] = results[:limit]
+        truncated = True
+    return json.dumps(response) if truncated else body
+
+  def EncodeResponse(self, body):
+    """Returns |body| as bytes to be stored in the cache under this key."""
+    if self.limits is None:
+      return body
+    return _LIMITS_MARKER + json.dumps(self.limits).encode('utf-8') + b'\n' + \
+        body
+
+  @staticmethod
+  def DecodeResponse(data):
+    """Returns a tuple containing the limits and the body of a response that
+    was encoded using EncodeResponse(). The limits are None if they weren't
+    recorded."""
+    if not data.startswith(_LIMITS_MARKER):
+      return None, data
+    header, _, body = data.partition(b'\n')
+    return json.loads(header[len(_LIMITS_MARKER):].decode('utf-8')), body
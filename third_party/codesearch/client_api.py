@@ -9,13 +9,27 @@ Codesearch library.
 
 from __future__ import absolute_import
 
+import array
+import codecs
+import collections
 import logging
 import os
-
-from .file_cache import FileCache
+import re
+import threading
+
+from .annotation_index import AnnotationIndex
+from .connection_pool import ConnectionPool, DEFAULT_CHUNK_SIZE, UsesProxy
+from .cs_file_cache import CsFileCache
+from .cache_key import RequestCacheKey
+from .file_cache import FileCache, DEFAULT_MAX_BYTES, DEFAULT_MAX_ENTRIES
+from .pack_file_cache import PackFileCache
+from .response_cache import ResponseCache
+from .streaming import ArrayElementDecoder
+from .symbol_index import SymbolIndex
 from .messages import \
         Annotation, \
         AnnotationRequest, \
+        AnnotationResponse, \
         AnnotationType, \
         AnnotationTypeValue, \
         CallGraphRequest, \
@@ -27,9 +41,11 @@ from .messages import \
         EdgeEnumKind, \
         FileInfo, \
         FileInfoRequest, \
+        FileInfoResponse, \
         FileSpec, \
         KytheNodeKind, \
         KytheXrefKind, \
+        Message, \
         Node, \
         NodeEnumKind, \
         SearchRequest, \
@@ -40,7 +56,7 @@ from .messages import \
         XrefSingleMatch
 from .paths import GetSourceRoot
 from .compat import StringFromBytes
-from .language_utils import SymbolSuffixMatcher, IsIdentifier
+from .language_utils import IsIdentifier
 
 try:
   from urllib.request import urlopen, Request
@@ -69,6 +85,16 @@ class NotFoundError(Exception):
   pass
 
 
+# Line boundaries as understood by str.splitlines().
+_LINE_BOUNDARY_RE = re.compile(
+    u'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+# Rough number of bytes taken up by a decoded Annotation, and by its entries in
+# an AnnotationIndex or SymbolIndex. Used for estimating CsFile.Footprint().
+_ANNOTATION_FOOTPRINT = 1024
+_INDEX_ENTRY_FOOTPRINT = 128
+
+
 class CsFile(object):
   """Represents a source file known to CodeSearch and allows looking up annotations."""
 
@@ -80,9 +106,22 @@ class CsFile(object):
     self.file_info = file_info
 
     if hasattr(self.file_info, 'content'):
-      self.lines = self.file_info.content.text.splitlines()
+      self.text = self.file_info.content.text
     else:
-      self.lines = []
+      self.text = ''
+
+    # Offsets into |text| of the start and the end of each line, not counting
+    # the line terminator. Built on first use by _LineTable().
+    self.line_starts = None
+    self.line_ends = None
+
+    # True if all lines are terminated by a single '\n', in which case text
+    # spanning multiple lines can be sliced out of |text| as-is.
+    self.newlines_only = True
+
+    # The contents of the file split into lines. Only built if someone asks for
+    # |lines|.
+    self.split_lines = None
 
     if hasattr(self.file_info, 'codeblock'):
       codeblocks = self.file_info.codeblock
@@ -93,40 +132,119 @@ class CsFile(object):
     else:
       self.codeblock = None
     self.annotations = None
+    self.annotation_index = None
+    self.symbol_index = None
 
   def Path(self):
     """Return the path to the file relative to the root of the source directory."""
     return self.file_info.name
 
-  def Text(self, text_range):
-    """Given a TextRange, returns the text corresponding to said range in this file.
-
-    Any intervening newlines will be represented with a single '\n'."""
-
+  @property
+  def lines(self):
+    """The contents of the file as a list of lines."""
+    if self.split_lines is None:
+      self.split_lines = self.text.splitlines()
+      self.cs.file_info_cache.update(self)
+    return self.split_lines
+
+  def Footprint(self):
+    """Returns an estimate of the memory held by this file in bytes."""
+    footprint = len(self.text)
+    if self.line_starts is not None:
+      footprint += 2 * self.line_starts.itemsize * len(self.line_starts)
+    if self.split_lines is not None:
+      footprint += len(self.text) + 64 * len(self.split_lines)
+    if self.annotations is not None:
+      footprint += _ANNOTATION_FOOTPRINT * len(self.annotations)
+      indices = (self.annotation_index is not None) + (
+          self.symbol_index is not None)
+      footprint += _INDEX_ENTRY_FOOTPRINT * indices * len(self.annotations)
+    return footprint
+
+  def LineCount(self):
+    return len(self._LineTable()[0])
+
+  def _LineTable(self):
+    """Returns the lists of line start and end offsets into |text|."""
+    if self.line_starts is None:
+      starts = array.array('l', [0])
+      ends = array.array('l')
+      newlines_only = True
+      for match in _LINE_BOUNDARY_RE.finditer(self.text):
+        ends.append(match.start())
+        starts.append(match.end())
+        if newlines_only and match.group() != '\n':
+          newlines_only = False
+      if starts[-1] == len(self.text):
+        # The last line is terminated, or the file is empty.
+        starts.pop()
+      else:
+        ends.append(len(self.text))
+      self.newlines_only = newlines_only
+      self.line_ends = ends
+      self.line_starts = starts
+    return self.line_starts, self.line_ends
+
+  def _Offsets(self, text_range):
+    """Returns the start and end offsets into |text| for |text_range|, which
+    is a TextRange. Columns past the end of a line are clamped to the end of
+    the line."""
     assert isinstance(text_range, TextRange)
+    starts, ends = self._LineTable()
 
-    if len(self.lines) == 0:
+    if len(starts) == 0:
       raise IndexError('no text received for file contents. path:{}'.format(
           self.file_info.name))
 
-    if text_range.start_line <= 0 or text_range.start_line > len(self.lines) or \
-            text_range.end_line <= 0 or text_range.end_line > len(self.lines) or \
+    if text_range.start_line <= 0 or text_range.start_line > len(starts) or \
+            text_range.end_line <= 0 or text_range.end_line > len(starts) or \
             text_range.start_line > text_range.end_line:
       raise IndexError(
           'invalid range specified: ({},{}) - ({},{}) : {} lines'.format(
               text_range.start_line, text_range.start_column,
-              text_range.end_line, text_range.end_column, len(self.lines)))
-    if text_range.start_line == text_range.end_line:
-      return self.lines[text_range.start_line
-                        - 1][text_range.start_column - 1:text_range.end_column]
+              text_range.end_line, text_range.end_column, len(starts)))
+
+    first = text_range.start_line - 1
+    last = text_range.end_line - 1
+    start = min(starts[first] + max(text_range.start_column - 1, 0),
+                ends[first])
+    end = min(starts[last] + max(text_range.end_column, 0), ends[last])
+    return start, max(start, end)
+
+  def Text(self, text_range):
+    """Given a TextRange, returns the text corresponding to said range in this file.
+
+    Any intervening newlines will be represented with a single '\n'."""
+
+    start, end = self._Offsets(text_range)
+    if self.newlines_only or text_range.start_line == text_range.end_line:
+      return self.text[start:end]
+
+    starts, ends = self.line_starts, self.line_ends
+    first = text_range.start_line - 1
+    last = text_range.end_line - 1
+    pieces = [self.text[start:ends[first]]]
+    pieces.extend(self.text[starts[i]:ends[i]] for i in range(first + 1, last))
+    pieces.append(self.text[starts[last]:end])
+    return '\n'.join(pieces)
+
+  def TextEquals(self, text_range, s):
+    """Returns True if the text corresponding to |text_range| is |s|.
 
-    first = [
-        self.lines[text_range.start_line - 1][text_range.start_column - 1:]
-    ]
-    middle = self.lines[text_range.start_line:text_range.end_line - 1]
-    end = [self.lines[text_range.end_line - 1][:text_range.end_column]]
+    Same as self.Text(text_range) == s, but doesn't make a copy of the text."""
+    start, end = self._Offsets(text_range)
+    if not self.newlines_only and text_range.start_line != text_range.end_line:
+      return self.Text(text_range) == s
+    return end - start == len(s) and self.text.startswith(s, start, end)
 
-    return '\n'.join(first + middle + end)
+  def TextContains(self, text_range, s):
+    """Returns True if the text corresponding to |text_range| contains |s|.
+
+    Same as s in self.Text(text_range), but doesn't make a copy of the text."""
+    start, end = self._Offsets(text_range)
+    if not self.newlines_only and text_range.start_line != text_range.end_line:
+      return s in self.Text(text_range)
+    return self.text.find(s, start, end) != -1
 
   def GetCodeBlock(self):
     """Retrieves a CodeBlocks of type ROOT for the file or None if one is not found.
@@ -176,7 +294,7 @@ class CsFile(object):
         continue
       if not codeblock.text_range.Overlaps(annotation.range):
         continue
-      if self.Text(annotation.range) == codeblock.name:
+      if self.TextEquals(annotation.range, codeblock.name):
         return annotation.GetSignature()
     return None
 
@@ -187,14 +305,51 @@ class CsFile(object):
   def GetAnnotations(self):
     if self.annotations == None:
       response = self.cs.GetAnnotationsForFile(self.GetFileSpec())
-      if not hasattr(response.annotation_response[0], 'annotation'):
-        return []
-      self.annotations = response.annotation_response[0].annotation
-      assert isinstance(self.annotations, list)
-      assert isinstance(self.annotations[0], Annotation)
+      self.SetAnnotationsFromResponse(response.annotation_response[0])
 
     return self.annotations
 
+  def GetAnnotationIndex(self):
+    """Returns an AnnotationIndex for the annotations in this file, which is
+    built on first use. Fetches the annotations if necessary."""
+    if self.annotation_index is None:
+      self.annotation_index = AnnotationIndex(self.GetAnnotations())
+      self.cs.file_info_cache.update(self)
+    return self.annotation_index
+
+  def GetSymbolIndex(self):
+    """Returns a SymbolIndex for the annotations in this file, which is built
+    on first use. Fetches the annotations if necessary."""
+    if self.symbol_index is None:
+      self.symbol_index = SymbolIndex(self)
+      self.cs.file_info_cache.update(self)
+    return self.symbol_index
+
+  def HasAnnotations(self):
+    """Returns True if the annotations for this file have already been
+    retrieved."""
+    return self.annotations is not None
+
+  def SetAnnotationsFromResponse(self, annotation_response):
+    """Populate the annotations for this file from an AnnotationResponse.
+
+    Used by GetAnnotations() as well as by batched requests made via
+    CodeSearch.GetFileInfos() which retrieve annotations for many files at
+    once."""
+    assert isinstance(annotation_response, AnnotationResponse)
+
+    self.annotation_index = None
+    self.symbol_index = None
+    if not hasattr(annotation_response, 'annotation'):
+      self.annotations = []
+    else:
+      # The response may be shared with other callers. See ResponseCache.
+      self.annotations = list(annotation_response.annotation)
+      assert isinstance(self.annotations, list)
+      assert len(self.annotations) == 0 or isinstance(self.annotations[0],
+                                                      Annotation)
+    self.cs.file_info_cache.update(self)
+
   def GetAnchorText(self, signature):
     # Fetch annotations if we haven't already.
     self.GetAnnotations()
@@ -288,6 +443,40 @@ class XrefNode(object):
     if xref_kinds is None:
       return results
 
+    xrset = XrefNode._XrefKindSet(xref_kinds)
+
+    cg = []
+    if KytheXrefKind.CALLED_BY in xrset:
+      cg.extend([
+          XrefNode.FromNode(self.cs, n)
+          for n in self._GetCallGraphNode(max_num_results).children
+      ])
+
+    return XrefNode._FilterByXrefKind(results, xrset) + cg
+
+  def TraverseIncrementally(self, xref_kinds=None, max_num_results=500):
+    """Like Traverse(), but returns an iterator that yields XrefNode objects
+    while the response is being received.
+
+    Cross references of kinds that aren't in |xref_kinds| are dropped before
+    they are decoded. If KytheXrefKind.CALLED_BY is requested, the callers are
+    yielded after all the other cross references.
+    """
+    xrset = None
+    if xref_kinds is not None:
+      xrset = XrefNode._XrefKindSet(xref_kinds)
+
+    for filespec, match in self.cs.GetXrefsIncrementally(
+        self.single_match.signature, max_num_results, xrset):
+      yield XrefNode(self.cs, match, filespec, self)
+
+    if xrset is not None and KytheXrefKind.CALLED_BY in xrset:
+      for n in self._GetCallGraphNode(max_num_results).children:
+        yield XrefNode.FromNode(self.cs, n)
+
+  @staticmethod
+  def _XrefKindSet(xref_kinds):
+    """Returns a set of KytheXrefKind values given a single value or a list."""
     if isinstance(xref_kinds, list):
       xrset = set(xref_kinds)
     else:
@@ -299,22 +488,20 @@ class XrefNode(object):
     # disjoint despite being sparse.
     for v in xrset:
       assert KytheXrefKind.ToSymbol(v) != v
+    return xrset
 
-    cg = []
-    if KytheXrefKind.CALLED_BY in xrset:
-      cg.extend([
-          XrefNode.FromNode(self.cs, n)
-          for n in self._GetCallGraphNode(max_num_results).children
-      ])
-
-    return list(filter(lambda n: n.single_match.type_id in xrset, results)) + cg
+  @staticmethod
+  def _FilterByXrefKind(nodes, xrset):
+    return list(filter(lambda n: n.single_match.type_id in xrset, nodes))
 
   def _GetCallGraphNode(self, max_num_results=500):
     """Returns a single Node containing one level of the incoming call graph."""
 
     cg_response = self.cs.GetCallGraph(
         signature=self.single_match.signature, max_num_results=max_num_results)
+    return self._CallGraphNodeFromResponse(cg_response)
 
+  def _CallGraphNodeFromResponse(self, cg_response):
     if not isinstance(cg_response, CompoundResponse) or not hasattr(
         cg_response, 'call_graph_response'):
       raise ServerError("Unexpected response. {}".format(cg_response))
@@ -550,6 +737,12 @@ class XrefNode(object):
 
 class CodeSearch(object):
 
+  # Annotation types retrieved by default for CsFile.GetAnnotations().
+  DEFAULT_ANNOTATION_TYPES = [
+      AnnotationType(id=AnnotationTypeValue.XREF_SIGNATURE),
+      AnnotationType(id=AnnotationTypeValue.LINK_TO_DEFINITION)
+  ]
+
   class Stats(object):
     """Used internally to track how many requests are being made."""
 
@@ -557,6 +750,83 @@ class CodeSearch(object):
       self.cache_hits = 0
       self.cache_misses = 0  # == number of network requests made
 
+      # Number of requests that were answered by waiting on an identical
+      # request that was already in flight.
+      self.coalesced_requests = 0
+
+      # Number of requests that were answered using a stale cache entry, and
+      # the number of background refreshes started because of them.
+      self.stale_hits = 0
+      self.background_refreshes = 0
+
+      # Number of requests that were answered using an already decoded
+      # response. These are also counted in |cache_hits|.
+      self.decoded_hits = 0
+
+  # Classes that can be used as the disk cache, keyed by the name that's passed
+  # in as |cache_backend|.
+  CACHE_BACKENDS = {'files': FileCache, 'pack': PackFileCache}
+
+  class _InFlightRequest(object):
+    """A request that is currently being sent to the server."""
+
+    def __init__(self):
+      self.done = threading.Event()
+      self.result = None
+      self.error = None
+
+  class _Refresher(object):
+    """Runs background refreshes on at most |max_workers| threads.
+
+    Workers are started on demand and exit once there's nothing left to do.
+    At most |max_pending| refreshes are queued. Further ones are dropped, as
+    is a refresh whose key is already queued. A later stale hit asks again.
+    """
+
+    def __init__(self, logger, max_workers=2, max_pending=64):
+      self.logger = logger
+      self.max_workers = max_workers
+      self.max_pending = max_pending
+      self.lock = threading.Lock()
+      self.pending = collections.OrderedDict()
+      self.workers = 0
+      self.closed = False
+
+    def Submit(self, key, fn):
+      """Queue |fn| to be run in the background under |key|.
+
+      Returns True if |fn| was queued."""
+      with self.lock:
+        if self.closed or key in self.pending or \
+            len(self.pending) >= self.max_pending:
+          return False
+        self.pending[key] = fn
+        if self.workers >= self.max_workers:
+          return True
+        self.workers += 1
+      thread = threading.Thread(target=self._Work)
+      thread.daemon = True
+      thread.start()
+      return True
+
+    def close(self):
+      """Drop queued refreshes. Running ones are left to finish."""
+      with self.lock:
+        self.closed = True
+        self.pending.clear()
+
+    def _Work(self):
+      while True:
+        with self.lock:
+          if not self.pending:
+            self.workers -= 1
+            return
+          key, fn = self.pending.popitem(last=False)
+        try:
+          fn()
+        except Exception as e:
+          self.logger.debug('Background refresh of %s failed: %s', key, e)
+
   def __init__(self,
                should_cache=False,
                cache_dir=None,
@@ -566,7 +836,18 @@ class CodeSearch(object):
                package_name='chromium',
                codesearch_host='https://cs.chromium.org',
                request_timeout_in_seconds=3,
-               user_agent_string='Python-CodeSearch-Client'):
+               user_agent_string='Python-CodeSearch-Client',
+               connection_pool_size=0,
+               connection_idle_timeout_in_seconds=60,
+               cache_max_bytes=DEFAULT_MAX_BYTES,
+               cache_max_entries=DEFAULT_MAX_ENTRIES,
+               cache_backend='files',
+               cache_max_staleness_in_seconds=0,
+               response_cache_max_entries=256,
+               file_info_cache_max_entries=1024,
+               file_info_cache_max_bytes=256 * 1024 * 1024,
+               lazy_decoding=False,
+               compact_messages=False):
     """Initialize a CodeSearch object.
 
     Creating a CodeSearch object is probably the first thing you are going to
@@ -592,6 +873,50 @@ class CodeSearch(object):
         cache_timeout_in_seconds -- The amount of time a request should be
             cached before being sent out to the network again.
 
+        cache_max_staleness_in_seconds -- How long a response may be used after
+            it has expired. A request that finds an expired response younger
+            than this in the cache is answered immediately using that response
+            while the response is refreshed in the background. Set to 0 to
+            always wait for the network once a response has expired.
+
+        cache_max_bytes -- Upper bound on the total size of the responses kept
+            in the cache. Least recently used responses are evicted once the
+            cache grows beyond this. Set to None for no limit.
+
+        cache_max_entries -- Upper bound on the number of responses kept in the
+            cache. Set to None for no limit.
+
+        response_cache_max_entries -- Number of decoded responses kept in
+            memory in front of the disk cache. Only considered if
+            |should_cache| is True. Set to 0 to always decode responses.
+
+            Decoded responses are shared between callers and are frozen
+            before they are stored. See response_cache.py.
+
+        file_info_cache_max_entries -- Upper bound on the number of CsFile
+            objects kept in memory by GetFileInfo() and GetFileInfos(). Set to
+            None for no limit.
+
+        file_info_cache_max_bytes -- Upper bound on the estimated memory held
+            by the CsFile objects kept in memory, including their annotations.
+            Least recently used files are dropped once this is exceeded. Set to
+            None for no limit. See CsFile.Footprint().
+
+        lazy_decoding -- If True, responses are decoded lazily. Nested
+            messages are only converted when they are first accessed. See
+            Message.Coerce().
+
+        compact_messages -- If True, responses use compact variants of
+            frequently occurring message types like TextRange and Annotation,
+            which store their fields in __slots__. This reduces the memory
+            held by large responses and cached files. See
+            messages.MakeCompactClass().
+
+        cache_backend -- How the disk cache is stored. 'files' stores each
+            response in a separate file. 'pack' stores compressed responses in
+            a single pack file inside |cache_dir|, which is preferable for large
+            shared caches. See pack_file_cache.py.
+
         source_root -- The CodeSearch backend refers to files using paths that
             are relative to the root of a source tree. This argument specifies
             this root in the local filesystem.
@@ -617,6 +942,19 @@ class CodeSearch(object):
         request_timeout_in_seconds -- Timeout to be applied to requests made to
             the server.
 
+        connection_pool_size -- Number of idle keep-alive connections to retain
+            per host. Set this to a positive number in order to reuse
+            connections across requests instead of paying for a new TCP and TLS
+            handshake for each request. If this is 0, each request is made
+            using urlopen() and hence goes through whichever URL opener is
+            installed. Pooled connections don't go through a proxy, so
+            urlopen() is also used if a proxy is configured for
+            |codesearch_host|.
+
+        connection_idle_timeout_in_seconds -- Pooled connections that have been
+            idle for longer than this are closed rather than reused. Only
+            considered if |connection_pool_size| is positive.
+
     In general, you only need to set the source_root or a_path_inside_source_dir
     in order to construct a functional CodeSearch object.
 
@@ -627,8 +965,13 @@ class CodeSearch(object):
     # An instance of FileCache or None if no caching is to be performed.
     self.file_cache = None
 
+    # An instance of ResponseCache or None if decoded responses are not to be
+    # cached.
+    self.response_cache = None
+
     # A cache mapping path -> CsFile objects.
-    self.file_info_cache = {}
+    self.file_info_cache = CsFileCache(file_info_cache_max_entries,
+                                       file_info_cache_max_bytes)
 
     self.logger = logging.getLogger('codesearch')
 
@@ -643,13 +986,44 @@ class CodeSearch(object):
 
     self.extra_headers = {'User-Agent': user_agent_string}
 
+    self.lazy_decoding = lazy_decoding
+    self.compact_messages = compact_messages
+
     self.stats = CodeSearch.Stats()
 
+    # Map from URL to _InFlightRequest for requests that are currently being
+    # sent to the server. Protected by |in_flight_lock|.
+    self.in_flight = {}
+    self.in_flight_lock = threading.Lock()
+
+    # Refreshes stale cache entries in the background.
+    self.refresher = CodeSearch._Refresher(self.logger)
+
+    # An instance of ConnectionPool or None if each request should use a new
+    # connection.
+    self.connection_pool = None
+    if connection_pool_size > 0 and not UsesProxy(codesearch_host):
+      self.connection_pool = ConnectionPool(
+          pool_size=connection_pool_size,
+          idle_timeout_in_seconds=connection_idle_timeout_in_seconds,
+          timeout_in_seconds=request_timeout_in_seconds)
+
     if not should_cache:
       self.file_cache = None
       return
-    self.file_cache = FileCache(
-        cache_dir=cache_dir, expiration_in_seconds=cache_timeout_in_seconds)
+    if cache_backend not in CodeSearch.CACHE_BACKENDS:
+      raise ValueError('unknown cache backend: {}'.format(cache_backend))
+    self.file_cache = CodeSearch.CACHE_BACKENDS[cache_backend](
+        cache_dir=cache_dir,
+        expiration_in_seconds=cache_timeout_in_seconds,
+        max_staleness_in_seconds=cache_max_staleness_in_seconds,
+        max_bytes=cache_max_bytes,
+        max_entries=cache_max_entries)
+
+    if response_cache_max_entries > 0:
+      self.response_cache = ResponseCache(
+          max_entries=response_cache_max_entries,
+          expiration_in_seconds=cache_timeout_in_seconds)
 
   def GetSourceRoot(self):
     return self.source_root
@@ -682,57 +1056,297 @@ class CodeSearch(object):
     return FileSpec(name=path, package_name=args[0])
 
   def TeardownCache(self):
+    """Release the cache along with any pooled connections."""
     if self.file_cache:
       self.file_cache.close()
 
     self.file_cache = None
+    self.response_cache = None
+    self.refresher.close()
+
+    if self.connection_pool:
+      self.connection_pool.close()
 
-  def _Retrieve(self, url):
+  def _Retrieve(self, url, cache_key=None):
     """Retrieve the URL, optionally using the cache.
 
     If a cache is in use, checks if the URL is cached, otherwise sends it to the
     network. Note that the cache in question may not obey usual HTTP caching
     semantics.
 
+    The cache is looked up using |cache_key|, which is a RequestCacheKey. If
+    |cache_key| is None, the URL itself is used as the key.
+
+    Concurrent requests for the same URL are coalesced. Only the first caller
+    sends the request to the server while the rest wait for its result.
+
+    A stale cached response is returned right away. The response is then
+    refreshed on a background thread.
+
     The response is a str object containing the response body on success. Will
     throw on failure.
     """
     self.logger.debug('Fetching %s', url)
 
-    if self.file_cache:
-      cached_response = self.file_cache.get(url)
-      self.logger.debug('Found cached response')
-      if (cached_response):
-        self.stats.cache_hits += 1
-        return cached_response.decode('utf8')
-    self.stats.cache_misses += 1
+    if cache_key is None:
+      cache_key = RequestCacheKey(url)
 
-    # Long URLs cause the request to fail. If it's too long, snip off the query
-    # and send it as a POST body. Yes, this is how it works.
-    if len(url) > 1500:
-      parsed = urlparse(url)
-      short_url = '{}://{}{}'.format(parsed.scheme, parsed.netloc, parsed.path)
-      data = parsed.query.encode('utf-8')
-      request = Request(url=short_url, headers=self.extra_headers, data=data)
-    else:
-      request = Request(url=url, headers=self.extra_headers)
+    cached_response, is_stale = self._GetCachedResponse(cache_key)
+    if cached_response:
+      if is_stale:
+        cache_key.served_stale = True
+        self._RefreshInBackground(url, cache_key)
+      return cached_response
+
+    return self._FetchOnce(url, cache_key)
+
+  def _FetchOnce(self, url, cache_key):
+    """Like _Fetch(), but coalesces concurrent requests for |url|."""
+    in_flight, is_leader = self._JoinInFlight(url)
+    while not is_leader:
+      result = self._WaitForInFlight(in_flight)
+      if result is not None:
+        return result
+      # The request was abandoned. See _RetrieveIncrementally().
+      in_flight, is_leader = self._JoinInFlight(url)
+
+    try:
+      in_flight.result = self._Fetch(url, cache_key)
+    except Exception as e:
+      in_flight.error = e
+      raise
+    finally:
+      self._LeaveInFlight(url, in_flight)
+    return in_flight.result
+
+  def _RetrieveIncrementally(self, url, cache_key=None):
+    """Like _Retrieve(), but yields the response body as it is received.
+
+    Returns an iterator over str objects that make up the response body when
+    concatenated. Cached responses and responses to requests that were
+    coalesced with one that's already in flight are yielded in one piece.
+
+    The response is cached once it has been received in full. If the caller
+    stops iterating early, the connection is closed instead of reading the rest
+    of the body. Nothing is cached in that case, and coalesced requests send
+    the request again.
+    """
+    self.logger.debug('Fetching %s incrementally', url)
+
+    if cache_key is None:
+      cache_key = RequestCacheKey(url)
+
+    cached_response, is_stale = self._GetCachedResponse(cache_key)
+    if cached_response:
+      if is_stale:
+        cache_key.served_stale = True
+        self._RefreshInBackground(url, cache_key)
+      yield cached_response
+      return
 
+    in_flight, is_leader = self._JoinInFlight(url)
+    while not is_leader:
+      result = self._WaitForInFlight(in_flight)
+      if result is not None:
+        yield result
+        return
+      # The request was abandoned before the response was complete.
+      in_flight, is_leader = self._JoinInFlight(url)
+
+    try:
+      stream = self._FetchStream(url)
+      decoder = codecs.getincrementaldecoder('utf-8')()
+      chunks = []
+      for chunk in stream:
+        chunks.append(chunk)
+        text = decoder.decode(chunk)
+        if not text:
+          continue
+        try:
+          yield text
+        except GeneratorExit:
+          # Closing the stream closes the connection.
+          stream.close()
+          raise
+      decoder.decode(b'', True)
+      in_flight.result = self._CacheResponse(cache_key, b''.join(chunks))
+    except Exception as e:
+      in_flight.error = e
+      raise
+    finally:
+      self._LeaveInFlight(url, in_flight)
+
+  def _JoinInFlight(self, url):
+    """Returns a tuple containing the _InFlightRequest for |url| and a boolean
+    that is True if the caller is the one that should send the request. The
+    latter must call _LeaveInFlight() once done."""
+    with self.in_flight_lock:
+      in_flight = self.in_flight.get(url)
+      if in_flight is None:
+        in_flight = CodeSearch._InFlightRequest()
+        self.in_flight[url] = in_flight
+        self.stats.cache_misses += 1
+        return in_flight, True
+      self.stats.coalesced_requests += 1
+      return in_flight, False
+
+  def _WaitForInFlight(self, in_flight):
+    """Returns the response body received by |in_flight|, or None if the
+    request was abandoned before it was received in full."""
+    self.logger.debug('Waiting for in-flight request')
+    in_flight.done.wait()
+    if in_flight.error is not None:
+      raise in_flight.error
+    return in_flight.result
+
+  def _LeaveInFlight(self, url, in_flight):
+    with self.in_flight_lock:
+      del self.in_flight[url]
+    in_flight.done.set()
+
+  def _RefreshInBackground(self, url, cache_key):
+    """Queue a fetch of |url| on |refresher| unless it is already in flight."""
+    with self.in_flight_lock:
+      if url in self.in_flight:
+        return
+
+    if self.refresher.Submit(url, lambda: self._FetchOnce(url, cache_key)):
+      with self.in_flight_lock:
+        self.stats.background_refreshes += 1
+
+  def _Fetch(self, url, cache_key):
+    """Send a request for |url| to the server and cache the response under
+    |cache_key|. Returns the response body as a str."""
+    request_url, data = CodeSearch._SplitLongUrl(url)
+    if self.connection_pool:
+      result = self.connection_pool.Open(
+          request_url, data=data, headers=self.extra_headers)
+    else:
+      request = Request(url=request_url, headers=self.extra_headers, data=data)
+      response = urlopen(request, timeout=self.request_timeout_in_seconds)
+      result = response.read()
+      response.close()
+
+    return self._CacheResponse(cache_key, result)
+
+  def _FetchStream(self, url):
+    """Send a request for |url| to the server. Returns an iterator over the
+    response body as bytes objects. The response is not cached."""
+    request_url, data = CodeSearch._SplitLongUrl(url)
+    if self.connection_pool:
+      return self.connection_pool.OpenStream(
+          request_url, data=data, headers=self.extra_headers)
+    request = Request(url=request_url, headers=self.extra_headers, data=data)
     response = urlopen(request, timeout=self.request_timeout_in_seconds)
-    result = response.read()
-    response.close()
-    if self.file_cache:
-      self.file_cache.put(url, result)
+    return CodeSearch._ReadChunks(response)
+
+  @staticmethod
+  def _ReadChunks(response, chunk_size=DEFAULT_CHUNK_SIZE):
+    try:
+      while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+          return
+        yield chunk
+    finally:
+      response.close()
+
+  def _GetCachedResponse(self, cache_key):
+    """Looks up the cached response for the RequestCacheKey |cache_key|.
+
+    Returns a tuple containing the response as a str, or None if there isn't
+    one, and a boolean that is True if the response is stale. Counts cache hits
+    in |stats|. A response that was fetched with higher result limits than
+    those of |cache_key| is cut down to the requested limits. Sets
+    |cache_key.cached_at| to the time at which the response was cached.
+    """
+    file_cache = self.file_cache
+    if file_cache:
+      cached_response, is_stale, cached_at = file_cache.lookup_timestamped(
+          cache_key.key)
+      if (cached_response):
+        limits, body = RequestCacheKey.DecodeResponse(cached_response)
+        if cache_key.IsSatisfiedBy(limits):
+          self.logger.debug('Found %s cached response',
+                            'stale' if is_stale else 'fresh')
+          cache_key.cached_at = cached_at
+          self.stats.cache_hits += 1
+          if is_stale:
+            self.stats.stale_hits += 1
+          return cache_key.TruncateResponse(body.decode('utf8'),
+                                            limits), is_stale
+    return None, False
+
+  def _CacheResponse(self, cache_key, result):
+    """Stores the response body |result| under the RequestCacheKey
+    |cache_key| in the cache, if there is one. Returns |result| as a str."""
+    file_cache = self.file_cache
+    if file_cache:
+      file_cache.put(cache_key.key, cache_key.EncodeResponse(result))
+    response_cache = self.response_cache
+    if response_cache:
+      response_cache.discard(cache_key.key)
     return StringFromBytes(result)
 
-  def SendRequestToServer(self, compound_request):
+  @staticmethod
+  def _SplitLongUrl(url):
+    """Returns a tuple containing the URL to request and the POST body to send
+    for |url|. The latter is None if the request should be a GET."""
+
+    # Long URLs cause the request to fail. If it's too long, snip off the query
+    # and send it as a POST body. Yes, this is how it works.
+    if len(url) <= 1500:
+      return url, None
+    parsed = urlparse(url)
+    short_url = '{}://{}{}'.format(parsed.scheme, parsed.netloc, parsed.path)
+    return short_url, parsed.query.encode('utf-8')
+
+  def _UrlForRequest(self, compound_request):
     if not isinstance(compound_request, CompoundRequest):
       raise ValueError(
           '|compound_request| should be an instance of CompoundRequest')
 
     qs = urlencode(compound_request.AsQueryString(), doseq=True)
-    url = '{host}/codesearch/json?{qs}'.format(host=self.codesearch_host, qs=qs)
-    result = self._Retrieve(url)
-    return CompoundResponse.FromJsonString(result)
+    return '{host}/codesearch/json?{qs}'.format(host=self.codesearch_host, qs=qs)
+
+  def SendRequestToServer(self, compound_request):
+    """Send |compound_request| to the server and return the CompoundResponse.
+
+    If caching is enabled, the returned object may be shared with other callers
+    and is frozen. See Message.Freeze().
+    """
+    url = self._UrlForRequest(compound_request)
+    cache_key = RequestCacheKey.ForRequest(compound_request,
+                                           self.codesearch_host)
+    response = self._GetDecodedResponse(cache_key)
+    if response is not None:
+      return response
+    result = self._Retrieve(url, cache_key)
+    response = CompoundResponse.FromJsonString(result, self.lazy_decoding,
+                                               self.compact_messages)
+    self._CacheDecodedResponse(cache_key, response, len(result))
+    return response
+
+  def _GetDecodedResponse(self, cache_key):
+    response_cache = self.response_cache
+    if not response_cache:
+      return None
+    response = response_cache.get(cache_key)
+    if response is not None:
+      self.stats.cache_hits += 1
+      self.stats.decoded_hits += 1
+    return response
+
+  def _CacheDecodedResponse(self, cache_key, response, size):
+    # A stale response is about to be replaced by a background refresh. Keeping
+    # it around would hide the refreshed response.
+    response_cache = self.response_cache
+    if response_cache and not cache_key.served_stale:
+      response.Freeze()
+      # A response decoded from the disk cache expires along with the disk
+      # cache entry. It would otherwise be considered fresh for longer than
+      # the response it came from.
+      response_cache.put(cache_key, response, size, cache_key.cached_at)
 
   def GetCallGraph(self, signature, max_num_results=500):
     """Retrieves a list of call graph nodes corresponding to all call sites of
@@ -747,13 +1361,28 @@ class CodeSearch(object):
                 signature=signature)
         ]))
 
-  def GetAnnotationsForFile(
-      self,
-      filename,
-      annotation_types=[
-          AnnotationType(id=AnnotationTypeValue.XREF_SIGNATURE), AnnotationType(
-              id=AnnotationTypeValue.LINK_TO_DEFINITION)
-      ]):
+  def GetCallGraphs(self, signatures, max_num_results=500):
+    """Retrieves the call graphs for each signature in |signatures| using a
+    single request.
+
+    Returns a list of CallGraphResponse objects in the same order as
+    |signatures|.
+    """
+    if not signatures:
+      return []
+
+    response = self.SendRequestToServer(
+        CompoundRequest(call_graph_request=[
+            CallGraphRequest(
+                file_spec=self.GetFileSpec(),
+                max_num_results=max_num_results,
+                signature=signature) for signature in signatures
+        ]))
+    return getattr(response, 'call_graph_response', [])
+
+  def GetAnnotationsForFile(self,
+                            filename,
+                            annotation_types=DEFAULT_ANNOTATION_TYPES):
     """Retrieves a list of annotations for a file.
 
     Note that it is much more efficient in your scripts to use
@@ -773,13 +1402,10 @@ class CodeSearch(object):
 
     All locations are 1-based."""
 
-    annotations = self.GetFileInfo(filename).GetAnnotations()
-    enclosing_annotation_found = False
+    annotations = self.GetFileInfo(filename).GetAnnotationIndex().AnnotationsAt(
+        line, column)
+    enclosing_annotation_found = len(annotations) > 0
     for annotation in annotations:
-      if not annotation.range.Contains(line, column):
-        continue
-
-      enclosing_annotation_found = True
 
       if hasattr(annotation, 'xref_signature'):
         return annotation.xref_signature.signature
@@ -809,8 +1435,10 @@ class CodeSearch(object):
     file_spec = self.GetFileSpec(filename)
     cacheable = (not fetch_html_content) and fetch_outline and (
         not fetch_folding) and (not fetch_generated_from)
-    if cacheable and (file_spec.name in self.file_info_cache):
-      return self.file_info_cache[file_spec.name]
+    if cacheable:
+      cs_file = self.file_info_cache.get(file_spec.name)
+      if cs_file is not None:
+        return cs_file
 
     result = self.SendRequestToServer(
         CompoundRequest(file_info_request=[
@@ -822,30 +1450,115 @@ class CodeSearch(object):
                 fetch_generated_from=fetch_generated_from)
         ]))
 
-    if hasattr(result.file_info_response[0], 'error_message'):
-      raise ServerError('server reported error while fetching FileInfo: {}'.
-                        format(result.file_info_response[0].error_message))
+    file_info = self._CsFileFromResponse(result.file_info_response[0],
+                                         filename)
+    if cacheable:
+      self.file_info_cache.put(file_spec.name, file_info)
+    return file_info
 
-    if hasattr(result.file_info_response[0], 'file_info'):
-      file_info = CsFile(self, file_info=result.file_info_response[0].file_info)
-      if cacheable:
-        self.file_info_cache[file_spec.name] = file_info
+  def _CsFileFromResponse(self, file_info_response, filename):
+    """Construct a CsFile from a FileInfoResponse. Throws a ServerError if the
+    response doesn't contain a FileInfo."""
+    assert isinstance(file_info_response, FileInfoResponse)
 
-      return file_info
+    if hasattr(file_info_response, 'error_message'):
+      raise ServerError('server reported error while fetching FileInfo: {}'.
+                        format(file_info_response.error_message))
+
+    if hasattr(file_info_response, 'file_info'):
+      return CsFile(self, file_info=file_info_response.file_info)
 
     raise ServerError(
         'unexpected message format while fetching file info for %s' %
         (filename))
 
+  def GetFileInfos(self, filenames, fetch_annotations=True):
+    """Return a list of CsFile objects corresponding to |filenames| while
+    making at most one request to the server.
+
+    This is the batched equivalent of calling GetFileInfo() followed by
+    CsFile.GetAnnotations() for each file. Each entry in |filenames| is
+    resolved the same way as the |filename| argument of GetFileInfo().
+
+    Files that are already known via |file_info_cache| are not requested again.
+    Neither are their annotations if they have already been retrieved. All
+    remaining FileInfoRequest and AnnotationRequest messages are packed into a
+    single CompoundRequest and the resulting CompoundResponse is split back
+    into per-file results which are then added to |file_info_cache|.
+
+    If |fetch_annotations| is True, then the annotations for each file are
+    also retrieved and become available via CsFile.GetAnnotations() without
+    any further network requests.
+
+    The returned list is in the same order as |filenames|. An entry is None if
+    the server couldn't provide a FileInfo for the corresponding file.
+    """
+    file_specs = [self.GetFileSpec(filename) for filename in filenames]
+
+    # Map from path to CsFile for the files that are known. These are
+    # collected separately since adding files to |file_info_cache| may evict
+    # others.
+    cs_files = {}
+    need_file_info = []
+    need_annotations = []
+    for file_spec in file_specs:
+      if file_spec.name in cs_files:
+        continue
+
+      cs_file = self.file_info_cache.get(file_spec.name)
+      cs_files[file_spec.name] = cs_file
+      if cs_file is None:
+        need_file_info.append(file_spec)
+        if fetch_annotations:
+          need_annotations.append(file_spec)
+      elif fetch_annotations and not cs_file.HasAnnotations():
+        need_annotations.append(file_spec)
+
+    if need_file_info or need_annotations:
+      result = self.SendRequestToServer(
+          CompoundRequest(
+              file_info_request=[
+                  FileInfoRequest(
+                      file_spec=file_spec,
+                      fetch_html_content=False,
+                      fetch_outline=True,
+                      fetch_folding=False,
+                      fetch_generated_from=False)
+                  for file_spec in need_file_info
+              ],
+              annotation_request=[
+                  AnnotationRequest(
+                      file_spec=file_spec, type=self.DEFAULT_ANNOTATION_TYPES)
+                  for file_spec in need_annotations
+              ]))
+
+      file_info_responses = getattr(result, 'file_info_response', [])
+      for file_spec, response in zip(need_file_info, file_info_responses):
+        try:
+          cs_files[file_spec.name] = self._CsFileFromResponse(
+              response, file_spec.name)
+        except ServerError as e:
+          self.logger.debug('Failed to retrieve FileInfo for %s: %s',
+                            file_spec.name, e)
+
+      annotation_responses = getattr(result, 'annotation_response', [])
+      for file_spec, response in zip(need_annotations, annotation_responses):
+        cs_file = cs_files[file_spec.name]
+        if cs_file is not None:
+          cs_file.SetAnnotationsFromResponse(response)
+
+      for file_spec in need_file_info:
+        if cs_files[file_spec.name] is not None:
+          self.file_info_cache.put(file_spec.name, cs_files[file_spec.name])
+
+    return [cs_files[file_spec.name] for file_spec in file_specs]
+
   def GetSignatureForSymbol(self, filename, symbol):
     """Return a signature matching |symbol| in |filename|.
     """
 
     fileinfo = self.GetFileInfo(filename)
-    for annotation in fileinfo.GetAnnotations():
-      if symbol not in fileinfo.Text(annotation.range):
-        continue
-
+    for annotation in fileinfo.GetSymbolIndex().AnnotationsContaining(symbol):
       if annotation.type.id == AnnotationTypeValue.LINK_TO_DEFINITION:
         return annotation.internal_link.GetSignature()
 
@@ -873,16 +1586,9 @@ class CodeSearch(object):
 
     signatures = set()
     fileinfo = self.GetFileInfo(filename)
-    matcher = SymbolSuffixMatcher(symbol)
-
-    for annotation in fileinfo.GetAnnotations():
-      text = fileinfo.Text(annotation.range)
-      if not matcher.Match(text):
-        continue
-
-      if node_kind is not None and node_kind != annotation.kythe_xref_kind:
-        continue
 
+    for annotation in fileinfo.GetSymbolIndex().AnnotationsMatchingSymbol(
+        symbol, node_kind):
       if annotation.type.id == AnnotationTypeValue.LINK_TO_DEFINITION:
         signatures.update(annotation.internal_link.GetSignatures())
         continue
@@ -916,6 +1622,13 @@ class CodeSearch(object):
     results will be returned. Note that this can be very slow. By default, the
     search will end as soon as at least one signature has been found.
     """
+    search_response = self.SendRequestToServer(
+        self._SearchRequestForSymbol(symbol, xref_kind,
+                                     max_results_to_analyze)).search_response[0]
+    return self._XrefNodesFromSymbolSearch(search_response, symbol,
+                                           return_all_results)
+
+  def _SearchRequestForSymbol(self, symbol, xref_kind, max_results_to_analyze):
     XREF_KIND_TO_SEARCH_PREFIX = {
         NodeEnumKind.CLASS: "class:",
         NodeEnumKind.FUNCTION: "function:",
@@ -925,27 +1638,28 @@ class CodeSearch(object):
     search_prefix = XREF_KIND_TO_SEARCH_PREFIX.get(xref_kind, "symbol:")
     search_query = "{}{}".format(search_prefix, symbol)
 
-    search_response = self.SendRequestToServer(
-        CompoundRequest(search_request=[
-            SearchRequest(
-                query=search_query,
-                exhaustive=True,
-                max_num_results=max_results_to_analyze,
-                return_all_duplicates=False,
-                return_all_snippets=True,
-                return_decorated_snippets=False,
-                return_directories=False,
-                return_line_matches=True,
-                return_snippets=True)
-        ])).search_response[0]
-
+    return CompoundRequest(search_request=[
+        SearchRequest(
+            query=search_query,
+            exhaustive=True,
+            max_num_results=max_results_to_analyze,
+            return_all_duplicates=False,
+            return_all_snippets=True,
+            return_decorated_snippets=False,
+            return_directories=False,
+            return_line_matches=True,
+            return_snippets=True)
+    ])
+
+  def _XrefNodesFromSymbolSearch(self, search_response, symbol,
+                                 return_all_results):
+    """Second half of SearchForSymbol(). Resolves the signatures for the
+    matches in |search_response|."""
     if not hasattr(search_response, 'search_result'):
       return []
 
     signatures = set()
-    result = None
-    for r in search_response.search_result:
-      result = r
+    for result in search_response.search_result:
       assert isinstance(result, SearchResult)
 
       if not hasattr(result, 'top_file'):
@@ -954,41 +1668,46 @@ class CodeSearch(object):
       if not hasattr(result, 'snippet'):
         continue
 
-      for snippet in result.snippet:
-        if not hasattr(snippet, 'text') or not hasattr(snippet.text, 'range'):
-          continue
-        for r in snippet.text.range:
-          try:
-            s = self.GetSignatureForLocation(
-                result.top_file.file.name,
-                snippet.first_line_number + r.range.end_line - 1,
-                r.range.end_column - 1)
-            signatures.add(s)
-          except:
-            # This usually means that there were no matches at the location. CS
-            # being CS, sometimes we need to resort to doing terrible things,
-            # like searching by symbol name.
-            sa = self.GetSignaturesForSymbol(result.top_file.file.name, symbol)
-            signatures.update(set(sa))
-
-            if len(sa) == 0:
-              # Well, that didn't work either. Let's try one more time and
-              # this time look up signatures that look like they are in the
-              # right ballpark. This is the least accurate of the methods
-              # available to us.
-              try:
-                s = self.GetSignatureForSymbol(result.top_file.file.name,
-                                               symbol)
-                signatures.add(s)
-              except:
-                pass
-            pass
+      signatures.update(self._SignaturesFromSearchResult(result, symbol))
 
       if not return_all_results and len(signatures) > 0:
         break
 
     return [XrefNode.FromSignature(self, signature=s) for s in signatures]
 
+  def _SignaturesFromSearchResult(self, result, symbol):
+    """Returns the set of signatures for |symbol| at the snippets of the
+    SearchResult |result|."""
+    signatures = set()
+    for snippet in result.snippet:
+      if not hasattr(snippet, 'text') or not hasattr(snippet.text, 'range'):
+        continue
+      for r in snippet.text.range:
+        try:
+          s = self.GetSignatureForLocation(
+              result.top_file.file.name,
+              snippet.first_line_number + r.range.end_line - 1,
+              r.range.end_column - 1)
+          signatures.add(s)
+        except:
+          # This usually means that there were no matches at the location. CS
+          # being CS, sometimes we need to resort to doing terrible things,
+          # like searching by symbol name.
+          sa = self.GetSignaturesForSymbol(result.top_file.file.name, symbol)
+          signatures.update(set(sa))
+
+          if len(sa) == 0:
+            # Well, that didn't work either. Let's try one more time and
+            # this time look up signatures that look like they are in the
+            # right ballpark. This is the least accurate of the methods
+            # available to us.
+            try:
+              s = self.GetSignatureForSymbol(result.top_file.file.name, symbol)
+              signatures.add(s)
+            except:
+              pass
+    return signatures
+
   def GetXrefsFor(self, signature, max_num_results=500):
     refs = self.SendRequestToServer(
         CompoundRequest(xref_search_request=[
@@ -1001,6 +1720,81 @@ class CodeSearch(object):
       return []
     return refs.xref_search_response[0].search_result
 
+  def GetXrefsIncrementally(self,
+                            signature,
+                            max_num_results=500,
+                            xref_kinds=None):
+    """Like GetXrefsFor(), but yields the results while the response is being
+    received.
+
+    Returns an iterator over (FileSpec, XrefSingleMatch) tuples, one for each
+    match in the response. |xref_kinds|, if not None, is a set of KytheXrefKind
+    values. Matches of other kinds are skipped without being converted into
+    XrefSingleMatch objects.
+    """
+    compound_request = CompoundRequest(xref_search_request=[
+        XrefSearchRequest(
+            file_spec=self.GetFileSpec(),
+            query=signature,
+            max_num_results=max_num_results)
+    ])
+    url = self._UrlForRequest(compound_request)
+    cache_key = RequestCacheKey.ForRequest(compound_request,
+                                           self.codesearch_host)
+
+    response = self._GetDecodedResponse(cache_key)
+    if response is not None:
+      responses = getattr(response, 'xref_search_response', [])
+      results = getattr(responses[0], 'search_result', []) if responses else []
+      for result in results:
+        for match in result.match:
+          if xref_kinds is None or match.type_id in xref_kinds:
+            yield result.file, match
+      return
+
+    kind_type = XrefSingleMatch.DESCRIPTOR['type_id']
+    decoder = ArrayElementDecoder('search_result')
+    for text in self._RetrieveIncrementally(url, cache_key):
+      for result in decoder.Feed(text):
+        filespec = None
+        for match in result.get('match', []):
+          if xref_kinds is not None:
+            kind = match.get('type_id')
+            if kind is None or \
+                Message.Coerce(kind, kind_type) not in xref_kinds:
+              continue
+          if filespec is None and 'file' in result:
+            filespec = Message.Coerce(result['file'], FileSpec, None,
+                                      self.lazy_decoding,
+                                      self.compact_messages)
+          yield filespec, Message.Coerce(match, XrefSingleMatch, None,
+                                         self.lazy_decoding,
+                                         self.compact_messages)
+    decoder.Close()
+
+  def GetXrefsForSignatures(self, signatures, max_num_results=500):
+    """Batched version of GetXrefsFor().
+
+    Retrieves cross references for each signature in |signatures| using a
+    single request. Returns a list containing a list of XrefSearchResult
+    objects for each signature, in the same order as |signatures|.
+    """
+    if not signatures:
+      return []
+
+    refs = self.SendRequestToServer(
+        CompoundRequest(xref_search_request=[
+            XrefSearchRequest(
+                file_spec=self.GetFileSpec(),
+                query=signature,
+                max_num_results=max_num_results) for signature in signatures
+        ]))
+
+    responses = getattr(refs, 'xref_search_response', [])
+    results = [getattr(r, 'search_result', []) for r in responses]
+    results.extend([[] for _ in range(len(signatures) - len(results))])
+    return results
+
   def GetOverridingDefinitions(self, signature):
     """GetOverridingDefinitions returns a list of XrefSearchResult objects
     representing all the overrides of the symbol corresponding to |signature|.
@@ -1008,12 +1802,20 @@ class CodeSearch(object):
     Returns an empty list if there are no overrides.
     """
 
-    refs = self.GetXrefsFor(signature)
-    for result in refs:
-      result.match = filter(
-          lambda match: getattr(match, 'type_id', -1) == KytheXrefKind.OVERRIDDEN_BY,
-          result.match)
-    return filter(lambda result: len(result.match) > 0, refs)
+    # The results returned by GetXrefsFor() may be shared and must not be
+    # modified. Return filtered copies instead.
+    overrides = []
+    for result in self.GetXrefsFor(signature):
+      matches = [
+          match for match in result.match
+          if getattr(match, 'type_id', -1) == KytheXrefKind.OVERRIDDEN_BY
+      ]
+      if not matches:
+        continue
+      override = XrefSearchResult()
+      override.__dict__ = dict(result.Fields(), match=matches)
+      overrides.append(override)
+    return overrides
 
   def GetCallTargets(self, signature):
     # First look up the declaration(s) for the callsite.
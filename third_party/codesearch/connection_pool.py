@@ -0,0 +1,276 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""A small pool of persistent HTTP(S) connections.
+
+The CodeSearch client tends to make many back-to-back requests to the same
+host. Using a new connection for each of these means paying for a TCP and TLS
+handshake every time. ConnectionPool keeps a bounded number of idle
+connections around per host so that subsequent requests can reuse them.
+
+Connections are made directly to the server. ConnectionPool doesn't support
+proxies. Use UsesProxy() to find out whether urlopen() should be used instead.
+"""
+
+import socket
+import threading
+import time
+
+try:
+  from http.client import HTTPConnection, HTTPSConnection, HTTPException, \
+      BadStatusLine, RemoteDisconnected
+  from urllib.error import HTTPError
+  from urllib.parse import urljoin, urlparse
+  from urllib.request import getproxies, proxy_bypass
+
+  # Errors that mean the server closed or reset an idle connection.
+  RETRYABLE_ERRORS = (ConnectionResetError, BrokenPipeError, RemoteDisconnected,
+                      BadStatusLine)
+except ImportError:
+  from httplib import HTTPConnection, HTTPSConnection, HTTPException, \
+      BadStatusLine
+  from urllib import getproxies, proxy_bypass
+  from urllib2 import HTTPError
+  from urlparse import urljoin, urlparse
+
+  RETRYABLE_ERRORS = (socket.error, BadStatusLine)
+
+# Maximum number of redirects that will be followed for a single request.
+MAX_REDIRECTS = 5
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# Redirects that turn a POST into a GET without a body, as urlopen() does.
+# Long requests are sent as a POST, so these need to behave the same whether
+# or not a proxy is involved.
+REDIRECT_TO_GET_CODES = (301, 302, 303)
+
+# Default size of the pieces returned by ConnectionPool.OpenStream().
+DEFAULT_CHUNK_SIZE = 16 * 1024
+
+
+def UsesProxy(url):
+  """Returns True if urlopen() would send requests for |url| through a proxy
+  according to the environment or the system settings."""
+  parsed = urlparse(url)
+  if parsed.scheme not in getproxies():
+    return False
+  return not proxy_bypass(parsed.hostname)
+
+
+class ConnectionPool(object):
+  """A pool of keep-alive connections.
+
+  Idle connections are kept per (scheme, host, port). At most |pool_size| idle
+  connections are retained for each host. Connections that have been idle for
+  longer than |idle_timeout_in_seconds| are discarded instead of being reused
+  since the server is likely to have closed them already.
+
+  If a reused connection turns out to have been closed or reset by the server,
+  the request is retried once on a fresh connection. Other errors, including
+  timeouts, are not retried.
+
+  ConnectionPool is thread safe. Connections are never shared between
+  concurrent requests. If all pooled connections are in use, a new one is
+  created for the duration of the request.
+  """
+
+  def __init__(self,
+               pool_size=4,
+               idle_timeout_in_seconds=60,
+               timeout_in_seconds=3):
+    self.pool_size = pool_size
+    self.idle_timeout_in_seconds = idle_timeout_in_seconds
+    self.timeout_in_seconds = timeout_in_seconds
+
+    # Protects |idle| and |closed|.
+    self.lock = threading.Lock()
+
+    # Map from (scheme, host, port) to a list of (connection, last_used)
+    # tuples. The most recently used connection is at the end of the list.
+    self.idle = {}
+
+    # Number of connections that were created. Useful for figuring out how
+    # effective the pool is.
+    self.connections_created = 0
+
+    # Set once close() has been called. Connections that are released after
+    # that are closed instead of being kept around.
+    self.closed = False
+
+  def Open(self, url, data=None, headers={}):
+    """Send a request for |url| and return the response body as bytes.
+
+    The request is a POST if |data| is not None, and a GET otherwise. Throws
+    an HTTPError if the server responds with an error status.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+      status, reason, response_headers, body = self._Send(url, data, headers)
+      location = response_headers.get('location')
+      if status in REDIRECT_CODES and location:
+        url = urljoin(url, location)
+        if status in REDIRECT_TO_GET_CODES:
+          data = None
+        continue
+
+      if status >= 400:
+        raise HTTPError(url, status, reason, response_headers, None)
+      return body
+
+    raise HTTPError(url, status, 'too many redirects', response_headers, None)
+
+  def OpenStream(self, url, data=None, headers={},
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """Like Open(), but returns the response body incrementally.
+
+    Returns an iterator over the response body as bytes objects of at most
+    |chunk_size| bytes each, yielded as they are received. The connection is
+    returned to the pool once the body has been read in full. It is closed
+    instead if the iterator is abandoned before reaching the end.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+      key, connection, response = self._Begin(url, data, headers)
+      status = response.status
+      response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+      location = response_headers.get('location')
+      if (status in REDIRECT_CODES and location) or status >= 400:
+        self._Finish(key, connection, response)
+        if status >= 400:
+          raise HTTPError(url, status, response.reason, response_headers, None)
+        url = urljoin(url, location)
+        if status in REDIRECT_TO_GET_CODES:
+          data = None
+        continue
+
+      return self._ReadChunks(key, connection, response, chunk_size)
+
+    raise HTTPError(url, status, 'too many redirects', response_headers, None)
+
+  def close(self):
+    """Close all idle connections. Connections of requests that are still in
+    flight are closed once the request completes."""
+    with self.lock:
+      self.closed = True
+      idle = self.idle
+      self.idle = {}
+    for connections in idle.values():
+      for connection, _ in connections:
+        connection.close()
+
+  def _Send(self, url, data, headers):
+    key, connection, response = self._Begin(url, data, headers)
+    response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+    self._Finish(key, connection, response)
+    return response.status, response.reason, response_headers, response.body
+
+  def _Begin(self, url, data, headers):
+    """Sends the request and reads the response status and headers.
+
+    Returns a tuple containing the key for the host, the connection and the
+    HTTPResponse. The caller is responsible for reading the body and then
+    calling _Finish(), or closing the connection.
+    """
+    parsed = urlparse(url)
+    key = (parsed.scheme, parsed.hostname, parsed.port)
+    path = parsed.path or '/'
+    if parsed.query:
+      path = '{}?{}'.format(path, parsed.query)
+    method = 'GET' if data is None else 'POST'
+
+    request_headers = dict(headers)
+    if data is not None:
+      request_headers.setdefault('Content-Type',
+                                 'application/x-www-form-urlencoded')
+
+    connection, reused = self._Acquire(key)
+    try:
+      try:
+        response = self._Exchange(connection, method, path, data,
+                                  request_headers)
+      except RETRYABLE_ERRORS as e:
+        connection.close()
+        # A timeout means the server may well have seen the request. Only
+        # retry if the server closed or reset an idle connection.
+        if not reused or isinstance(e, socket.timeout):
+          raise
+        # Try once more on a new connection.
+        connection = self._Connect(key)
+        response = self._Exchange(connection, method, path, data,
+                                  request_headers)
+    except:
+      connection.close()
+      raise
+    return key, connection, response
+
+  def _Exchange(self, connection, method, path, data, headers):
+    connection.request(method, path, body=data, headers=headers)
+    return connection.getresponse()
+
+  def _Finish(self, key, connection, response):
+    """Reads what's left of the body of |response| into |response.body| and
+    then releases |connection|."""
+    try:
+      response.body = response.read()
+    except:
+      connection.close()
+      raise
+    if response.will_close:
+      connection.close()
+    else:
+      self._Release(key, connection)
+
+  def _ReadChunks(self, key, connection, response, chunk_size):
+    complete = False
+    try:
+      while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+          complete = True
+          break
+        yield chunk
+    finally:
+      if complete:
+        self._Finish(key, connection, response)
+      else:
+        connection.close()
+
+  def _Acquire(self, key):
+    """Returns a tuple containing a connection for |key| and a boolean that is
+    True if the connection is being reused."""
+    now = time.time()
+    stale = []
+    connection = None
+    with self.lock:
+      connections = self.idle.get(key, [])
+      while connections:
+        candidate, last_used = connections.pop()
+        if now - last_used > self.idle_timeout_in_seconds:
+          stale.append(candidate)
+          continue
+        connection = candidate
+        break
+
+    for c in stale:
+      c.close()
+
+    if connection is not None:
+      return connection, True
+    return self._Connect(key), False
+
+  def _Release(self, key, connection):
+    with self.lock:
+      connections = self.idle.setdefault(key, [])
+      if not self.closed and len(connections) < self.pool_size:
+        connections.append((connection, time.time()))
+        return
+    connection.close()
+
+  def _Connect(self, key):
+    scheme, host, port = key
+    with self.lock:
+      self.connections_created += 1
+    if scheme == 'https':
+      return HTTPSConnection(host, port, timeout=self.timeout_in_seconds)
+    return HTTPConnection(host, port, timeout=self.timeout_in_seconds)
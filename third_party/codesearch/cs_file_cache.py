@@ -0,0 +1,108 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""An in-memory cache of CsFile objects.
+
+CodeSearch hands out a single CsFile per file so that the file's contents,
+annotations and indices are only fetched and built once. Keeping every file
+that was ever looked at means that a long running client grows without bound.
+
+CsFileCache keeps the most recently used files within a budget on the number
+of files and on their estimated memory footprint. See CsFile.Footprint(). The
+footprint of a file grows as its annotations are retrieved and its indices are
+built. Call update() when that happens so that the cache can account for it.
+"""
+
+import threading
+
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CsFileCache(object):
+  """A bounded LRU cache of CsFile objects keyed by source relative path."""
+
+  def __init__(self, max_entries=DEFAULT_MAX_ENTRIES,
+               max_bytes=DEFAULT_MAX_BYTES):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+
+    # Protects |store| and |total_bytes|.
+    self.lock = threading.Lock()
+
+    # Map from path to a (CsFile, footprint) tuple. Ordered from least recently
+    # used to most recently used.
+    self.store = OrderedDict()
+    self.total_bytes = 0
+
+  def get(self, path):
+    """Returns the CsFile for |path| or None if there isn't one."""
+    with self.lock:
+      entry = self.store.pop(path, None)
+      if entry is None:
+        return None
+      self.store[path] = entry
+      return entry[0]
+
+  def put(self, path, cs_file):
+    """Store |cs_file| under |path|, evicting least recently used files as
+    necessary."""
+    with self.lock:
+      self._Remove(path)
+      self._Add(path, cs_file)
+      self._Evict()
+
+  def update(self, cs_file):
+    """Account for a change in the footprint of |cs_file|. Does nothing if
+    |cs_file| is not in the cache."""
+    with self.lock:
+      path = cs_file.Path()
+      entry = self.store.get(path)
+      if entry is None or entry[0] is not cs_file:
+        return
+      self.total_bytes -= entry[1]
+      footprint = cs_file.Footprint()
+      self.store[path] = (cs_file, footprint)
+      self.total_bytes += footprint
+      self._Evict()
+
+  def discard(self, path):
+    with self.lock:
+      self._Remove(path)
+
+  def clear(self):
+    with self.lock:
+      self.store.clear()
+      self.total_bytes = 0
+
+  def entry_count(self):
+    with self.lock:
+      return len(self.store)
+
+  def entries(self):
+    """Returns a list of (path, footprint) tuples describing the cached files,
+    from least recently used to most recently used."""
+    with self.lock:
+      return [(path, entry[1]) for path, entry in self.store.items()]
+
+  def _Add(self, path, cs_file):
+    footprint = cs_file.Footprint()
+    self.store[path] = (cs_file, footprint)
+    self.total_bytes += footprint
+
+  def _Remove(self, path):
+    entry = self.store.pop(path, None)
+    if entry is not None:
+      self.total_bytes -= entry[1]
+
+  def _Evict(self):
+    # The most recently used file is kept even if it's over budget on its own.
+    while len(self.store) > 1 and (
+        (self.max_entries is not None and len(self.store) > self.max_entries) or
+        (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+      _, entry = self.store.popitem(last=False)
+      self.total_bytes -= entry[1]
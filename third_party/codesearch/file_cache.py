@@ -4,135 +4,363 @@
 # license that can be found in the LICENSE file or at
 # https://developers.google.com/open-source/licenses/bsd.
 
+import atexit
 import hashlib
-import threading
-import tempfile
 import os
-import datetime
+import shutil
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+# A key/value store that stores objects to disk for 30 minutes.
+#
+# The store is bounded. Once it holds more than |max_entries| entries or more
+# than |max_bytes| bytes of data, the least recently used entries are evicted
+# and their files removed. Only the |max_open_files| most recently used entries
+# keep an open file object. Colder entries are reopened on demand.
+
+# Default limits. These are generous enough to hold the responses for a long
+# editing session while keeping the number of file descriptors and the amount
+# of disk space in check.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_OPEN_FILES = 32
+
 
-# A key/value store that stores objects to disk in temporary objects
-# for 30 minutes.
+# Temporary cache directories that haven't been removed yet. Caches without a
+# |cache_dir| are often never closed, e.g. by the Sublime plugin, so whatever
+# is left here is removed when the interpreter exits.
+_temporary_dirs = set()
+_temporary_dirs_lock = threading.Lock()
 
 
 def StableFilenameForUrl(url):
   return hashlib.sha1(url.encode('utf-8')).hexdigest()
 
 
+def MakeTemporaryCacheDir():
+  """Create a private cache directory that's removed at exit at the latest."""
+  path = tempfile.mkdtemp(prefix='codesearch-cache-')
+  with _temporary_dirs_lock:
+    _temporary_dirs.add(path)
+  return path
+
+
+def RemoveTemporaryCacheDir(path):
+  """Remove a directory created by MakeTemporaryCacheDir()."""
+  with _temporary_dirs_lock:
+    _temporary_dirs.discard(path)
+  shutil.rmtree(path, ignore_errors=True)
+
+
+@atexit.register
+def _RemoveTemporaryCacheDirs():
+  with _temporary_dirs_lock:
+    paths = list(_temporary_dirs)
+  for path in paths:
+    RemoveTemporaryCacheDir(path)
+
+
+class _Entry(object):
+  """Bookkeeping for a single cached response."""
+
+  __slots__ = ('f', 'timestamp', 'size')
+
+  def __init__(self, f, timestamp, size):
+    # Open file object or None if the file is currently closed.
+    self.f = f
+
+    # Creation time as returned by time.time().
+    self.timestamp = timestamp
+
+    # Size of the cached data in bytes.
+    self.size = size
+
+
 class FileCache:
 
-  def __init__(self, cache_dir=None, expiration_in_seconds=1800):
+  def __init__(self,
+               cache_dir=None,
+               expiration_in_seconds=1800,
+               max_staleness_in_seconds=0,
+               max_bytes=DEFAULT_MAX_BYTES,
+               max_entries=DEFAULT_MAX_ENTRIES,
+               max_open_files=DEFAULT_MAX_OPEN_FILES):
+    """Construct a FileCache.
 
-    # Protects |self| but individual file objects in |store| are not
-    # protected once its returned from |_file_for|.
+    Args:
+      cache_dir: Directory containing cache files. If this is None, a
+          temporary directory is used which is removed when the cache is
+          closed or when the interpreter exits, whichever comes first.
+      expiration_in_seconds: Entries older than this are stale.
+      max_staleness_in_seconds: Stale entries are kept around for this much
+          longer and can be retrieved via lookup(). Entries that are older
+          than both combined are discarded.
+      max_bytes: Maximum total size of cached data. None for no limit.
+      max_entries: Maximum number of cached entries. None for no limit.
+      max_open_files: Maximum number of file objects kept open at any time.
+    """
+
+    # Protects |self|, including the file objects in |store|.
     self.lock = threading.Lock()
 
-    # Dictionary mapping a URL to a tuple containing a file object and a
-    # timestamp. The timestamp notes the creation time.
-    self.store = {}
+    # Map from StableFilenameForUrl(url) to an _Entry. Ordered from least
+    # recently used to most recently used.
+    self.store = OrderedDict()
+
+    # Subset of |store| containing entries with an open file object. Ordered
+    # from least recently used to most recently used.
+    self.open_entries = OrderedDict()
+
+    # Sum of the sizes of all entries in |store|.
+    self.total_bytes = 0
+
+    # Number of entries that were evicted to stay within the limits.
+    self.evictions = 0
+
+    # Set once close() has been called.
+    self.closed = False
+
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.max_open_files = max(1, max_open_files)
+
+    self.expiration_in_seconds = expiration_in_seconds
+    self.max_staleness_in_seconds = max_staleness_in_seconds
+
+    # True if |cache_dir| was created by us and should be removed on close().
+    self.is_temporary = cache_dir is None
+
+    if cache_dir is None:
+      cache_dir = MakeTemporaryCacheDir()
+    elif not os.path.exists(cache_dir):
+      if not os.path.isabs(cache_dir):
+        raise ValueError('|cache_dir| should be an absolute path')
+      os.makedirs(cache_dir)
 
-    # Directory containing cache files. If |cache_dir| is None, then each
-    # file is created independently using tempfile.TemporaryFile().
+    # Directory containing cache files.
     self.cache_dir = cache_dir
 
-    self.expiration = datetime.timedelta(seconds=expiration_in_seconds)
+    if not self.is_temporary:
+      self._LoadExistingEntries()
 
     # Garbage collector timer.
     # Add 2 seconds so that file timestamp comparisons will work as expected on
     # filesystems where timestamps aren't very accurate.
-    self.timer = threading.Timer(self.expiration.total_seconds() + 2, self.gc)
+    self.timer = threading.Timer(self._RetentionInSeconds() + 2, self.gc)
+    self.timer.daemon = True
     self.timer.start()
 
-    if cache_dir and not os.path.exists(cache_dir):
-      if not os.path.isabs(cache_dir):
-        raise ValueError('|cache_dir| should be an absolute path')
-      os.makedirs(cache_dir)
+  def put(self, url, data):
+    """Store |data| as the response for |url|."""
+    key = StableFilenameForUrl(url)
+    with self.lock:
+      if self.closed:
+        return
+      entry = self.store.pop(key, None)
+      if entry is not None:
+        self._Forget(key, entry)
+
+      f = open(self._PathFor(key), 'w+b')
+      f.write(data)
+      f.flush()
 
-  def _file_for(self, url, create=False):
+      entry = _Entry(f, time.time(), len(data))
+      self.store[key] = entry
+      self.total_bytes += entry.size
+      self.open_entries[key] = entry
+      self._CloseColdFiles()
+      self._Evict()
+
+  def get(self, url):
+    """Get response data for |url|. Stale entries are not returned."""
+    data, is_stale = self.lookup(url)
+    return '' if is_stale else data
+
+  def lookup(self, url):
+    """Get response data for |url| along with whether or not it is stale.
+
+    Returns a tuple containing the data and a boolean that is True if the data
+    is older than |expiration_in_seconds|. The data is '' if there is no
+    entry for |url|.
+    """
+    data, is_stale, _ = self.lookup_timestamped(url)
+    return data, is_stale
+
+  def lookup_timestamped(self, url):
+    """Like lookup(), but also returns the time at which the data was written
+    as the third element of the tuple. The time is None if there is no entry
+    for |url|."""
+    key = StableFilenameForUrl(url)
     with self.lock:
-      if url in self.store:
-        f, _ = self.store[url]
-        f.seek(0)
+      if self.closed:
+        return '', False, None
+      entry = self.store.pop(key, None)
+      adopted = False
+      if entry is None:
+        entry = self._AdoptFile(key)
+        if entry is None:
+          return '', False, None
+        adopted = True
 
-      elif create and self.cache_dir is None:
-        f = tempfile.TemporaryFile(mode='w+b')
+      age = time.time() - entry.timestamp
+      if age > self._RetentionInSeconds():
+        self._Discard(key, entry)
+        return '', False, None
+
+      self.store[key] = entry
+      try:
+        f = self._Open(key, entry)
         f.seek(0)
+        data = f.read()
+      except (IOError, OSError):
+        # The file went away underneath us.
+        del self.store[key]
+        self._Discard(key, entry)
+        return '', False, None
 
-      elif self.cache_dir:
-        deterministic_filename = os.path.join(self.cache_dir,
-                                              StableFilenameForUrl(url))
-        if os.path.exists(deterministic_filename):
-          st = os.stat(deterministic_filename)
-          if create:
-            f = open(deterministic_filename, 'w+b')
-          elif datetime.datetime.utcfromtimestamp(st.st_mtime) + \
-                  self.expiration > datetime.datetime.utcnow():
-            f = open(deterministic_filename, 'r+b')
-            self.store[url] = (f,
-                               datetime.datetime.utcfromtimestamp(st.st_mtime))
-          else:
-            # Existing file has expired.
-            os.remove(deterministic_filename)
-            return None
-        else:
-          if create:
-            f = open(deterministic_filename, 'w+b')
-          else:
-            return None
-      else:
-        return None
-
-      if url not in self.store:
-        self.store[url] = (f, datetime.datetime.now())
-      return f
+      if adopted:
+        # The adopted file counts against the budget just like one that was
+        # put().
+        self._Evict()
+      return data, age > self.expiration_in_seconds, entry.timestamp
 
-  def put(self, url, data):
-    """Store |data| as the response for |url|."""
-    f = self._file_for(url, create=True)
-    if f is None:
-      return
+  def size(self):
+    """Return the total size in bytes of the data currently in the cache."""
+    with self.lock:
+      return self.total_bytes
 
-    f.write(data)
-    f.flush()
+  def open_file_count(self):
+    """Return the number of file objects currently held open."""
+    with self.lock:
+      return len(self.open_entries)
 
-  def get(self, url):
-    """Get response data for |url|."""
-    f = self._file_for(url, create=False)
-    if f is None:
-      return ''
-    f.seek(0)
-    return f.read()
+  def entry_count(self):
+    """Return the number of entries currently in the cache."""
+    with self.lock:
+      return len(self.store)
 
   def gc(self):
     """Garbage collect. Should be invoked periodically to keep cache directory clean."""
-    dir_to_purge = None
-    expiration = None
     with self.lock:
-      expired = datetime.datetime.now() - self.expiration
-      remove = []
-      for url, (_, timestamp) in self.store.items():
-        if timestamp < expired:
-          remove.append(url)
-      for url in remove:
-        self.store.pop(url)
+      if self.closed:
+        return
+      expired = time.time() - self._RetentionInSeconds()
+      remove = [
+          key for key, entry in self.store.items() if entry.timestamp < expired
+      ]
+      for key in remove:
+        self._Discard(key, self.store.pop(key))
       self.timer = threading.Timer(15 * 60, self.gc)
+      self.timer.daemon = True
       self.timer.start()
-      dir_to_purge = self.cache_dir
-      expiration = self.expiration
-
-    # This part doesn't require a lock on |self|.
-    if not dir_to_purge:
-      return
+      known = set(self.store.keys())
 
-    now = datetime.datetime.utcnow()
-    for entry in os.listdir(dir_to_purge):
-      full_path = os.path.join(dir_to_purge, entry)
-      st = os.stat(full_path)
-      expires_on = datetime.datetime.utcfromtimestamp(st.st_mtime) + expiration
-      if expires_on < now:
-        os.remove(full_path)
+    # Purge expired files that were left behind by other instances sharing the
+    # same directory. This part doesn't require a lock on |self|.
+    for entry in os.listdir(self.cache_dir):
+      if entry in known:
+        continue
+      full_path = os.path.join(self.cache_dir, entry)
+      try:
+        if os.stat(full_path).st_mtime < expired:
+          os.remove(full_path)
+      except OSError:
+        pass
 
   def close(self):
     """Stop using this FileCache. Should be called for every FileCache instance."""
     self.timer.cancel()
-    for f, _ in self.store.values():
-      f.close()
+    with self.lock:
+      self.closed = True
+      for entry in self.open_entries.values():
+        entry.f.close()
+        entry.f = None
+      self.open_entries.clear()
+      if self.is_temporary:
+        RemoveTemporaryCacheDir(self.cache_dir)
+        self.store.clear()
+        self.total_bytes = 0
+
+  def _RetentionInSeconds(self):
+    return self.expiration_in_seconds + self.max_staleness_in_seconds
+
+  def _PathFor(self, key):
+    return os.path.join(self.cache_dir, key)
+
+  def _LoadExistingEntries(self):
+    """Index the files in |cache_dir| left behind by a previous session."""
+    now = time.time()
+    found = []
+    for key in os.listdir(self.cache_dir):
+      path = self._PathFor(key)
+      try:
+        st = os.stat(path)
+      except OSError:
+        continue
+      if now - st.st_mtime > self._RetentionInSeconds():
+        continue
+      found.append((st.st_mtime, key, st.st_size))
+
+    # Oldest first so that the least recently written files are evicted first.
+    found.sort()
+    with self.lock:
+      for mtime, key, size in found:
+        self.store[key] = _Entry(None, mtime, size)
+        self.total_bytes += size
+      self._Evict()
+
+  def _AdoptFile(self, key):
+    """Returns an _Entry for a file that was written by another instance
+    sharing |cache_dir| or None if there's no such file."""
+    if self.is_temporary:
+      return None
+    try:
+      st = os.stat(self._PathFor(key))
+    except OSError:
+      return None
+    entry = _Entry(None, st.st_mtime, st.st_size)
+    self.total_bytes += entry.size
+    return entry
+
+  def _Open(self, key, entry):
+    """Returns an open file object for |entry|, opening it if necessary."""
+    if entry.f is None:
+      entry.f = open(self._PathFor(key), 'r+b')
+    self.open_entries.pop(key, None)
+    self.open_entries[key] = entry
+    self._CloseColdFiles()
+    return entry.f
+
+  def _CloseColdFiles(self):
+    while len(self.open_entries) > self.max_open_files:
+      _, entry = self.open_entries.popitem(last=False)
+      entry.f.close()
+      entry.f = None
+
+  def _Evict(self):
+    while self.store and (
+        (self.max_entries is not None and len(self.store) > self.max_entries) or
+        (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+      key, entry = self.store.popitem(last=False)
+      self._Discard(key, entry)
+      self.evictions += 1
+
+  def _Forget(self, key, entry):
+    """Release the resources held by |entry| without removing its file. The
+    caller is responsible for removing |entry| from |store|."""
+    if entry.f is not None:
+      entry.f.close()
+      entry.f = None
+    self.open_entries.pop(key, None)
+    self.total_bytes -= entry.size
+
+  def _Discard(self, key, entry):
+    """Like _Forget(), but also removes the file backing |entry|."""
+    self._Forget(key, entry)
+    try:
+      os.remove(self._PathFor(key))
+    except OSError:
+      pass
@@ -30,6 +30,26 @@ def CppIdentifierTokens(s):
   return [token for token in re.split(TOKEN_BOUNDARIES, s) if token]
 
 
+def CompleteCppIdentifierTokens(s):
+  """Returns the C++ identifier tokens in |s| that are delimited on both sides
+  within |s|.
+
+  These are the tokens that are guaranteed to appear whole in any string that
+  contains |s|.
+
+    >>> CompleteCppIdentifierTokens('class-abc::def(')
+    ['abc', 'def']
+
+    >>> CompleteCppIdentifierTokens('abc::def')
+    []
+
+    >>> CompleteCppIdentifierTokens(' abc ')
+    ['abc']
+    """
+  pieces = re.split(TOKEN_BOUNDARIES, s)
+  return [token for token in pieces[1:-1] if token]
+
+
 def MatchSymbolSuffix(haystack_string, needle_string):
   """Returns true if the symbols in |haystack_string| ends with the symbols in |needle_string|.
 
@@ -12,27 +12,185 @@ from .compat import IsString, ToStringSafe
 
 
 class CodeSearchProtoJsonEncoder(json.JSONEncoder):
+  """JSON encoder for Message objects.
 
-  def default(self, o):
-    if isinstance(o, Message):
-      return o.__dict__
-    return o
-
+  Without |indent|, Message objects are handed to the json module one at a
+  time via default(), which keeps the encoding on the fast path of the json
+  module. That fast path isn't available when |indent| is set. In that case
+  the output is produced by _JsonWriter, which walks Message trees directly.
+  """
 
-class CodeSearchProtoJsonSymbolizedEncoder(json.JSONEncoder):
+  SYMBOLIZE = False
 
   def default(self, o):
     if isinstance(o, Message):
-      rv = {}
-      desc = o.__class__.DESCRIPTOR
-      for k, v in o.__dict__.items():
-        if k in desc and not isinstance(desc[k], list) and issubclass(
-            desc[k], Message) and desc[k].IsEnum():
-          rv[k] = desc[k].ToSymbol(v)
-        else:
-          rv[k] = v
-      return rv
-    return o
+      return _FieldsForJson(o, self.SYMBOLIZE)
+    return json.JSONEncoder.default(self, o)
+
+  def iterencode(self, o, _one_shot=False):
+    if self.indent is None:
+      return json.JSONEncoder.iterencode(self, o, _one_shot)
+    return _JsonWriter(self, self.SYMBOLIZE).Write(o)
+
+
+class CodeSearchProtoJsonSymbolizedEncoder(CodeSearchProtoJsonEncoder):
+  """Like CodeSearchProtoJsonEncoder, but emits symbolic names for the values
+  of enum fields. Repeated enum fields are left alone."""
+
+  SYMBOLIZE = True
+
+
+def _FieldsForJson(o, symbolize):
+  """Returns a dictionary of the fields of the Message |o|. If |symbolize| is
+  True, enum values are replaced by their symbolic names."""
+  fields = o.Fields()
+  if not symbolize:
+    return fields
+  enum_fields = _EnumFields(o.__class__)
+  if not enum_fields:
+    return fields
+  for k, enum_type in enum_fields.items():
+    if k in fields:
+      fields[k] = enum_type.ToSymbol(fields[k])
+  return fields
+
+
+# Map from a Message subclass to a dictionary mapping the names of its non
+# repeated enum fields to the enum type. See _EnumFields().
+_ENUM_FIELDS = {}
+
+
+def _EnumFields(cls):
+  enum_fields = _ENUM_FIELDS.get(cls)
+  if enum_fields is None:
+    enum_fields = {}
+    if isinstance(cls.DESCRIPTOR, dict):
+      for k, v in cls.DESCRIPTOR.items():
+        if isinstance(v, type) and issubclass(v, Message) and \
+            v.DESCRIPTOR is not None and v.IsEnum():
+          enum_fields[k] = v
+    _ENUM_FIELDS[cls] = enum_fields
+  return enum_fields
+
+
+class _JsonWriter(object):
+  """Produces the same output as json.JSONEncoder.iterencode() would for
+  |encoder| when |indent| is set, but without the overhead of its generic
+  implementation."""
+
+  def __init__(self, encoder, symbolize):
+    self.encoder = encoder
+    self.symbolize = symbolize
+    indent = encoder.indent
+    if not IsString(indent):
+      indent = ' ' * indent
+    self.indent = indent
+    self.item_separator = encoder.item_separator
+    self.key_separator = encoder.key_separator
+    self.sort_keys = encoder.sort_keys
+    self.encode_string = json.encoder.encode_basestring_ascii \
+        if encoder.ensure_ascii else json.encoder.encode_basestring
+    self.chunks = []
+
+  def Write(self, o):
+    """Returns a list of strings which make up the JSON encoding of |o|."""
+    self._Write(o, 0)
+    return self.chunks
+
+  def _Write(self, o, level):
+    append = self.chunks.append
+    if IsString(o):
+      append(self.encode_string(o))
+    elif o is None:
+      append('null')
+    elif o is True:
+      append('true')
+    elif o is False:
+      append('false')
+    elif isinstance(o, Message):
+      self._WriteDict(_FieldsForJson(o, self.symbolize), level)
+    elif isinstance(o, dict):
+      self._WriteDict(o, level)
+    elif isinstance(o, (list, tuple)):
+      self._WriteList(o, level)
+    elif isinstance(o, float):
+      append(self._FloatString(o))
+    elif isinstance(o, int):
+      append(int.__repr__(o))
+    elif type(o).__name__ == 'long':
+      append(str(o))
+    else:
+      self._Write(self.encoder.default(o), level)
+
+  def _WriteList(self, o, level):
+    append = self.chunks.append
+    if not o:
+      append('[]')
+      return
+    level += 1
+    newline_indent = '\n' + self.indent * level
+    separator = self.item_separator + newline_indent
+    append('[' + newline_indent)
+    first = True
+    for v in o:
+      if not first:
+        append(separator)
+      first = False
+      self._Write(v, level)
+    append('\n' + self.indent * (level - 1) + ']')
+
+  def _WriteDict(self, o, level):
+    append = self.chunks.append
+    if not o:
+      append('{}')
+      return
+    level += 1
+    newline_indent = '\n' + self.indent * level
+    separator = self.item_separator + newline_indent
+    append('{' + newline_indent)
+    items = sorted(o.items()) if self.sort_keys else o.items()
+    first = True
+    for k, v in items:
+      if not IsString(k):
+        k = self._KeyString(k)
+        if k is None:
+          continue
+      if not first:
+        append(separator)
+      first = False
+      append(self.encode_string(k))
+      append(self.key_separator)
+      self._Write(v, level)
+    append('\n' + self.indent * (level - 1) + '}')
+
+  def _KeyString(self, k):
+    if k is True:
+      return 'true'
+    if k is False:
+      return 'false'
+    if k is None:
+      return 'null'
+    if isinstance(k, float):
+      return self._FloatString(k)
+    if isinstance(k, int) or type(k).__name__ == 'long':
+      return str(k)
+    if self.encoder.skipkeys:
+      return None
+    raise TypeError('key {!r} is not a string'.format(k))
+
+  def _FloatString(self, o):
+    if o != o:
+      text = 'NaN'
+    elif o == float('inf'):
+      text = 'Infinity'
+    elif o == -float('inf'):
+      text = '-Infinity'
+    else:
+      return float.__repr__(o)
+    if not self.encoder.allow_nan:
+      raise ValueError(
+          'Out of range float values are not JSON compliant: ' + repr(o))
+    return text
 
 
 def StringifyObject(o, target_type):
@@ -40,7 +198,8 @@ def StringifyObject(o, target_type):
   def stringify_lines(o, level):
     indent = '  ' * level
     lines = [indent + '{']
-    for k, v in vars(o).items():
+    fields = o.Fields() if isinstance(o, Message) else vars(o)
+    for k, v in fields.items():
       if isinstance(v, target_type):
         lines.append(indent + '  {}:'.format(k))
         lines.extend(stringify_lines(v, level + 1))
@@ -52,6 +211,26 @@ def StringifyObject(o, target_type):
   return '\n'.join(stringify_lines(o, 0))
 
 
+# Stands in for a value that isn't there, since None is a valid field value.
+_MISSING = object()
+
+# Name of the slot of compact messages that holds the fields that are not in
+# the DESCRIPTOR. See MakeCompactClass().
+_EXTRA_FIELDS = '_extra_fields'
+
+# Name of the slot of compact messages that's set once they are frozen. See
+# Message.Freeze().
+_FROZEN = '_frozen'
+
+
+class _PendingFields(dict):
+  """Source values of the fields of a lazily decoded message that haven't been
+  accessed yet. |converters| maps each field name to the function that
+  converts its value. See _CompileMessageConverter()."""
+
+  __slots__ = ('converters',)
+
+
 def AttemptToFixupInvalidUtf8(s):
   """Try to recover invalid UTF-8 by replacing invalid bytes.
    
@@ -82,12 +261,80 @@ class Message(object):
   class PARENT_TYPE:
     pass
 
+  # Messages that are decoded lazily keep the source values of fields that
+  # haven't been accessed yet in a dictionary stored under this name in
+  # __dict__. See Coerce().
+  PENDING_FIELDS = '_pending'
+
+  # The compact variant of this class, if there is one. See
+  # MakeCompactClass().
+  COMPACT_CLASS = None
+
+  # True for the read-only variants of Message subclasses. See Freeze().
+  FROZEN = False
+
   def AsQueryString(self):
     values = []
-    for k, v in sorted(self.__dict__.items()):
+    for k, v in sorted(self.Fields().items()):
       values.extend(Message.ToQueryString(k, v))
     return values
 
+  def Fields(self):
+    """Returns a dictionary of the fields that are set on this message.
+
+    Use this instead of __dict__ or vars(), which don't include fields that
+    are pending decoding.
+    """
+    pending = self.__dict__.get(Message.PENDING_FIELDS)
+    if pending is not None:
+      for k in list(pending.keys()):
+        getattr(self, k)
+    return dict((k, v)
+                for k, v in self.__dict__.items()
+                if k != Message.PENDING_FIELDS)
+
+  def Freeze(self):
+    """Make this message and the messages nested in it read-only.
+
+    Fields that are pending decoding are decoded first, so that the messages
+    are not modified afterwards. Setting or deleting a field of a frozen
+    message raises an AttributeError. Lists of repeated fields are left as is
+    and must not be modified either.
+    """
+    stack = [self]
+    while stack:
+      o = stack.pop()
+      if isinstance(o, list):
+        stack.extend(o)
+      elif isinstance(o, Message) and not o.FROZEN:
+        stack.extend(o.Fields().values())
+        o._MakeFrozen()
+
+  def _MakeFrozen(self):
+    self.__class__ = _FrozenClass(self.__class__)
+
+  def __getattr__(self, name):
+    # Only invoked if |name| isn't found via the usual means. I.e. if |name|
+    # isn't a decoded field.
+    pending = self.__dict__.get(Message.PENDING_FIELDS)
+    source = _MISSING if pending is None else pending.get(name, _MISSING)
+    if source is not _MISSING:
+      value = pending.converters[name](source)
+
+      # Another thread may be decoding the same field. Both will end up with
+      # the value that's stored first.
+      value = self.__dict__.setdefault(name, value)
+      pending.pop(name, None)
+      if not pending:
+        self.__dict__.pop(Message.PENDING_FIELDS, None)
+      return value
+
+    # The field may have been decoded by another thread in the meantime.
+    value = self.__dict__.get(name, _MISSING)
+    if value is _MISSING:
+      raise AttributeError(name)
+    return value
+
   def __str__(self):
     return StringifyObject(self, Message)
 
@@ -107,53 +354,23 @@ class Message(object):
     return [(k, str(o))]
 
   @staticmethod
-  def Coerce(source, target_type, parent_class=None):
-    if isinstance(target_type, list):
-      assert isinstance(source, list)
-      assert len(target_type) == 1
-      target_type = target_type[0]
-
-      return [Message.Coerce(x, target_type, parent_class) for x in source]
+  def Coerce(source, target_type, parent_class=None, lazy=False, compact=False):
+    """Convert |source| into an object of type |target_type|.
 
-    if target_type == Message.PARENT_TYPE:
+    If |lazy| is True, fields of |Message| types are converted when they are
+    first accessed rather than right away. Such messages behave the same as
+    ones that are converted eagerly, except that __dict__ and vars() only
+    contain the fields that have been accessed. Use Message.Fields() to get at
+    all of them.
 
-      assert parent_class is not None
+    If |compact| is True, messages of types that have a compact variant are
+    created using that variant instead. See MakeCompactClass(). The fields of
+    compact messages are always converted right away.
 
-      return Message.Coerce(source, parent_class, parent_class)
-
-    if issubclass(target_type, Message):
-      if isinstance(source, target_type):
-        return source
-
-      typespec = target_type.DESCRIPTOR
-      if isinstance(typespec, dict):
-        assert isinstance(
-            source, dict), 'Source is not a dictionary: %s; Mapping to %s' % (
-                source, target_type)
-        dest = target_type()
-        for k, v in source.items():
-          if k in typespec:
-            dest.__dict__[k] = Message.Coerce(v, typespec[k], target_type)
-          else:
-            dest.__dict__[k] = v
-        return dest
-      if typespec is None:
-        assert isinstance(source, dict)
-        m = Message()
-        m.__dict__ = source.copy()
-        return m
-      if sys.version_info[0] == 2:
-        if typespec != str and isinstance(source, basestring) and hasattr(
-            target_type, source):
-          return typespec(getattr(target_type, source))
-      else:
-        if typespec != str and isinstance(source, str) and hasattr(
-            target_type, source):
-          return typespec(getattr(target_type, source))
-      return typespec(source)
-    if target_type == str and IsString(source):
-      return ToStringSafe(source)
-    return target_type(source)
+    The conversion is done by a converter that's compiled once for each
+    combination of |target_type|, |lazy| and |compact|. See _GetConverter().
+    """
+    return _GetConverter(target_type, parent_class, lazy, compact)(source)
 
   @classmethod
   def IsEnum(cls):
@@ -161,27 +378,51 @@ class Message(object):
 
   @classmethod
   def ToSymbol(cls, v):
-    assert cls.IsEnum()
-    for prop, value in vars(cls).items():
-      if value == v:
-        return prop
-    return v
+    """Returns the symbolic name of the enum value |v|, or |v| itself if it
+    doesn't have one."""
+    try:
+      return cls.SymbolTables()[0].get(v, v)
+    except TypeError:
+      # |v| is not hashable and hence not an enum value.
+      return v
 
   @classmethod
   def FromSymbol(cls, s):
-    assert cls.IsEnum()
-    return vars(cls)[s]
+    """Returns the enum value whose symbolic name is |s|. Raises a KeyError
+    if there isn't one."""
+    return cls.SymbolTables()[1][s]
+
+  @classmethod
+  def SymbolTables(cls):
+    """Returns a tuple containing a dictionary mapping the values of the enum
+    |cls| to their symbolic names and one mapping symbolic names to values.
+
+    If several names share a value, the first one that's defined is used.
+    """
+    tables = cls.__dict__.get('_SYMBOL_TABLES')
+    if tables is None:
+      assert cls.IsEnum()
+      to_symbol = {}
+      from_symbol = {}
+      for prop, value in vars(cls).items():
+        if prop.startswith('_') or not isinstance(value, cls.DESCRIPTOR):
+          continue
+        to_symbol.setdefault(value, prop)
+        from_symbol[prop] = value
+      tables = (to_symbol, from_symbol)
+      cls._SYMBOL_TABLES = tables
+    return tables
 
   @classmethod
   def Make(cls, **kwargs):
     return Message.Coerce(kwargs, cls)
 
   @classmethod
-  def FromShallowDict(cls, d):
-    return Message.Coerce(d, cls)
+  def FromShallowDict(cls, d, lazy=False, compact=False):
+    return Message.Coerce(d, cls, lazy=lazy, compact=compact)
 
   @classmethod
-  def FromJsonString(cls, s):
+  def FromJsonString(cls, s, lazy=False, compact=False):
     try:
       if isinstance(s, bytes) or isinstance(s, bytearray):
         s = s.decode(encoding='utf-8')
@@ -216,11 +457,178 @@ Content follows this line: ----
       raise ValueError('Error while decoding JSON response. Report saved to {}'.
                        format(error_file_name))
 
-    return cls.FromShallowDict(d)
+    return cls.FromShallowDict(d, lazy, compact)
 
   DESCRIPTOR = None
 
 
+# Map from (target_type, lazy, compact, is_list) to the function that converts
+# a decoded JSON value into an instance of |target_type|, or a list of them if
+# |is_list| is True. Converters are only added once they are complete. See
+# _GetConverter().
+_CONVERTERS = {}
+
+
+def _GetConverter(target_type, parent_class, lazy, compact):
+  """Returns a function that converts a decoded JSON value as described in
+  Message.Coerce()."""
+  is_list = isinstance(target_type, list)
+  if is_list:
+    assert len(target_type) == 1
+    target_type = target_type[0]
+  if target_type == Message.PARENT_TYPE:
+    assert parent_class is not None
+    target_type = parent_class
+
+  converter = _CONVERTERS.get((target_type, lazy, compact, is_list))
+  if converter is None:
+    # Converters for recursive types refer to themselves. These are collected
+    # in |compiled| and only published once all of them are complete so that
+    # other threads don't see a converter whose field table is still empty.
+    compiled = {}
+    converter = _CompileConverter(target_type, lazy, compact, is_list,
+                                  compiled)
+    _CONVERTERS.update(compiled)
+  return converter
+
+
+def _CompileConverter(target_type, lazy, compact, is_list, compiled):
+  key = (target_type, lazy, compact, is_list)
+  converter = _CONVERTERS.get(key) or compiled.get(key)
+  if converter is not None:
+    return converter
+
+  if is_list:
+    convert_element = _CompileConverter(target_type, lazy, compact, False,
+                                        compiled)
+
+    def ConvertList(source):
+      assert isinstance(source, list)
+      return [convert_element(x) for x in source]
+
+    compiled[key] = ConvertList
+    return ConvertList
+
+  if not (isinstance(target_type, type) and issubclass(target_type, Message)):
+    return _ConvertToString if target_type == str else target_type
+
+  typespec = target_type.DESCRIPTOR
+  if isinstance(typespec, dict):
+    converter = _CompileMessageConverter(target_type, lazy, compact, compiled)
+  elif typespec is None:
+    converter = _ConvertToBareMessage
+  else:
+    converter = _CompileEnumConverter(target_type)
+  compiled[key] = converter
+  return converter
+
+
+def _CompileMessageConverter(target_type, lazy, compact, compiled):
+  typespec = target_type.DESCRIPTOR
+  dest_type = target_type
+  if compact and target_type.COMPACT_CLASS is not None:
+    dest_type = target_type.COMPACT_CLASS
+
+  # Map from field name to the converter for the field. Filled in below, after
+  # the converter for |target_type| has been registered so that recursive
+  # references find it.
+  fields = {}
+
+  def CheckSource(source):
+    assert isinstance(
+        source, dict), 'Source is not a dictionary: %s; Mapping to %s' % (
+            source, target_type)
+
+  if dest_type is not target_type:
+    # Fields in the DESCRIPTOR are set through their slot descriptors, which
+    # skips the __setattr__() of the compact class.
+    setters = dict((k, getattr(dest_type, k).__set__) for k in typespec)
+
+    def Convert(source):
+      if isinstance(source, target_type):
+        return source
+      CheckSource(source)
+      dest = dest_type.__new__(dest_type)
+      for k, v in source.items():
+        convert = fields.get(k)
+        if convert is None:
+          setattr(dest, k, v)
+        else:
+          setters[k](dest, convert(v))
+      return dest
+
+  elif lazy:
+
+    def Convert(source):
+      if isinstance(source, target_type):
+        return source
+      CheckSource(source)
+      dest = target_type.__new__(target_type)
+      d = dest.__dict__
+      pending = _PendingFields()
+      pending.converters = fields
+      for k, v in source.items():
+        if k in fields:
+          pending[k] = v
+        else:
+          d[k] = v
+      if pending:
+        d[Message.PENDING_FIELDS] = pending
+      return dest
+
+  else:
+
+    def Convert(source):
+      if isinstance(source, target_type):
+        return source
+      CheckSource(source)
+      dest = target_type.__new__(target_type)
+      d = dest.__dict__
+      for k, v in source.items():
+        convert = fields.get(k)
+        d[k] = v if convert is None else convert(v)
+      return dest
+
+  compiled[(target_type, lazy, compact, False)] = Convert
+  for k, v in typespec.items():
+    field_type = v
+    if isinstance(field_type, list):
+      field_type = field_type[0]
+    if field_type == Message.PARENT_TYPE:
+      field_type = target_type
+    fields[k] = _CompileConverter(field_type, lazy, compact,
+                                  isinstance(v, list), compiled)
+  return Convert
+
+
+def _CompileEnumConverter(target_type):
+  typespec = target_type.DESCRIPTOR
+  if typespec == str:
+    return typespec
+
+  symbols = target_type.SymbolTables()[1]
+
+  def Convert(source):
+    if IsString(source) and source in symbols:
+      return typespec(symbols[source])
+    return typespec(source)
+
+  return Convert
+
+
+def _ConvertToString(source):
+  if IsString(source):
+    return ToStringSafe(source)
+  return str(source)
+
+
+def _ConvertToBareMessage(source):
+  assert isinstance(source, dict)
+  m = Message()
+  m.__dict__ = source.copy()
+  return m
+
+
 def message(cls):
 
   def Constructor(self, **kwargs):
@@ -232,6 +640,143 @@ def message(cls):
   return cls
 
 
+def MakeCompactClass(cls):
+  """Create the compact variant of the Message subclass |cls|.
+
+  The compact variant is a subclass of |cls| which stores the fields listed
+  in |cls.DESCRIPTOR| in __slots__ rather than in a per-instance __dict__.
+  Fields that are not in the DESCRIPTOR go into a dictionary that's only
+  allocated if there are any. This makes a noticeable difference for types
+  that have many instances.
+
+  Compact messages are created by Message.Coerce() when it's called with
+  |compact|=True. Otherwise they behave like instances of |cls|.
+  """
+  assert isinstance(cls.DESCRIPTOR, dict)
+  slots = tuple(sorted(cls.DESCRIPTOR.keys()))
+  assert _EXTRA_FIELDS not in slots and _FROZEN not in slots
+
+  def Fields(self):
+    fields = {}
+    for k, get in getters:
+      try:
+        fields[k] = get(self)
+      except AttributeError:
+        pass
+    extra = get_extra(self)
+    if extra:
+      fields.update(extra)
+    return fields
+
+  def __getattr__(self, name):
+    # Compact messages are never decoded lazily. Hence a field that's not
+    # found by the usual means is either an extra field or isn't there at all.
+    extra = get_extra(self)
+    if extra is None or name not in extra:
+      raise AttributeError(name)
+    return extra[name]
+
+  def __setattr__(self, name, value):
+    if is_frozen(self):
+      raise AttributeError('{} is frozen'.format(cls.__name__))
+    setter = setters.get(name)
+    if setter is not None:
+      setter(self, value)
+      return
+    extra = get_extra(self)
+    if extra is None:
+      extra = {}
+      set_extra(self, extra)
+    extra[name] = value
+
+  def __delattr__(self, name):
+    if is_frozen(self):
+      raise AttributeError('{} is frozen'.format(cls.__name__))
+    if name in setters:
+      object.__delattr__(self, name)
+      return
+    extra = get_extra(self)
+    if extra is None or name not in extra:
+      raise AttributeError(name)
+    del extra[name]
+
+  def _MakeFrozen(self):
+    # Switching the class like Message._MakeFrozen() does would allocate a
+    # __dict__ on some versions of Python.
+    set_frozen(self, True)
+
+  compact_cls = type('Compact' + cls.__name__, (cls,), {
+      '__slots__': slots + (_EXTRA_FIELDS, _FROZEN),
+      '__module__': cls.__module__,
+      '__doc__': cls.__doc__,
+      'Fields': Fields,
+      '__getattr__': __getattr__,
+      '__setattr__': __setattr__,
+      '__delattr__': __delattr__,
+      '_MakeFrozen': _MakeFrozen,
+      'FROZEN': property(lambda self: is_frozen(self)),
+  })
+
+  # Slot descriptors are used directly since getattr() and setattr() would
+  # end up in the methods above.
+  getters = [(k, getattr(compact_cls, k).__get__) for k in slots]
+  setters = dict((k, getattr(compact_cls, k).__set__) for k in slots)
+  extra_slot = getattr(compact_cls, _EXTRA_FIELDS)
+
+  def get_extra(self):
+    try:
+      return extra_slot.__get__(self)
+    except AttributeError:
+      return None
+
+  set_extra = extra_slot.__set__
+  frozen_slot = getattr(compact_cls, _FROZEN)
+
+  def is_frozen(self):
+    try:
+      return frozen_slot.__get__(self)
+    except AttributeError:
+      return False
+
+  set_frozen = frozen_slot.__set__
+
+  cls.COMPACT_CLASS = compact_cls
+  compact_cls.COMPACT_CLASS = compact_cls
+  return compact_cls
+
+
+# Map from a Message subclass to its frozen variant. See _FrozenClass().
+_FROZEN_CLASSES = {}
+
+
+def _FrozenClass(cls):
+  """Returns the read-only variant of the Message subclass |cls|.
+
+  The frozen variant is a subclass of |cls| without any storage of its own,
+  which allows Message.Freeze() to switch the class of an existing instance.
+  Compact messages have a slot for this instead. See MakeCompactClass().
+  """
+  frozen_cls = _FROZEN_CLASSES.get(cls)
+  if frozen_cls is not None:
+    return frozen_cls
+
+  def __setattr__(self, name, value):
+    raise AttributeError('{} is frozen'.format(cls.__name__))
+
+  def __delattr__(self, name):
+    raise AttributeError('{} is frozen'.format(cls.__name__))
+
+  frozen_cls = type('Frozen' + cls.__name__, (cls,), {
+      '__slots__': (),
+      '__module__': cls.__module__,
+      '__doc__': cls.__doc__,
+      '__setattr__': __setattr__,
+      '__delattr__': __delattr__,
+      'FROZEN': True,
+  })
+  return _FROZEN_CLASSES.setdefault(cls, frozen_cls)
+
+
 class AnnotationTypeValue(Message):
   BLAME = 0x00040
   CODE_FINDINGS = 0x40000
@@ -1252,3 +1797,13 @@ class CompoundRequest(Message):
       'status_request': [StatusRequest],
       'xref_search_request': [XrefSearchRequest],
   }
+
+
+# Types that have a lot of instances in a typical response. These get compact
+# variants. See MakeCompactClass().
+for compact_type in (TextRange, Annotation, XrefSingleMatch, Node):
+  MakeCompactClass(compact_type)
+
+for enum_type in (AnnotationTypeValue, NodeEnumKind, KytheNodeKind, FormatType,
+                  FileType, CodeBlockType, EdgeEnumKind, KytheXrefKind):
+  enum_type.SymbolTables()
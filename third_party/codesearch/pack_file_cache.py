@@ -0,0 +1,427 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""A FileCache compatible store that keeps all responses in a single file.
+
+FileCache stores each response in a file of its own. Shared cache directories
+can end up with hundreds of thousands of files, which makes listing and
+stat-ing the directory slow and wastes inodes and disk space. CodeSearch
+responses are JSON and compress very well.
+
+PackFileCache instead appends zlib compressed responses to a single pack file.
+Each record in the pack consists of a fixed size header followed by the
+compressed payload:
+
+    magic       4 bytes   RECORD_MAGIC
+    key        20 bytes   SHA1 digest of the URL
+    timestamp   8 bytes   Creation time as a double (seconds since the epoch)
+    stored      4 bytes   Size of the compressed payload
+    size        4 bytes   Size of the uncompressed payload
+
+The index mapping keys to record offsets is kept in memory and is rebuilt by
+scanning the record headers when the pack is opened. Payloads are read through
+a read-only mmap of the pack.
+
+Records are never modified in place. Newer records for the same key supersede
+older ones. Superseded, expired and evicted records are reclaimed by compact(),
+which rewrites the pack when more than half of it is dead.
+
+Several instances, including ones in different processes, can share a pack.
+Each record is appended with a single write() to a file opened with O_APPEND
+and other instances pick up new records when they miss in their index. A
+compaction that races with a write from another instance may drop the latter.
+Since this is a cache, that only results in a spurious cache miss.
+
+The pack is never truncated, since the end of the file may be a record that
+another instance is still writing. A record is only indexed once it's followed
+by the end of the pack or by another record. What's left of a record whose
+writer crashed is skipped by searching for the next RECORD_MAGIC, and is
+reclaimed by the next compaction.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+from .file_cache import (DEFAULT_MAX_BYTES, DEFAULT_MAX_ENTRIES,
+                         MakeTemporaryCacheDir, RemoveTemporaryCacheDir)
+
+RECORD_MAGIC = b'CSP1'
+
+RECORD_HEADER = struct.Struct('<4s20sdII')
+
+# Name of the pack file inside the cache directory.
+PACK_FILENAME = 'responses.pack'
+
+
+def KeyForUrl(url):
+  return hashlib.sha1(url.encode('utf-8')).digest()
+
+
+class _Record(object):
+  """Location of a single response in the pack."""
+
+  __slots__ = ('offset', 'stored', 'size', 'timestamp')
+
+  def __init__(self, offset, stored, size, timestamp):
+    # Offset of the compressed payload. The header precedes it.
+    self.offset = offset
+    self.stored = stored
+    self.size = size
+    self.timestamp = timestamp
+
+
+class PackFileCache(object):
+
+  def __init__(self,
+               cache_dir=None,
+               expiration_in_seconds=1800,
+               max_staleness_in_seconds=0,
+               max_bytes=DEFAULT_MAX_BYTES,
+               max_entries=DEFAULT_MAX_ENTRIES,
+               compression_level=6):
+    """Construct a PackFileCache.
+
+    Args:
+      cache_dir: Directory containing the pack file. If this is None, a
+          temporary directory is used which is removed when the cache is
+          closed or when the interpreter exits.
+      expiration_in_seconds: Entries older than this are stale.
+      max_staleness_in_seconds: How much longer stale entries are kept around.
+          See FileCache.
+      max_bytes: Maximum total size of the compressed data that's kept live.
+          None for no limit.
+      max_entries: Maximum number of live entries. None for no limit.
+      compression_level: zlib compression level.
+    """
+
+    # Protects |self|.
+    self.lock = threading.Lock()
+
+    # Map from KeyForUrl(url) to a _Record. Ordered from least recently used to
+    # most recently used.
+    self.index = OrderedDict()
+
+    # Sum of the compressed sizes of all records in |index|.
+    self.live_bytes = 0
+
+    # Number of entries that were evicted to stay within the limits.
+    self.evictions = 0
+
+    self.closed = False
+
+    self.max_bytes = max_bytes
+    self.max_entries = max_entries
+    self.expiration_in_seconds = expiration_in_seconds
+    self.max_staleness_in_seconds = max_staleness_in_seconds
+    self.compression_level = compression_level
+
+    # True if |cache_dir| was created by us and should be removed on close().
+    self.is_temporary = cache_dir is None
+
+    if cache_dir is None:
+      cache_dir = MakeTemporaryCacheDir()
+    elif not os.path.exists(cache_dir):
+      if not os.path.isabs(cache_dir):
+        raise ValueError('|cache_dir| should be an absolute path')
+      os.makedirs(cache_dir)
+
+    self.cache_dir = cache_dir
+    self.path = os.path.join(cache_dir, PACK_FILENAME)
+
+    # File descriptor, identity and read-only mapping of the pack. |end| is
+    # the offset just past the last record that has been indexed.
+    self.fd = None
+    self.inode = None
+    self.map = None
+    self.map_size = 0
+    self.end = 0
+
+    with self.lock:
+      self._OpenPack()
+      self._Evict()
+
+    self.timer = threading.Timer(15 * 60, self.gc)
+    self.timer.daemon = True
+    self.timer.start()
+
+  def put(self, url, data):
+    """Store |data| as the response for |url|."""
+    key = KeyForUrl(url)
+    payload = zlib.compress(data, self.compression_level)
+    timestamp = time.time()
+    header = RECORD_HEADER.pack(RECORD_MAGIC, key, timestamp, len(payload),
+                                len(data))
+    record = header + payload
+    with self.lock:
+      if self.closed:
+        return
+      self._CheckIdentity()
+      written = 0
+      while written < len(record):
+        written += os.write(self.fd, record[written:])
+      end = os.lseek(self.fd, 0, os.SEEK_CUR)
+      start = end - len(record)
+
+      if start == self.end:
+        self._Insert(key,
+                     _Record(start + RECORD_HEADER.size, len(payload),
+                             len(data), timestamp))
+        self.end = end
+      else:
+        # Another instance appended records in the meantime.
+        self._Scan()
+      self._Evict()
+
+  def get(self, url):
+    """Get response data for |url|. Stale entries are not returned."""
+    data, is_stale = self.lookup(url)
+    return '' if is_stale else data
+
+  def lookup(self, url):
+    """Get response data for |url| along with whether or not it is stale. See
+    FileCache.lookup()."""
+    data, is_stale, _ = self.lookup_timestamped(url)
+    return data, is_stale
+
+  def lookup_timestamped(self, url):
+    """See FileCache.lookup_timestamped()."""
+    key = KeyForUrl(url)
+    with self.lock:
+      if self.closed:
+        return '', False, None
+      record = self.index.get(key)
+      if record is None:
+        self._CheckIdentity()
+        if self._Size() > self.end:
+          self._Scan()
+        record = self.index.get(key)
+        if record is None:
+          return '', False, None
+
+      age = time.time() - record.timestamp
+      if age > self._RetentionInSeconds():
+        self._Remove(key)
+        return '', False, None
+
+      self._Insert(key, self._Remove(key))
+      if record.offset + record.stored > self.map_size:
+        self._Map()
+      payload = self.map[record.offset:record.offset + record.stored]
+
+    try:
+      return (zlib.decompress(payload), age > self.expiration_in_seconds,
+              record.timestamp)
+    except zlib.error:
+      with self.lock:
+        if self.index.get(key) is record:
+          self._Remove(key)
+      return '', False, None
+
+  def size(self):
+    """Return the total compressed size in bytes of the live entries."""
+    with self.lock:
+      return self.live_bytes
+
+  def entry_count(self):
+    """Return the number of live entries."""
+    with self.lock:
+      return len(self.index)
+
+  def pack_size(self):
+    """Return the size of the pack file including dead records."""
+    with self.lock:
+      return self.end
+
+  def gc(self):
+    """Drop expired entries and compact the pack if it's mostly dead."""
+    with self.lock:
+      if self.closed:
+        return
+      expired = time.time() - self._RetentionInSeconds()
+      for key in [k for k, r in self.index.items() if r.timestamp < expired]:
+        self._Remove(key)
+      if self._DeadBytes() > self.end // 2:
+        self._Compact()
+      self.timer = threading.Timer(15 * 60, self.gc)
+      self.timer.daemon = True
+      self.timer.start()
+
+  def compact(self):
+    """Rewrite the pack so that it only contains live entries."""
+    with self.lock:
+      if not self.closed:
+        self._Compact()
+
+  def close(self):
+    """Stop using this PackFileCache. Should be called for every instance."""
+    self.timer.cancel()
+    with self.lock:
+      if self.closed:
+        return
+      self.closed = True
+      self._ClosePack()
+      self.index.clear()
+      self.live_bytes = 0
+      if self.is_temporary:
+        RemoveTemporaryCacheDir(self.cache_dir)
+
+  def _RetentionInSeconds(self):
+    return self.expiration_in_seconds + self.max_staleness_in_seconds
+
+  def _OpenPack(self):
+    flags = os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+    self.fd = os.open(self.path, flags, 0o644)
+    self.inode = os.fstat(self.fd).st_ino
+    self.index.clear()
+    self.live_bytes = 0
+    self.end = 0
+    self._Scan()
+
+  def _ClosePack(self):
+    if self.map is not None:
+      self.map.close()
+      self.map = None
+      self.map_size = 0
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+  def _CheckIdentity(self):
+    """Reopen the pack if another instance replaced it by compacting it."""
+    try:
+      inode = os.stat(self.path).st_ino
+    except OSError:
+      inode = None
+    if inode != self.inode:
+      self._ClosePack()
+      self._OpenPack()
+
+  def _Size(self):
+    return os.fstat(self.fd).st_size
+
+  def _Map(self):
+    size = self._Size()
+    if self.map is not None:
+      self.map.close()
+      self.map = None
+    self.map_size = 0
+    if size == 0:
+      return
+    self.map = mmap.mmap(self.fd, size, access=mmap.ACCESS_READ)
+    self.map_size = size
+
+  def _Scan(self):
+    """Index the records between |end| and the end of the pack.
+
+    Scanning stops at a record that's incomplete and not followed by another
+    record, since it may still be being written. |end| is left pointing at it
+    so that the next scan picks it up.
+    """
+    self._Map()
+    now = time.time()
+    offset = self.end
+    while offset + RECORD_HEADER.size <= self.map_size:
+      magic, key, timestamp, stored, size = RECORD_HEADER.unpack_from(
+          self.map, offset)
+      payload_offset = offset + RECORD_HEADER.size
+      next_offset = payload_offset + stored
+      if magic == RECORD_MAGIC and self._IsFollowedByRecord(next_offset):
+        offset = next_offset
+        if now - timestamp > self._RetentionInSeconds():
+          continue
+        if key in self.index:
+          self._Remove(key)
+        self._Insert(key, _Record(payload_offset, stored, size, timestamp))
+        continue
+
+      if magic == RECORD_MAGIC and next_offset > self.map_size and \
+          self.map.find(RECORD_MAGIC, payload_offset) == -1:
+        # Possibly a record that is still being written.
+        break
+
+      # Not a record, or one that was abandoned by its writer and overlaps the
+      # records after it. Skip to the next record.
+      next_record = self.map.find(RECORD_MAGIC, offset + 1)
+      if next_record == -1:
+        break
+      offset = next_record
+    self.end = offset
+
+  def _IsFollowedByRecord(self, offset):
+    """Returns True if |offset| is the end of the pack or the start of a
+    record. A record that is being written may not have its magic in place
+    yet, so a partial magic at the end of the pack counts too."""
+    if offset > self.map_size:
+      return False
+    following = self.map[offset:offset + len(RECORD_MAGIC)]
+    return RECORD_MAGIC.startswith(following)
+
+  def _Insert(self, key, record):
+    if key in self.index:
+      self._Remove(key)
+    self.index[key] = record
+    self.live_bytes += record.stored
+
+  def _Remove(self, key):
+    record = self.index.pop(key)
+    self.live_bytes -= record.stored
+    return record
+
+  def _DeadBytes(self):
+    return self.end - self.live_bytes - len(self.index) * RECORD_HEADER.size
+
+  def _Evict(self):
+    while self.index and (
+        (self.max_entries is not None and len(self.index) > self.max_entries) or
+        (self.max_bytes is not None and self.live_bytes > self.max_bytes)):
+      key = next(iter(self.index))
+      self._Remove(key)
+      self.evictions += 1
+
+  def _Compact(self):
+    if self._DeadBytes() == 0:
+      return
+    if self.map_size < self.end:
+      self._Map()
+
+    # Each compaction gets its own temporary file. Otherwise two processes
+    # compacting the same pack could interleave their records.
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(self.path)),
+        prefix=os.path.basename(self.path) + '.',
+        suffix='.tmp')
+    records = list(self.index.items())
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        for key, record in records:
+          f.write(
+              RECORD_HEADER.pack(RECORD_MAGIC, key, record.timestamp,
+                                 record.stored, record.size))
+          f.write(self.map[record.offset:record.offset + record.stored])
+
+      # mkstemp() creates the file readable by the owner only. Keep the
+      # permissions of the pack being replaced.
+      if os.path.exists(self.path):
+        os.chmod(temp_path, os.stat(self.path).st_mode & 0o7777)
+    except:
+      os.remove(temp_path)
+      raise
+
+    self._ClosePack()
+    if hasattr(os, 'replace'):
+      os.replace(temp_path, self.path)
+    else:
+      if os.path.exists(self.path):
+        os.remove(self.path)
+      os.rename(temp_path, self.path)
+    self._OpenPack()
@@ -0,0 +1,120 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""An in-memory cache of decoded responses.
+
+A hit in the disk cache still needs to parse the JSON response and convert it
+into Message objects, which dominates the cost of a cache hit for large
+annotation and xref responses. ResponseCache sits in front of the disk cache
+and holds on to the decoded CompoundResponse objects instead.
+
+Responses returned from the cache are shared by all callers. CodeSearch
+freezes them before they are stored (see Message.Freeze()), so an attempt to
+modify a message raises an AttributeError. The lists of repeated fields can't
+be frozen. Callers that need to modify one must make a copy first.
+
+A response is only reused for requests with the same result limits. Unlike
+the disk cache, which cuts down a larger response to the requested limits,
+the decoded response would have to be copied to do so.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class _Entry(object):
+  __slots__ = ('limits', 'response', 'size', 'timestamp')
+
+  def __init__(self, limits, response, size, timestamp):
+    self.limits = limits
+    self.response = response
+    self.size = size
+    self.timestamp = timestamp
+
+
+class ResponseCache(object):
+  """A bounded LRU cache of decoded responses keyed by RequestCacheKey.
+
+  The size of an entry is approximated by the size of the JSON it was decoded
+  from. Entries older than |expiration_in_seconds| are not returned so that the
+  caller goes back to the disk cache, which knows how to deal with expired
+  responses.
+  """
+
+  def __init__(self,
+               max_entries=DEFAULT_MAX_ENTRIES,
+               max_bytes=DEFAULT_MAX_BYTES,
+               expiration_in_seconds=1800):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.expiration_in_seconds = expiration_in_seconds
+
+    # Protects |store| and |total_bytes|.
+    self.lock = threading.Lock()
+
+    # Map from RequestCacheKey.key to an _Entry. Ordered from least recently
+    # used to most recently used.
+    self.store = OrderedDict()
+    self.total_bytes = 0
+
+  def get(self, cache_key):
+    """Returns the decoded response for the RequestCacheKey |cache_key| or None
+    if there isn't one."""
+    with self.lock:
+      entry = self.store.get(cache_key.key)
+      if entry is None:
+        return None
+      if time.time() - entry.timestamp > self.expiration_in_seconds:
+        self._Remove(cache_key.key)
+        return None
+      # A miss due to different limits doesn't count as a use. Otherwise
+      # requests that only differ in their limits would keep each other's
+      # entries alive without ever hitting them.
+      if entry.limits != cache_key.limits:
+        return None
+      self.store[cache_key.key] = self.store.pop(cache_key.key)
+      return entry.response
+
+  def put(self, cache_key, response, size, timestamp=None):
+    """Store the decoded |response| under the RequestCacheKey |cache_key|.
+    |size| is the size of the encoded response in bytes.
+
+    |timestamp| is the time at which the response was received from the
+    server, and defaults to now. Pass the time at which the disk cache entry
+    was written when decoding a response from the disk cache so that the
+    entry expires along with it.
+    """
+    if timestamp is None:
+      timestamp = time.time()
+    with self.lock:
+      self._Remove(cache_key.key)
+      self.store[cache_key.key] = _Entry(cache_key.limits, response, size,
+                                         timestamp)
+      self.total_bytes += size
+      while self.store and (len(self.store) > self.max_entries or
+                            self.total_bytes > self.max_bytes):
+        _, entry = self.store.popitem(last=False)
+        self.total_bytes -= entry.size
+
+  def discard(self, key):
+    """Forget the response stored under |key|, which is a RequestCacheKey.key
+    value."""
+    with self.lock:
+      self._Remove(key)
+
+  def clear(self):
+    with self.lock:
+      self.store.clear()
+      self.total_bytes = 0
+
+  def _Remove(self, key):
+    entry = self.store.pop(key, None)
+    if entry is not None:
+      self.total_bytes -= entry.size
@@ -0,0 +1,187 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""Incremental decoding of large CodeSearch responses.
+
+Xref and search responses for popular symbols can run into megabytes, nearly
+all of which is a single array of results. Decoding such a response with
+Message.FromJsonString() means waiting for the whole body to arrive, parsing
+all of it and then converting every result into Message objects, including
+the ones that the caller is going to throw away.
+
+ArrayElementDecoder instead picks out the elements of a named array as the
+response body trickles in. Each element is decoded as soon as the text for it
+is complete, and is handed out as a plain dictionary. It is up to the caller
+to decide which of them are worth turning into Message objects.
+"""
+
+import json
+import re
+
+# Characters that may appear between array elements.
+_SEPARATORS = ' \t\r\n,'
+
+# Characters that change the nesting depth or start a string.
+_STRUCTURE = re.compile(r'[][{}"]')
+
+# Characters that end or escape within a string.
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+# Characters that end a number or a literal inside an array.
+_SCALAR_END = re.compile(r'[\s,\]]')
+
+
+class ArrayElementDecoder(object):
+  """Incrementally decodes the elements of a JSON array.
+
+  The array is the value of the first field named |field_name| in a JSON
+  document. The document is fed in as str pieces using Feed(), which returns
+  the elements that were completed by that piece. The rest of the document is
+  only scanned, not decoded.
+
+  Each piece is scanned once. The decoder keeps track of the nesting depth
+  and of whether it's inside a string, and only decodes an element once the
+  text for it is complete.
+
+  E.g.:
+  >>> decoder = ArrayElementDecoder('search_result')
+  >>> decoder.Feed('{"search_result": [{"a": 1}, {"b"')
+  [{'a': 1}]
+  >>> decoder.Feed(': 2}]}')
+  [{'b': 2}]
+  """
+
+  def __init__(self, field_name):
+    # Quotes that appear inside JSON strings are always escaped. Hence this
+    # can't match the contents of a string.
+    self.pattern = re.compile(r'"{}"\s*:\s*\['.format(re.escape(field_name)))
+
+    # Text preceding the array that hasn't been matched yet.
+    self.buffer = ''
+
+    # True once the start of the array has been found, and True once the end
+    # of the array has been reached, respectively.
+    self.in_array = False
+    self.done = False
+
+    # True while an element is being received, and its text so far in pieces.
+    self.in_element = False
+    self.pieces = []
+
+    # Scanner state for the element that's being received. |depth| is the
+    # number of open arrays and objects. |escaped| is True if the last piece
+    # ended in the middle of an escape sequence.
+    self.depth = 0
+    self.in_string = False
+    self.escaped = False
+    self.in_scalar = False
+
+    self.decoder = json.JSONDecoder()
+
+  def Feed(self, text):
+    """Add |text| to the document and return a list of the array elements
+    that are now complete."""
+    if self.done:
+      return []
+
+    if not self.in_array:
+      self.buffer += text
+      match = self.pattern.search(self.buffer)
+      if match is None:
+        # Hang on to enough text to match a field name that's split across
+        # pieces.
+        self.buffer = self.buffer[-(len(self.pattern.pattern) + 64):]
+        return []
+      self.in_array = True
+      text = self.buffer[match.end():]
+      self.buffer = ''
+
+    elements = []
+    position = 0
+    start = 0
+    while position < len(text):
+      if not self.in_element:
+        while position < len(text) and text[position] in _SEPARATORS:
+          position += 1
+        if position == len(text):
+          break
+        c = text[position]
+        if c == ']':
+          self.done = True
+          break
+        start = position
+        self.in_element = True
+        if c == '"':
+          self.in_string = True
+          position += 1
+        elif c in '[{':
+          self.depth = 1
+          position += 1
+        else:
+          self.in_scalar = True
+
+      end = self._Scan(text, position)
+      if end is None:
+        self.pieces.append(text[start:])
+        break
+      self.pieces.append(text[start:end])
+      elements.append(self.decoder.decode(''.join(self.pieces)))
+      self.in_element = False
+      self.pieces = []
+      position = end
+    return elements
+
+  def _Scan(self, text, position):
+    """Scan the current element in |text| from |position| on. Returns the
+    position just past the end of the element or None if it continues beyond
+    |text|."""
+    if self.in_scalar:
+      match = _SCALAR_END.search(text, position)
+      if match is None:
+        return None
+      self.in_scalar = False
+      return match.start()
+
+    while True:
+      if self.in_string:
+        if self.escaped:
+          if position == len(text):
+            return None
+          position += 1
+          self.escaped = False
+        match = _STRING_SPECIAL.search(text, position)
+        if match is None:
+          return None
+        position = match.end()
+        if match.group() == '\\':
+          self.escaped = True
+          continue
+        self.in_string = False
+        if self.depth == 0:
+          return position
+        continue
+
+      match = _STRUCTURE.search(text, position)
+      if match is None:
+        return None
+      position = match.end()
+      c = match.group()
+      if c == '"':
+        self.in_string = True
+      elif c in '[{':
+        self.depth += 1
+      else:
+        self.depth -= 1
+        if self.depth == 0:
+          return position
+
+  def Close(self):
+    """Signal the end of the document. Raises a ValueError if the array was
+    not terminated."""
+    if self.in_array and not self.done:
+      raise ValueError('Truncated array in JSON document')
+    self.buffer = ''
+    self.pieces = []
+    self.done = True
@@ -0,0 +1,149 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+"""Symbol lookups over the annotations of a file.
+
+Looking up a symbol in a file used to mean slicing out the text of every
+annotation in the file and matching it against the symbol. For a symbol search
+this is repeated for every file in the search results.
+
+Most of that work is redundant. The same identifiers are annotated over and
+over again in a file, so there are far fewer distinct annotation texts than
+there are annotations. SymbolIndex tokenizes each distinct text once and maps
+its last identifier token to the text, which turns a suffix match into a
+dictionary lookup. Substring matches are checked once per distinct text.
+
+The signatures of annotations are indexed by their identifier tokens in the
+same way, but only on first use since few callers look inside signatures.
+"""
+
+from .language_utils import CompleteCppIdentifierTokens, CppIdentifierTokens
+
+
+class _Text(object):
+  """A distinct annotation text, along with the positions of the annotations
+  that it belongs to."""
+
+  __slots__ = ('text', 'tokens', 'positions')
+
+  def __init__(self, text):
+    self.text = text
+    self.tokens = CppIdentifierTokens(text)
+    self.positions = []
+
+
+class SymbolIndex(object):
+  """An index over the annotations of |cs_file|, which is a CsFile.
+
+  Only annotations that have a signature are indexed. Annotations that are
+  returned by lookups are in the order in which they appear in the list of
+  annotations for the file.
+  """
+
+  def __init__(self, cs_file):
+    self.annotations = cs_file.GetAnnotations()
+
+    # Map from annotation text to a _Text.
+    self.texts = {}
+
+    # Map from the last identifier token in a text to a list of _Text objects.
+    # Texts without any tokens are listed under None.
+    self.by_last_token = {}
+
+    for position, annotation in enumerate(self.annotations):
+      if not annotation.HasSignature() or not hasattr(annotation, 'range'):
+        continue
+      try:
+        text = cs_file.Text(annotation.range)
+      except IndexError:
+        continue
+      entry = self.texts.get(text)
+      if entry is None:
+        entry = _Text(text)
+        self.texts[text] = entry
+        key = entry.tokens[-1] if entry.tokens else None
+        self.by_last_token.setdefault(key, []).append(entry)
+      entry.positions.append(position)
+
+    # Map from xref signature to the positions of the annotations that have
+    # it, and from identifier token to the signatures containing it. Built by
+    # _IndexSignatures().
+    self.signatures = None
+    self.signatures_by_token = None
+
+  def _Select(self, positions, kythe_xref_kind):
+    """Returns the annotations at |positions| in order, optionally limited to
+    those of kind |kythe_xref_kind|."""
+    annotations = [self.annotations[position] for position in sorted(positions)]
+    if kythe_xref_kind is None:
+      return annotations
+    return [
+        annotation for annotation in annotations
+        if getattr(annotation, 'kythe_xref_kind', None) == kythe_xref_kind
+    ]
+
+  def AnnotationsMatchingSymbol(self, symbol, kythe_xref_kind=None):
+    """Returns the annotations whose text matches |symbol| as determined by
+    SymbolSuffixMatcher."""
+    needle = CppIdentifierTokens(symbol)
+    key = needle[-1] if needle else None
+    positions = []
+    for entry in self.by_last_token.get(key, []):
+      if entry.tokens[-len(needle):] == needle:
+        positions.extend(entry.positions)
+    return self._Select(positions, kythe_xref_kind)
+
+  def AnnotationsContaining(self, s, kythe_xref_kind=None):
+    """Returns the annotations whose text contains |s|."""
+    positions = []
+    for text, entry in self.texts.items():
+      if s in text:
+        positions.extend(entry.positions)
+    return self._Select(positions, kythe_xref_kind)
+
+  def _IndexSignatures(self):
+    if self.signatures is not None:
+      return
+    signatures = {}
+    by_token = {}
+    for position, annotation in enumerate(self.annotations):
+      if not hasattr(annotation, 'xref_signature'):
+        continue
+      signature = annotation.xref_signature.signature
+      if signature not in signatures:
+        signatures[signature] = []
+        for token in set(CppIdentifierTokens(signature)):
+          by_token.setdefault(token, []).append(signature)
+      signatures[signature].append(position)
+    self.signatures_by_token = by_token
+    self.signatures = signatures
+
+  def XrefSignaturesContaining(self, s, kythe_xref_kind=None):
+    """Returns the distinct xref signatures that contain |s|, optionally
+    limited to those of annotations of kind |kythe_xref_kind|. Signatures are
+    listed in the order of their first annotation."""
+    self._IndexSignatures()
+
+    tokens = CompleteCppIdentifierTokens(s)
+    if tokens:
+      # Every matching signature contains all of |tokens|, so only the ones
+      # containing the least common token need to be looked at.
+      candidates = min((self.signatures_by_token.get(token, [])
+                        for token in tokens),
+                       key=len)
+    else:
+      candidates = self.signatures.keys()
+
+    first_positions = []
+    for signature in candidates:
+      if s not in signature:
+        continue
+      for position in self.signatures[signature]:
+        annotation = self.annotations[position]
+        if kythe_xref_kind is None or getattr(
+            annotation, 'kythe_xref_kind', None) == kythe_xref_kind:
+          first_positions.append((position, signature))
+          break
+    return [signature for _, signature in sorted(first_positions)]
@@ -0,0 +1,122 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+import unittest
+
+from .annotation_index import AnnotationIndex
+from .client_api import CodeSearch
+from .messages import Annotation, KytheNodeKind
+from .testing_support import InstallTestRequestHandler
+
+
+def MakeAnnotation(start_line, start_column, end_line, end_column, kind=None):
+  annotation = {
+      'range': {
+          'start_line': start_line,
+          'start_column': start_column,
+          'end_line': end_line,
+          'end_column': end_column
+      }
+  }
+  if kind is not None:
+    annotation['kythe_xref_kind'] = kind
+  return Annotation.FromShallowDict(annotation)
+
+
+class TestAnnotationIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.annotations = [
+        MakeAnnotation(10, 1, 10, 5, KytheNodeKind.FUNCTION),  # 0
+        MakeAnnotation(2, 1, 2, 5, KytheNodeKind.FUNCTION),  # 1
+        MakeAnnotation(10, 3, 10, 8),  # 2
+        MakeAnnotation(5, 1, 12, 1),  # 3
+        MakeAnnotation(10, 1, 10, 2, KytheNodeKind.FUNCTION),  # 4
+        MakeAnnotation(20, 1, 20, 5, KytheNodeKind.CONSTANT),  # 5
+        Annotation.FromShallowDict({}),  # 6
+    ]
+    self.index = AnnotationIndex(self.annotations)
+
+  def Positions(self, annotations):
+    return [self.annotations.index(a) for a in annotations]
+
+  def test_annotations_at(self):
+    self.assertEqual([0, 2, 3], self.Positions(self.index.AnnotationsAt(10, 4)))
+    self.assertEqual([3], self.Positions(self.index.AnnotationsAt(11, 30)))
+    self.assertEqual([], self.Positions(self.index.AnnotationsAt(12, 2)))
+    self.assertEqual([1], self.Positions(self.index.AnnotationsAt(2, 1)))
+    self.assertEqual([], self.Positions(self.index.AnnotationsAt(100, 1)))
+
+  def test_closest_before(self):
+    self.assertIs(self.annotations[3], self.index.ClosestBefore(10))
+    self.assertIs(self.annotations[0], self.index.ClosestBefore(11))
+    self.assertIs(self.annotations[1],
+                  self.index.ClosestBefore(10, KytheNodeKind.FUNCTION))
+    self.assertIs(self.annotations[0],
+                  self.index.ClosestBefore(
+                      10, KytheNodeKind.FUNCTION, inclusive=True))
+    self.assertIs(self.annotations[4],
+                  self.index.ClosestBefore(
+                      30, KytheNodeKind.FUNCTION,
+                      lambda a: a.range.end_column == 2))
+    self.assertIsNone(self.index.ClosestBefore(2))
+    self.assertIsNone(self.index.ClosestBefore(30, KytheNodeKind.TALIAS))
+
+  def test_annotations_near(self):
+    self.assertEqual([3, 1, 0, 2, 4, 5],
+                     self.Positions(self.index.AnnotationsNear(4)))
+    self.assertEqual([0, 2, 4, 3, 1, 5],
+                     self.Positions(self.index.AnnotationsNear(10)))
+    self.assertEqual([5, 0, 2, 4, 3, 1],
+                     self.Positions(self.index.AnnotationsNear(30)))
+
+    # Annotations 0, 1, 2 and 4 are all four lines away.
+    self.assertEqual([3, 0, 1, 2, 4, 5],
+                     self.Positions(self.index.AnnotationsNear(6)))
+
+  def test_nested_multiline_annotations(self):
+    annotations = [
+        MakeAnnotation(1, 1, 100, 1),  # 0
+        MakeAnnotation(20, 1, 40, 1),  # 1
+        MakeAnnotation(30, 1, 30, 5),  # 2
+        MakeAnnotation(35, 1, 60, 1),  # 3
+        MakeAnnotation(70, 1, 80, 1),  # 4
+    ]
+    index = AnnotationIndex(annotations)
+    for line in range(0, 102):
+      for column in (1, 3):
+        self.assertEqual(
+            [a for a in annotations if a.range.Contains(line, column)],
+            index.AnnotationsAt(line, column))
+
+  def test_matches_linear_scan(self):
+    InstallTestRequestHandler()
+    cs = CodeSearch(source_root='/src/chrome/')
+    cs_file = cs.GetFileInfo('/src/chrome/src/net/http/http_auth.h')
+    annotations = cs_file.GetAnnotations()
+    index = cs_file.GetAnnotationIndex()
+    self.assertIs(index, cs_file.GetAnnotationIndex())
+
+    for line in range(1, len(cs_file.lines) + 2):
+      for column in (1, 5, 20):
+        self.assertEqual(
+            [a for a in annotations if a.range.Contains(line, column)],
+            index.AnnotationsAt(line, column))
+
+      closest = None
+      for annotation in annotations:
+        if annotation.kythe_xref_kind != KytheNodeKind.FUNCTION:
+          continue
+        if annotation.range.start_line < line and (
+            closest is None or
+            annotation.range.start_line > closest.range.start_line):
+          closest = annotation
+      self.assertIs(closest,
+                    index.ClosestBefore(line, KytheNodeKind.FUNCTION))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,19 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import sys
+import unittest
+
+# The asyncio client and its tests rely on syntax that is only available on
+# Python 3.5+. Importing them on older versions is a SyntaxError.
+if sys.version_info >= (3, 5):
+  from .async_client_api_testcases import TestAsyncCodeSearch, \
+      TestAsyncConnectionPool
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,142 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import json
+import unittest
+
+from .cache_key import RequestCacheKey
+from .client_api import CodeSearch
+from .messages import AnnotationRequest, AnnotationType, AnnotationTypeValue, \
+    CallGraphRequest, CompoundRequest, FileSpec, SearchRequest, \
+    XrefSearchRequest
+
+HOST = 'https://cs.chromium.org'
+
+
+def KeyFor(**kwargs):
+  return RequestCacheKey.ForRequest(CompoundRequest(**kwargs), HOST)
+
+
+class TestRequestCacheKey(unittest.TestCase):
+
+  def test_ignores_unset_fields(self):
+    a = KeyFor(xref_search_request=[XrefSearchRequest(query='foo')])
+    b = KeyFor(
+        xref_search_request=[XrefSearchRequest(query='foo', edge_filter=[])])
+    self.assertEqual(a.key, b.key)
+
+    # Explicit values are kept even if they look like a default. The server
+    # may not treat them the same as leaving the field out.
+    c = KeyFor(search_request=[SearchRequest(query='foo')])
+    d = KeyFor(search_request=[SearchRequest(query='foo', exhaustive=False)])
+    e = KeyFor(search_request=[SearchRequest(query='foo', lines_context=0)])
+    self.assertEqual(3, len(set([c.key, d.key, e.key])))
+
+  def test_ignores_order_of_unordered_fields(self):
+    xref = AnnotationType(id=AnnotationTypeValue.XREF_SIGNATURE)
+    link = AnnotationType(id=AnnotationTypeValue.LINK_TO_DEFINITION)
+    file_spec = FileSpec(name='foo.cc', package_name='chromium')
+    a = KeyFor(annotation_request=[
+        AnnotationRequest(file_spec=file_spec, type=[xref, link])
+    ])
+    b = KeyFor(annotation_request=[
+        AnnotationRequest(file_spec=file_spec, type=[link, xref, link])
+    ])
+    self.assertEqual(a.key, b.key)
+
+  def test_limits(self):
+    small = KeyFor(call_graph_request=[
+        CallGraphRequest(signature='foo', max_num_results=10)
+    ])
+    large = KeyFor(call_graph_request=[
+        CallGraphRequest(signature='foo', max_num_results=500)
+    ])
+    default = KeyFor(call_graph_request=[CallGraphRequest(signature='foo')])
+    self.assertEqual(small.key, large.key)
+    self.assertEqual(small.key, default.key)
+    self.assertEqual([10], small.limits)
+    self.assertEqual([None], default.limits)
+
+    self.assertTrue(small.IsSatisfiedBy(large.limits))
+    self.assertFalse(large.IsSatisfiedBy(small.limits))
+    self.assertFalse(default.IsSatisfiedBy(large.limits))
+    self.assertFalse(small.IsSatisfiedBy(default.limits))
+
+    # Responses that were cached without recording their limits are accepted.
+    self.assertTrue(large.IsSatisfiedBy(None))
+
+  def test_truncate_response(self):
+    key = KeyFor(
+        call_graph_request=[
+            CallGraphRequest(signature='foo', max_num_results=2)
+        ],
+        xref_search_request=[
+            XrefSearchRequest(query='foo', max_num_results=500),
+            XrefSearchRequest(query='bar', max_num_results=1)
+        ])
+    self.assertEqual([('call_graph_request', 0), ('xref_search_request', 0),
+                      ('xref_search_request', 1)], key.limited_requests)
+    body = json.dumps({
+        'call_graph_response': [{
+            'node': {
+                'children': [{'signature': 'a'}, {'signature': 'b'},
+                             {'signature': 'c'}]
+            }
+        }],
+        'xref_search_response': [{
+            'search_result': [{'file': 1}, {'file': 2}]
+        }, {
+            'search_result': [{'file': 3}, {'file': 4}]
+        }]
+    })
+
+    truncated = json.loads(key.TruncateResponse(body, [10, 500, 10]))
+    self.assertEqual([{'signature': 'a'}, {'signature': 'b'}],
+                     truncated['call_graph_response'][0]['node']['children'])
+    self.assertEqual([{'file': 1}, {'file': 2}],
+                     truncated['xref_search_response'][0]['search_result'])
+    self.assertEqual([{'file': 3}],
+                     truncated['xref_search_response'][1]['search_result'])
+
+    # Responses fetched with the same limits are returned as is.
+    self.assertIs(body, key.TruncateResponse(body, [2, 500, 1]))
+    self.assertIs(body, key.TruncateResponse(body, None))
+
+  def test_encode_response(self):
+    key = KeyFor(call_graph_request=[
+        CallGraphRequest(signature='foo', max_num_results=10)
+    ])
+    self.assertEqual(([10], b'{}'),
+                     RequestCacheKey.DecodeResponse(key.EncodeResponse(b'{}')))
+    self.assertEqual((None, b'{}'), RequestCacheKey.DecodeResponse(b'{}'))
+
+  def test_larger_response_answers_smaller_request(self):
+    cs = CodeSearch(source_root='.', should_cache=True)
+    fetched = []
+
+    def Fetch(url, cache_key):
+      fetched.append(url)
+      return cs._CacheResponse(cache_key, b'{"call_graph_response": [{}]}')
+
+    cs._Fetch = Fetch
+    try:
+      cs.GetCallGraph('foo', max_num_results=100)
+      cs.GetCallGraph('foo', max_num_results=50)
+      self.assertEqual(1, len(fetched))
+      self.assertEqual(1, cs.stats.cache_hits)
+
+      cs.GetCallGraph('foo', max_num_results=200)
+      self.assertEqual(2, len(fetched))
+      cs.GetCallGraph('foo', max_num_results=100)
+      self.assertEqual(2, len(fetched))
+    finally:
+      cs.TeardownCache()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,18 +6,21 @@
 
 from __future__ import absolute_import
 
+import json
 import os
 import shutil
 import socket
 import sys
 import tempfile
 import tempfile
+import threading
+import time
 import unittest
 
 from .client_api import CodeSearch, XrefNode
 from .messages import CompoundRequest, CompoundResponse, FileInfoRequest, \
         FileInfoResponse, KytheNodeKind, KytheXrefKind, NodeEnumKind, \
-        CallGraphRequest, CallGraphResponse, Node
+        CallGraphRequest, CallGraphResponse, Node, StatusRequest
 from .testing_support import InstallTestRequestHandler, LastRequest, \
         TestDataDir, DisableNetwork, EnableNetwork, DumpCallers
 
@@ -125,6 +128,297 @@ class TestCodeSearch(unittest.TestCase):
     self.assertIsInstance(cg_response.call_graph_response[0], CallGraphResponse)
     self.assertIsInstance(cg_response.call_graph_response[0].node, Node)
 
+  def test_get_file_infos(self):
+    TARGET_FILES = [
+        '/src/chrome/src/net/http/http_auth.h',
+        '/src/chrome/src/base/metrics/field_trial.h'
+    ]
+
+    # Collect the individual responses for each file first. These are served
+    # from the recorded test data.
+    responses = {'file_info_response': [], 'annotation_response': []}
+    cs = CodeSearch(source_root=SOURCE_ROOT)
+    original_retrieve = cs._Retrieve
+
+    def RecordingRetrieve(url, cache_key=None):
+      result = original_retrieve(url, cache_key)
+      for k, v in json.loads(result).items():
+        if k in responses:
+          responses[k].extend(v)
+      return result
+
+    cs._Retrieve = RecordingRetrieve
+    for target in TARGET_FILES:
+      cs.GetFileInfo(target)
+      cs.GetAnnotationsForFile(target)
+
+    # Now serve a single combined response for the batched request.
+    urls = []
+
+    def CombinedRetrieve(url, cache_key=None):
+      urls.append(url)
+      return json.dumps(responses)
+
+    cs = CodeSearch(source_root=SOURCE_ROOT)
+    cs._Retrieve = CombinedRetrieve
+    cs_files = cs.GetFileInfos(TARGET_FILES + TARGET_FILES[:1])
+    self.assertEqual(1, len(urls))
+    self.assertEqual(3, len(cs_files))
+    self.assertIs(cs_files[0], cs_files[2])
+    self.assertEqual('src/net/http/http_auth.h', cs_files[0].Path())
+    self.assertEqual('src/base/metrics/field_trial.h', cs_files[1].Path())
+    self.assertTrue(cs_files[0].HasAnnotations())
+    self.assertTrue(cs_files[1].HasAnnotations())
+    self.assertNotEqual(0, len(cs_files[1].GetAnnotations()))
+
+    # Everything is known now. Neither of these should hit the network.
+    self.assertIs(cs_files[1], cs.GetFileInfo(TARGET_FILES[1]))
+    self.assertEqual(cs_files, cs.GetFileInfos(TARGET_FILES + TARGET_FILES[:1]))
+    self.assertEqual(1, len(urls))
+
+  def test_coalesce_identical_requests(self):
+    cs = CodeSearch(source_root='.')
+    release = threading.Event()
+    fetched = []
+
+    def BlockingFetch(url, cache_key):
+      fetched.append(url)
+      release.wait()
+      return '{}'
+
+    cs._Fetch = BlockingFetch
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cs._Retrieve('foo')))
+        for _ in range(4)
+    ]
+    for t in threads:
+      t.start()
+
+    # Wait for everyone to arrive before letting the first request finish.
+    for _ in range(100):
+      if cs.stats.coalesced_requests == 3:
+        break
+      time.sleep(0.05)
+    release.set()
+    for t in threads:
+      t.join()
+
+    self.assertEqual(['foo'], fetched)
+    self.assertEqual(['{}'] * 4, results)
+    self.assertEqual(1, cs.stats.cache_misses)
+    self.assertEqual(3, cs.stats.coalesced_requests)
+
+    # Nothing is in flight anymore. A new request goes to the network again.
+    cs._Retrieve('foo')
+    self.assertEqual(['foo', 'foo'], fetched)
+
+  def test_coalesced_requests_see_errors(self):
+    cs = CodeSearch(source_root='.')
+    release = threading.Event()
+
+    def FailingFetch(url, cache_key):
+      release.wait()
+      raise ValueError('failed')
+
+    cs._Fetch = FailingFetch
+
+    errors = []
+
+    def Retrieve():
+      try:
+        cs._Retrieve('foo')
+      except ValueError as e:
+        errors.append(e)
+
+    threads = [threading.Thread(target=Retrieve) for _ in range(2)]
+    for t in threads:
+      t.start()
+    for _ in range(100):
+      if cs.stats.coalesced_requests == 1:
+        break
+      time.sleep(0.05)
+    release.set()
+    for t in threads:
+      t.join()
+    self.assertEqual(2, len(errors))
+    self.assertEqual({}, cs.in_flight)
+
+  def test_stale_while_revalidate(self):
+    cs = CodeSearch(
+        source_root='.',
+        should_cache=True,
+        cache_timeout_in_seconds=-1,
+        cache_max_staleness_in_seconds=60)
+    responses = ['{"status_response": [{"success": true}]}']
+    refreshed = threading.Event()
+
+    def Fetch(url, cache_key):
+      result = cs._CacheResponse(cache_key, responses.pop(0).encode('utf-8'))
+      refreshed.set()
+      return result
+
+    cs._Fetch = Fetch
+    try:
+      request = CompoundRequest(status_request=[StatusRequest()])
+      cs.SendRequestToServer(request)
+      self.assertEqual(1, cs.stats.cache_misses)
+      refreshed.clear()
+
+      # The stale response is returned right away and refreshed in the
+      # background.
+      responses.append('{"status_response": [{"success": false}]}')
+      response = cs.SendRequestToServer(request)
+      self.assertTrue(response.status_response[0].success)
+      self.assertTrue(refreshed.wait(5))
+      self.assertEqual(1, cs.stats.stale_hits)
+      self.assertEqual(1, cs.stats.background_refreshes)
+
+      for _ in range(100):
+        if not cs.in_flight:
+          break
+        time.sleep(0.05)
+      response = cs.SendRequestToServer(request)
+      self.assertFalse(response.status_response[0].success)
+    finally:
+      cs.TeardownCache()
+
+  def test_decoded_responses_expire_with_disk_entry(self):
+    test_dir = tempfile.mkdtemp()
+    request = CompoundRequest(status_request=[StatusRequest()])
+    refreshed = threading.Event()
+
+    def Fetch(url, cache_key):
+      refreshed.set()
+      return cs._CacheResponse(
+          cache_key, b'{"status_response": [{"success": true}]}')
+
+    try:
+      cs = CodeSearch(source_root='.', should_cache=True, cache_dir=test_dir)
+      cs._Fetch = Fetch
+      cs.SendRequestToServer(request)
+      cs.TeardownCache()
+
+      # The response on disk is close to expiring by the time it is decoded.
+      for name in os.listdir(test_dir):
+        written = time.time() - 1.5
+        os.utime(os.path.join(test_dir, name), (written, written))
+
+      cs = CodeSearch(
+          source_root='.',
+          should_cache=True,
+          cache_dir=test_dir,
+          cache_timeout_in_seconds=2,
+          cache_max_staleness_in_seconds=60)
+      cs._Fetch = Fetch
+      refreshed.clear()
+      cs.SendRequestToServer(request)
+      self.assertEqual(0, cs.stats.stale_hits)
+
+      # The decoded response expires along with the response on disk. The
+      # latter is now stale and gets refreshed.
+      time.sleep(1)
+      cs.SendRequestToServer(request)
+      self.assertTrue(refreshed.wait(5))
+      self.assertEqual(0, cs.stats.decoded_hits)
+      self.assertEqual(1, cs.stats.stale_hits)
+      self.assertEqual(1, cs.stats.background_refreshes)
+
+      for _ in range(100):
+        if not cs.in_flight:
+          break
+        time.sleep(0.05)
+      cs.TeardownCache()
+    finally:
+      shutil.rmtree(test_dir)
+
+  def test_background_refreshes_are_bounded(self):
+    cs = CodeSearch(source_root='.')
+    release = threading.Event()
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def Refresh():
+      with lock:
+        running.append(1)
+        max_running.append(len(running))
+      release.wait(5)
+      with lock:
+        running.pop()
+
+    try:
+      refresher = cs.refresher
+      for i in range(5):
+        self.assertTrue(refresher.Submit('url{}'.format(i), Refresh))
+      self.assertFalse(refresher.Submit('url4', Refresh))
+      self.assertEqual(refresher.max_workers, refresher.workers)
+      release.set()
+      for _ in range(100):
+        if not refresher.workers:
+          break
+        time.sleep(0.05)
+      self.assertEqual(0, refresher.workers)
+      self.assertEqual(5, len(max_running))
+      self.assertLessEqual(max(max_running), refresher.max_workers)
+    finally:
+      cs.TeardownCache()
+    self.assertFalse(refresher.Submit('url', Refresh))
+
+  def test_stopping_early_closes_the_stream(self):
+    cs = CodeSearch(source_root='.', should_cache=True)
+    streams = []
+
+    def FetchStream(url):
+      state = {'closed': False, 'read': 0}
+      streams.append(state)
+
+      def Stream():
+        try:
+          for chunk in [b'{"a": ', b'1', b'}']:
+            state['read'] += 1
+            yield chunk
+        finally:
+          state['closed'] = True
+
+      return Stream()
+
+    cs._FetchStream = FetchStream
+    try:
+      pieces = cs._RetrieveIncrementally('http://example.com/x')
+      self.assertEqual('{"a": ', next(pieces))
+      pieces.close()
+      self.assertEqual([{'closed': True, 'read': 1}], streams)
+      self.assertEqual({}, cs.in_flight)
+
+      # Nothing was cached. Hence the request is sent again.
+      self.assertEqual('{"a": 1}',
+                       ''.join(cs._RetrieveIncrementally('http://example.com/x')))
+      self.assertEqual(2, len(streams))
+      self.assertEqual('{"a": 1}',
+                       ''.join(cs._RetrieveIncrementally('http://example.com/x')))
+      self.assertEqual(2, len(streams))
+    finally:
+      cs.TeardownCache()
+
+  def test_decoded_responses_are_reused(self):
+    cs = CodeSearch(source_root='.', should_cache=True)
+    try:
+      request = CompoundRequest(status_request=[StatusRequest()])
+      cs._Fetch = lambda url, cache_key: cs._CacheResponse(
+          cache_key, b'{"status_response": [{}]}')
+      first = cs.SendRequestToServer(request)
+      self.assertIs(first, cs.SendRequestToServer(request))
+      self.assertEqual(1, cs.stats.cache_misses)
+      self.assertEqual(1, cs.stats.decoded_hits)
+
+      # Shared responses are read-only.
+      with self.assertRaises(AttributeError):
+        first.status_response[0].success = False
+    finally:
+      cs.TeardownCache()
+
   def test_fixed_cache(self):
     fixed_cache_dir = os.path.join(TestDataDir(), 'fixed_cache')
 
@@ -0,0 +1,264 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from .client_api import CodeSearch
+from .connection_pool import ConnectionPool, UsesProxy
+from .messages import CompoundRequest, StatusRequest
+
+
+class LocalServer(object):
+  """A local HTTP/1.1 server that keeps track of connections and requests."""
+
+  def __init__(self, close_after_response=False):
+    server = self
+
+    self.connections = 0
+    self.requests = []
+    self.close_after_response = close_after_response
+
+    # Time to wait before sending each response.
+    self.delay_in_seconds = 0
+
+    # Map from path to a (status, location) tuple for paths that redirect.
+    self.redirects = {}
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def setup(self):
+        server.connections += 1
+        BaseHTTPRequestHandler.setup(self)
+
+      def log_message(self, *args):
+        pass
+
+      def _Respond(self, body):
+        server.requests.append((self.command, self.path, body))
+        if server.delay_in_seconds:
+          time.sleep(server.delay_in_seconds)
+        if self.path in server.redirects:
+          status, location = server.redirects[self.path]
+          self.send_response(status)
+          self.send_header('Location', location)
+          self.send_header('Content-Length', '0')
+          self.end_headers()
+          return
+        response = json.dumps({'status_response': [{}]}).encode('utf-8')
+        try:
+          self.send_response(200)
+          self.send_header('Content-Type', 'application/json')
+          self.send_header('Content-Length', str(len(response)))
+          self.end_headers()
+          self.wfile.write(response)
+        except socket.error:
+          # The client gave up waiting.
+          self.close_connection = True
+          return
+        if server.close_after_response:
+          # Drop the connection without announcing it.
+          self.close_connection = True
+
+      def do_GET(self):
+        self._Respond(None)
+
+      def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._Respond(self.rfile.read(length))
+
+    self.httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    self.thread = threading.Thread(target=self.httpd.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Url(self, path='/'):
+    return 'http://127.0.0.1:{}{}'.format(self.httpd.server_address[1], path)
+
+  def Stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+  def test_reuses_connection(self):
+    server = LocalServer()
+    pool = ConnectionPool(pool_size=2)
+    try:
+      for _ in range(3):
+        self.assertIn(b'status_response', pool.Open(server.Url('/foo')))
+      self.assertEqual(1, server.connections)
+      self.assertEqual(1, pool.connections_created)
+      self.assertEqual(3, len(server.requests))
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_reconnects_on_reset(self):
+    server = LocalServer(close_after_response=True)
+    pool = ConnectionPool(pool_size=2)
+    try:
+      for _ in range(3):
+        self.assertIn(b'status_response', pool.Open(server.Url('/foo')))
+      self.assertEqual(3, len(server.requests))
+      self.assertEqual(3, server.connections)
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_does_not_resend_on_timeout(self):
+    server = LocalServer()
+    pool = ConnectionPool(pool_size=2, timeout_in_seconds=0.1)
+    try:
+      pool.Open(server.Url('/foo'))
+
+      # The request on the reused connection times out. The server has seen
+      # it, so it must not be sent again on a new connection.
+      server.delay_in_seconds = 0.3
+      with self.assertRaises(socket.timeout):
+        pool.Open(server.Url('/foo'), data=b'bar')
+
+      # Give a resent request a chance to show up.
+      time.sleep(0.6)
+      self.assertEqual(2, len(server.requests))
+      self.assertEqual(1, pool.connections_created)
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_post_redirects(self):
+    server = LocalServer()
+    server.redirects = {
+        '/301': (301, '/foo'),
+        '/302': (302, '/foo'),
+        '/303': (303, '/foo'),
+        '/307': (307, '/foo'),
+    }
+    pool = ConnectionPool(pool_size=2)
+    try:
+      # Like urlopen(), follow 301, 302 and 303 with a GET without a body.
+      for code in ['301', '302', '303']:
+        del server.requests[:]
+        pool.Open(server.Url('/' + code), data=b'bar')
+        self.assertEqual(('GET', '/foo', None), server.requests[-1])
+
+      del server.requests[:]
+      list(pool.OpenStream(server.Url('/302'), data=b'bar'))
+      self.assertEqual(('GET', '/foo', None), server.requests[-1])
+
+      del server.requests[:]
+      pool.Open(server.Url('/307'), data=b'bar')
+      self.assertEqual(('POST', '/foo', b'bar'), server.requests[-1])
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_idle_timeout(self):
+    server = LocalServer()
+    pool = ConnectionPool(pool_size=2, idle_timeout_in_seconds=-1)
+    try:
+      pool.Open(server.Url('/foo'))
+      pool.Open(server.Url('/foo'))
+      self.assertEqual(2, pool.connections_created)
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_releases_after_close(self):
+    server = LocalServer()
+    pool = ConnectionPool(pool_size=2)
+    try:
+      stream = pool.OpenStream(server.Url('/foo'), chunk_size=4)
+      next(stream)
+
+      # The request was in flight when the pool was closed. Its connection
+      # should not be kept around.
+      pool.close()
+      list(stream)
+      self.assertFalse(any(pool.idle.values()))
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_open_stream(self):
+    server = LocalServer()
+    pool = ConnectionPool(pool_size=2)
+    try:
+      chunks = list(pool.OpenStream(server.Url('/foo'), chunk_size=4))
+      self.assertLessEqual(max(len(c) for c in chunks), 4)
+      self.assertEqual(pool.Open(server.Url('/foo')), b''.join(chunks))
+
+      # An abandoned stream can't be reused.
+      stream = pool.OpenStream(server.Url('/foo'), chunk_size=4)
+      next(stream)
+      stream.close()
+      pool.Open(server.Url('/foo'))
+      self.assertEqual(2, pool.connections_created)
+    finally:
+      pool.close()
+      server.Stop()
+
+  def test_codesearch_uses_pool(self):
+    server = LocalServer()
+    cs = CodeSearch(
+        source_root='.',
+        codesearch_host=server.Url('').rstrip('/'),
+        connection_pool_size=1)
+    try:
+      cs.SendRequestToServer(CompoundRequest(status_request=[StatusRequest()]))
+      cs.SendRequestToServer(
+          CompoundRequest(status_request=[StatusRequest()] * 200))
+      self.assertEqual(1, server.connections)
+
+      self.assertEqual('GET', server.requests[0][0])
+
+      # The second URL is too long and should have been sent as a POST.
+      method, path, body = server.requests[1]
+      self.assertEqual('POST', method)
+      self.assertEqual('/codesearch/json', path)
+      self.assertTrue(body.startswith(b'status_request=b'))
+    finally:
+      cs.TeardownCache()
+      server.Stop()
+
+  def test_proxy_falls_back_to_urlopen(self):
+    names = ['http_proxy', 'https_proxy', 'no_proxy', 'HTTP_PROXY',
+             'HTTPS_PROXY', 'NO_PROXY']
+    saved = dict((name, os.environ.pop(name, None)) for name in names)
+    try:
+      self.assertFalse(UsesProxy('https://cs.chromium.org/'))
+
+      os.environ['https_proxy'] = 'http://proxy.example.com:3128'
+      os.environ['no_proxy'] = 'localhost'
+      self.assertTrue(UsesProxy('https://cs.chromium.org/'))
+      self.assertFalse(UsesProxy('http://cs.chromium.org/'))
+      self.assertFalse(UsesProxy('https://localhost/'))
+
+      cs = CodeSearch(source_root='.', connection_pool_size=1)
+      self.assertIsNone(cs.connection_pool)
+      cs.TeardownCache()
+    finally:
+      for name, value in saved.items():
+        os.environ.pop(name, None)
+        if value is not None:
+          os.environ[name] = value
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -39,6 +39,38 @@ class TestCsFile(unittest.TestCase):
             TextRange(
                 start_line=17, start_column=59, end_line=19, end_column=2)))
 
+  def test_text_comparisons(self):
+    cs = CodeSearch(source_root='/src/chrome/')
+    cs_file = cs.GetFileInfo('/src/chrome/src/LICENSE')
+    single_line = TextRange(
+        start_line=3, start_column=1, end_line=3, end_column=25)
+    multi_line = TextRange(
+        start_line=17, start_column=59, end_line=18, end_column=1)
+
+    self.assertTrue(
+        cs_file.TextEquals(single_line, "// Redistribution and use"))
+    self.assertFalse(cs_file.TextEquals(single_line, "// Redistribution"))
+    self.assertTrue(cs_file.TextContains(single_line, "Redistribution"))
+    self.assertFalse(cs_file.TextContains(single_line, "source"))
+    self.assertTrue(cs_file.TextEquals(multi_line, "CONTRIBUTORS\n/"))
+    self.assertTrue(cs_file.TextContains(multi_line, "S\n/"))
+
+    self.assertIsNone(cs_file.split_lines)
+    self.assertEqual(cs_file.LineCount(), len(cs_file.lines))
+    self.assertEqual("// Redistribution and use", cs_file.lines[2][:25])
+
+  def test_text_with_other_line_terminators(self):
+    cs = CodeSearch(source_root='/src/chrome/')
+    cs_file = CsFile(cs, FileInfo.FromShallowDict(
+        {'name': 'src/foo.cc', 'content': {'text': 'ab\r\ncd\ref\r\n'}}))
+    self.assertEqual(3, cs_file.LineCount())
+    self.assertEqual(['ab', 'cd', 'ef'], cs_file.lines)
+    text_range = TextRange(
+        start_line=1, start_column=2, end_line=3, end_column=1)
+    self.assertEqual("b\ncd\ne", cs_file.Text(text_range))
+    self.assertTrue(cs_file.TextEquals(text_range, "b\ncd\ne"))
+    self.assertTrue(cs_file.TextContains(text_range, "d\ne"))
+
   def test_path(self):
     cs = CodeSearch(source_root='/src/chrome/')
     cs_file = cs.GetFileInfo('/src/chrome/src/LICENSE')
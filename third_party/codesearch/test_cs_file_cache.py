@@ -0,0 +1,82 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import unittest
+
+from .client_api import CodeSearch
+from .cs_file_cache import CsFileCache
+from .testing_support import InstallTestRequestHandler
+
+
+class FakeCsFile(object):
+
+  def __init__(self, path, footprint):
+    self.path = path
+    self.footprint = footprint
+
+  def Path(self):
+    return self.path
+
+  def Footprint(self):
+    return self.footprint
+
+
+class TestCsFileCache(unittest.TestCase):
+
+  def test_lru(self):
+    cache = CsFileCache(max_entries=2)
+    a, b, c = [FakeCsFile(p, 1) for p in 'abc']
+    cache.put('a', a)
+    cache.put('b', b)
+    self.assertIs(a, cache.get('a'))
+    cache.put('c', c)
+    self.assertIsNone(cache.get('b'))
+    self.assertIs(a, cache.get('a'))
+    self.assertIs(c, cache.get('c'))
+    self.assertEqual([('a', 1), ('c', 1)], cache.entries())
+
+  def test_footprint(self):
+    cache = CsFileCache(max_bytes=10)
+    a, b = [FakeCsFile(p, 4) for p in 'ab']
+    cache.put('a', a)
+    cache.put('b', b)
+    self.assertEqual(8, cache.total_bytes)
+
+    # |b| grows and pushes out |a|.
+    b.footprint = 7
+    cache.update(b)
+    self.assertIsNone(cache.get('a'))
+    self.assertEqual(7, cache.total_bytes)
+
+    # Files that aren't in the cache are ignored.
+    cache.update(a)
+    self.assertEqual(1, cache.entry_count())
+
+    # The most recently used file stays even if it doesn't fit.
+    b.footprint = 20
+    cache.update(b)
+    self.assertIs(b, cache.get('b'))
+
+  def test_code_search(self):
+    InstallTestRequestHandler()
+    cs = CodeSearch(source_root='/src/chrome/')
+    cs_file = cs.GetFileInfo('/src/chrome/src/net/http/http_auth.h')
+    self.assertIs(cs_file,
+                  cs.GetFileInfo('/src/chrome/src/net/http/http_auth.h'))
+    [(path, footprint)] = cs.file_info_cache.entries()
+    self.assertEqual('src/net/http/http_auth.h', path)
+    self.assertEqual(len(cs_file.text), footprint)
+
+    cs_file.GetAnnotations()
+    [(_, with_annotations)] = cs.file_info_cache.entries()
+    self.assertGreater(with_annotations, footprint)
+    self.assertEqual(with_annotations, cs.file_info_cache.total_bytes)
+
+
+if __name__ == '__main__':
+  unittest.main()
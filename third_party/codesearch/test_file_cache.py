@@ -10,6 +10,7 @@ import os
 import shutil
 import tempfile
 import unittest
+from . import file_cache
 from .file_cache import FileCache
 
 
@@ -23,6 +24,19 @@ class TestFileCache(unittest.TestCase):
     finally:
       f.close()
 
+  def test_temporary_dir_removed_at_exit(self):
+    f = FileCache()
+    try:
+      f.put('foo', b'hello')
+      self.assertTrue(os.path.isdir(f.cache_dir))
+
+      # Simulate the interpreter exiting without close() having been called.
+      file_cache._RemoveTemporaryCacheDirs()
+      self.assertFalse(os.path.exists(f.cache_dir))
+      self.assertNotIn(f.cache_dir, file_cache._temporary_dirs)
+    finally:
+      f.close()
+
   def test_with_cache_dir(self):
     f = None
     g = None
@@ -48,6 +62,107 @@ class TestFileCache(unittest.TestCase):
       if test_dir:
         shutil.rmtree(test_dir)
 
+  def test_evicts_least_recently_used_entries(self):
+    f = FileCache(max_bytes=10)
+    try:
+      f.put('a', b'aaaa')
+      f.put('b', b'bbbb')
+      self.assertEqual(b'aaaa', f.get('a'))
+
+      # 'b' is now the least recently used entry and should be evicted.
+      f.put('c', b'cccc')
+      self.assertEqual(b'aaaa', f.get('a'))
+      self.assertEqual('', f.get('b'))
+      self.assertEqual(b'cccc', f.get('c'))
+      self.assertEqual(8, f.size())
+      self.assertEqual(2, f.entry_count())
+      self.assertEqual(1, f.evictions)
+
+      f.put('c', b'cc')
+      self.assertEqual(6, f.size())
+    finally:
+      f.close()
+
+  def test_max_entries(self):
+    f = FileCache(max_entries=2)
+    try:
+      for url in ['a', 'b', 'c']:
+        f.put(url, url.encode('utf-8'))
+      self.assertEqual(2, f.entry_count())
+      self.assertEqual('', f.get('a'))
+      self.assertEqual(b'c', f.get('c'))
+    finally:
+      f.close()
+
+  def test_closes_cold_files(self):
+    f = FileCache(max_open_files=2)
+    try:
+      for url in ['a', 'b', 'c', 'd']:
+        f.put(url, url.encode('utf-8'))
+      self.assertEqual(2, f.open_file_count())
+
+      # Cold entries are still available, but only the most recently used
+      # ones stay open.
+      self.assertEqual(b'a', f.get('a'))
+      self.assertEqual(2, f.open_file_count())
+      self.assertEqual(4, f.entry_count())
+    finally:
+      f.close()
+
+  def test_budget_applies_to_existing_cache_dir(self):
+    test_dir = tempfile.mkdtemp()
+    try:
+      f = FileCache(cache_dir=test_dir)
+      f.put('a', b'aaaa')
+      f.put('b', b'bbbb')
+      f.close()
+
+      g = FileCache(cache_dir=test_dir, max_bytes=4)
+      try:
+        self.assertEqual(4, g.size())
+        self.assertEqual(1, len(os.listdir(test_dir)))
+      finally:
+        g.close()
+    finally:
+      shutil.rmtree(test_dir)
+
+  def test_budget_applies_to_adopted_files(self):
+    test_dir = tempfile.mkdtemp()
+    try:
+      g = FileCache(cache_dir=test_dir, max_entries=2, max_bytes=8)
+      f = FileCache(cache_dir=test_dir)
+      try:
+        # Files written by another instance after |g| was created are adopted
+        # on lookup.
+        for url in ['a', 'b', 'c']:
+          f.put(url, (url * 4).encode('utf-8'))
+        for url in ['a', 'b', 'c']:
+          self.assertEqual((url * 4).encode('utf-8'), g.get(url))
+        self.assertEqual(2, g.entry_count())
+        self.assertEqual(8, g.size())
+      finally:
+        f.close()
+        g.close()
+    finally:
+      shutil.rmtree(test_dir)
+
+  def test_stale_entries(self):
+    f = FileCache(expiration_in_seconds=-1, max_staleness_in_seconds=60)
+    try:
+      f.put('foo', b'foo')
+      self.assertEqual('', f.get('foo'))
+      self.assertEqual((b'foo', True), f.lookup('foo'))
+      self.assertEqual(('', False), f.lookup('bar'))
+    finally:
+      f.close()
+
+    f = FileCache(expiration_in_seconds=-1)
+    try:
+      f.put('foo', b'foo')
+      self.assertEqual(('', False), f.lookup('foo'))
+    finally:
+      f.close()
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -6,9 +6,15 @@
 
 from __future__ import absolute_import
 
+import gc
+import json
+import os
 import unittest
 
-from .messages import Message, message, XrefSignature, InternalLink, TextRange
+from .messages import Message, message, XrefSignature, InternalLink, \
+    TextRange, CompoundResponse, CodeSearchProtoJsonEncoder, Annotation, Node, \
+    CodeSearchProtoJsonSymbolizedEncoder, KytheXrefKind, _GetConverter
+from .testing_support import TestDataDir
 
 
 @message
@@ -98,6 +104,204 @@ class TestProto(unittest.TestCase):
     self.assertTrue(isinstance(v.y[0], Baz))
     self.assertTrue(isinstance(v.y[1], Baz))
 
+  def test_from_shallow_dict_2(self):
+    v = Quux.FromShallowDict({'x': 'BAR', 'unknown': {'x': 'FOO'}})
+    self.assertEqual(2, v.x)
+    # Values of fields that aren't in the DESCRIPTOR are left alone.
+    self.assertEqual({'x': 'FOO'}, v.unknown)
+
+    # So are values that are already messages.
+    bar = Bar.FromShallowDict({'x': 1})
+    self.assertIs(bar, Bar.FromShallowDict({'y': bar}).y)
+
+    with self.assertRaises(ValueError):
+      Quux.FromShallowDict({'x': 'BAZ'})
+
+  def test_converters_are_compiled_once(self):
+    first = _GetConverter(Baz, None, False, False)
+    self.assertIs(first, _GetConverter(Baz, None, False, False))
+    self.assertIsNot(first, _GetConverter(Baz, None, True, False))
+    self.assertIs(
+        _GetConverter([Baz], None, False, False),
+        _GetConverter([Message.PARENT_TYPE], Baz, False, False))
+
+
+class TestLazyDecoding(unittest.TestCase):
+
+  def test_decodes_on_access(self):
+    v = Bar.FromJsonString('{"x": 3, "y": {"x": 4}, "z": 5}', lazy=True)
+    self.assertEqual(5, v.z)
+    self.assertNotIn('y', v.__dict__)
+    self.assertTrue(isinstance(v.y, Bar))
+    self.assertIn('y', v.__dict__)
+    self.assertEqual(4, v.y.x)
+    self.assertTrue(hasattr(v, 'x'))
+    self.assertFalse(hasattr(v, 'w'))
+    self.assertFalse(hasattr(v.y, 'y'))
+    self.assertEqual({'x': 3, 'y': v.y, 'z': 5}, v.Fields())
+    self.assertNotIn(Message.PENDING_FIELDS, v.__dict__)
+
+  def test_lists_and_enums(self):
+    v = Baz.FromJsonString('{"y": [{"x": 1}, {"x": 2}]}', lazy=True)
+    self.assertEqual([1, 2], [y.x for y in v.y])
+    self.assertTrue(isinstance(v.y[0], Baz))
+
+    v = Quux.FromJsonString('{"x": "FOO"}', lazy=True)
+    self.assertEqual(1, v.x)
+
+  def test_same_as_eager_decoding(self):
+    responses_dir = os.path.join(TestDataDir(), 'responses')
+    for name in sorted(os.listdir(responses_dir)):
+      if not name.endswith('.json'):
+        continue
+      with open(os.path.join(responses_dir, name), 'rb') as f:
+        content = f.read()
+      expected = json.dumps(
+          CompoundResponse.FromJsonString(content),
+          cls=CodeSearchProtoJsonEncoder,
+          sort_keys=True)
+      for lazy, compact in [(True, False), (False, True), (True, True)]:
+        decoded = CompoundResponse.FromJsonString(content, lazy, compact)
+        self.assertEqual(
+            expected,
+            json.dumps(
+                decoded, cls=CodeSearchProtoJsonEncoder, sort_keys=True),
+            name)
+
+
+class TestCompactMessages(unittest.TestCase):
+
+  def test_compact_text_range(self):
+    v = Annotation.FromJsonString(
+        '{"type": {"id": 1}, "range": {"start_line": 1, "start_column": 2, '
+        '"end_line": 1, "end_column": 5}, "unknown": 3}',
+        compact=True)
+    self.assertIs(Annotation.COMPACT_CLASS, type(v))
+    self.assertIsInstance(v, Annotation)
+    self.assertIsInstance(v.range, TextRange)
+    self.assertIs(TextRange.COMPACT_CLASS, type(v.range))
+    self.assertTrue(v.range.IsValid())
+    self.assertTrue(v.range.Contains(1, 3))
+    self.assertEqual(3, v.unknown)
+    self.assertFalse(hasattr(v, 'xref_signature'))
+
+    v.range.start_column = 1
+    self.assertEqual(1, v.range.Fields()['start_column'])
+    self.assertEqual(['end_column', 'end_line', 'start_column', 'start_line'],
+                     sorted(v.range.Fields().keys()))
+
+  def test_no_instance_dict(self):
+    v = Annotation.FromJsonString(
+        '{"type": {"id": 1}, "range": {"start_line": 1}, "unknown": 3}',
+        compact=True)
+    v.range.end_line = 2
+    v.other = 4
+    self.assertEqual({'start_line': 1, 'end_line': 2}, v.range.Fields())
+    self.assertEqual(4, v.Fields()['other'])
+    del v.other
+    self.assertFalse(hasattr(v, 'other'))
+    v.Freeze()
+    with self.assertRaises(AttributeError):
+      v.range.start_line = 3
+
+    # gc.get_referents() includes the __dict__ of an object if it has one.
+    for o in [v, v.range]:
+      self.assertFalse([
+          r for r in gc.get_referents(o)
+          if isinstance(r, dict) and r is not getattr(o, '_extra_fields', None)
+      ])
+
+  def test_parent_type(self):
+    v = Node.FromJsonString(
+        '{"children": [{"children": [{"display_name": "x"}]}]}', compact=True)
+    self.assertIs(Node.COMPACT_CLASS, type(v.children[0].children[0]))
+    self.assertEqual('x', v.children[0].children[0].display_name)
+
+
+class TestFrozenMessages(unittest.TestCase):
+
+  def test_freeze(self):
+    for lazy, compact in [(False, False), (True, False), (False, True)]:
+      v = Baz.FromJsonString('{"x": 3, "y": [{"x": 1}, {"x": 2}]}', lazy,
+                             compact)
+      v.Freeze()
+      self.assertNotIn(Message.PENDING_FIELDS, v.__dict__)
+      self.assertTrue(v.FROZEN)
+      self.assertIsInstance(v, Baz)
+      self.assertEqual([1, 2], [y.x for y in v.y])
+      with self.assertRaises(AttributeError):
+        v.x = 4
+      with self.assertRaises(AttributeError):
+        v.y[0].x = 4
+      with self.assertRaises(AttributeError):
+        del v.x
+      self.assertEqual({'x': 3, 'y': v.y}, v.Fields())
+
+  def test_encodes_like_unfrozen(self):
+    v = Bar.FromJsonString('{"x": 3, "y": {"x": 4}}')
+    expected = json.dumps(v, cls=CodeSearchProtoJsonEncoder, sort_keys=True)
+    v.Freeze()
+    self.assertEqual(
+        expected, json.dumps(v, cls=CodeSearchProtoJsonEncoder, sort_keys=True))
+
+
+class TestEnums(unittest.TestCase):
+
+  def test_symbols(self):
+    self.assertEqual('FOO', Qux.ToSymbol(1))
+    self.assertEqual(3, Qux.ToSymbol(3))
+    self.assertEqual([1], Qux.ToSymbol([1]))
+    self.assertEqual(2, Qux.FromSymbol('BAR'))
+    with self.assertRaises(KeyError):
+      Qux.FromSymbol('DESCRIPTOR')
+    self.assertEqual('REFERENCE',
+                     KytheXrefKind.ToSymbol(KytheXrefKind.REFERENCE))
+
+
+class TestJsonEncoders(unittest.TestCase):
+
+  def test_indented_output_matches_json_module(self):
+    responses_dir = os.path.join(TestDataDir(), 'responses')
+    for name in sorted(os.listdir(responses_dir))[:10]:
+      if not name.endswith('.json'):
+        continue
+      with open(os.path.join(responses_dir, name), 'rb') as f:
+        response = CompoundResponse.FromJsonString(f.read())
+      for cls in [
+          CodeSearchProtoJsonEncoder, CodeSearchProtoJsonSymbolizedEncoder
+      ]:
+        # Without |indent|, the json module does all the work.
+        plain = json.loads(json.dumps(response, cls=cls))
+        for kwargs in [{
+            'indent': 4,
+            'ensure_ascii': True
+        }, {
+            'indent': 1,
+            'ensure_ascii': False
+        }]:
+          # The order of the fields depends on the order of dictionaries,
+          # which differs between Python versions. Hence only sorted output
+          # is compared as text.
+          self.assertEqual(
+              json.dumps(plain, sort_keys=True, **kwargs),
+              json.dumps(response, cls=cls, sort_keys=True, **kwargs), name)
+          self.assertEqual(plain,
+                           json.loads(json.dumps(response, cls=cls, **kwargs)),
+                           name)
+
+  def test_symbolized(self):
+    v = Quux.FromShallowDict({'x': 2, 'y': [1]})
+    self.assertEqual({
+        'x': 'BAR',
+        'y': [1]
+    }, json.loads(json.dumps(v, cls=CodeSearchProtoJsonSymbolizedEncoder)))
+    self.assertEqual(
+        '{\n  "x": "BAR"\n}',
+        json.dumps(
+            Quux.FromShallowDict({'x': 2}),
+            indent=2,
+            cls=CodeSearchProtoJsonSymbolizedEncoder))
+
 
 class TestConstructor(unittest.TestCase):
 
@@ -0,0 +1,203 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zlib
+
+from .client_api import CodeSearch
+from .pack_file_cache import (KeyForUrl, PackFileCache, PACK_FILENAME,
+                              RECORD_HEADER, RECORD_MAGIC)
+
+
+def MakeRecord(url, data):
+  payload = zlib.compress(data)
+  return RECORD_HEADER.pack(RECORD_MAGIC, KeyForUrl(url), time.time(),
+                            len(payload), len(data)) + payload
+
+
+class TestPackFileCache(unittest.TestCase):
+
+  def setUp(self):
+    self.test_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.test_dir)
+
+  def test_with_no_cache_dir(self):
+    f = PackFileCache()
+    try:
+      f.put('foo', b'hello')
+      self.assertEqual(b'hello', f.get('foo'))
+      self.assertEqual('', f.get('bar'))
+    finally:
+      f.close()
+    self.assertFalse(os.path.exists(f.cache_dir))
+
+  def test_persists_compressed_entries(self):
+    data = b'{"annotation": []}' * 1000
+    f = PackFileCache(cache_dir=self.test_dir)
+    f.put('foo', data)
+    f.put('bar', b'bar')
+    f.close()
+
+    self.assertEqual([PACK_FILENAME], os.listdir(self.test_dir))
+    self.assertLess(
+        os.path.getsize(os.path.join(self.test_dir, PACK_FILENAME)),
+        len(data) // 10)
+
+    g = PackFileCache(cache_dir=self.test_dir)
+    try:
+      self.assertEqual(data, g.get('foo'))
+      self.assertEqual(b'bar', g.get('bar'))
+      self.assertEqual(2, g.entry_count())
+    finally:
+      g.close()
+
+  def test_newer_records_supersede_older_ones(self):
+    f = PackFileCache(cache_dir=self.test_dir)
+    try:
+      f.put('foo', b'one')
+      f.put('foo', b'two')
+      self.assertEqual(b'two', f.get('foo'))
+      self.assertEqual(1, f.entry_count())
+    finally:
+      f.close()
+
+  def test_evicts_and_compacts(self):
+    f = PackFileCache(cache_dir=self.test_dir, max_entries=2)
+    try:
+      for url in ['a', 'b', 'c', 'd']:
+        f.put(url, url.encode('utf-8') * 100)
+      self.assertEqual(2, f.entry_count())
+      self.assertEqual(2, f.evictions)
+      self.assertEqual('', f.get('a'))
+
+      pack_size = f.pack_size()
+      f.compact()
+      self.assertLess(f.pack_size(), pack_size)
+      self.assertEqual(b'c' * 100, f.get('c'))
+      self.assertEqual(b'd' * 100, f.get('d'))
+    finally:
+      f.close()
+
+  def test_shared_between_instances(self):
+    f = PackFileCache(cache_dir=self.test_dir)
+    g = PackFileCache(cache_dir=self.test_dir)
+    try:
+      f.put('foo', b'foo')
+      g.put('bar', b'bar')
+      self.assertEqual(b'bar', f.get('bar'))
+      self.assertEqual(b'foo', g.get('foo'))
+
+      # Compacting replaces the pack. The other instance should notice.
+      f.put('foo', b'new foo')
+      f.compact()
+      f.put('baz', b'baz')
+      self.assertEqual(b'baz', g.get('baz'))
+      self.assertEqual(b'new foo', g.get('foo'))
+    finally:
+      f.close()
+      g.close()
+
+  def test_ignores_truncated_record(self):
+    f = PackFileCache(cache_dir=self.test_dir)
+    f.put('foo', b'foo')
+    f.put('bar', b'bar')
+    f.close()
+
+    path = os.path.join(self.test_dir, PACK_FILENAME)
+    with open(path, 'r+b') as pack:
+      pack.truncate(os.path.getsize(path) - 2)
+
+    g = PackFileCache(cache_dir=self.test_dir)
+    try:
+      self.assertEqual(b'foo', g.get('foo'))
+      self.assertEqual('', g.get('bar'))
+      g.put('bar', b'bar')
+      self.assertEqual(b'bar', g.get('bar'))
+    finally:
+      g.close()
+
+  def test_leaves_record_being_written_alone(self):
+    f = PackFileCache(cache_dir=self.test_dir)
+    f.put('foo', b'foo')
+
+    # Another process is halfway through appending a record when |g| opens
+    # the pack.
+    path = os.path.join(self.test_dir, PACK_FILENAME)
+    record = MakeRecord('bar', b'bar' * 100)
+    with open(path, 'ab') as pack:
+      pack.write(record[:RECORD_HEADER.size + 10])
+
+    g = PackFileCache(cache_dir=self.test_dir)
+    try:
+      self.assertEqual('', g.get('bar'))
+      with open(path, 'ab') as pack:
+        pack.write(record[RECORD_HEADER.size + 10:])
+      self.assertEqual(b'bar' * 100, g.get('bar'))
+      self.assertEqual(b'bar' * 100, f.get('bar'))
+    finally:
+      f.close()
+      g.close()
+
+  def test_skips_abandoned_record(self):
+    f = PackFileCache(cache_dir=self.test_dir)
+    f.put('foo', b'foo')
+    f.close()
+
+    # A record whose writer crashed, and claims to be larger than what's
+    # appended after it.
+    path = os.path.join(self.test_dir, PACK_FILENAME)
+    with open(path, 'ab') as pack:
+      pack.write(MakeRecord('bar', os.urandom(4096))[:RECORD_HEADER.size + 10])
+
+    g = PackFileCache(cache_dir=self.test_dir)
+    try:
+      g.put('baz', b'baz')
+      self.assertEqual(b'baz', g.get('baz'))
+      self.assertEqual(b'foo', g.get('foo'))
+      self.assertEqual('', g.get('bar'))
+    finally:
+      g.close()
+
+    h = PackFileCache(cache_dir=self.test_dir)
+    try:
+      self.assertEqual(b'baz', h.get('baz'))
+    finally:
+      h.close()
+
+  def test_stale_entries(self):
+    f = PackFileCache(expiration_in_seconds=-1, max_staleness_in_seconds=60)
+    try:
+      f.put('foo', b'foo')
+      self.assertEqual('', f.get('foo'))
+      self.assertEqual((b'foo', True), f.lookup('foo'))
+    finally:
+      f.close()
+
+  def test_codesearch_cache_backend(self):
+    cs = CodeSearch(
+        source_root='.',
+        should_cache=True,
+        cache_dir=self.test_dir,
+        cache_backend='pack')
+    try:
+      self.assertIsInstance(cs.file_cache, PackFileCache)
+    finally:
+      cs.TeardownCache()
+
+    with self.assertRaises(ValueError):
+      CodeSearch(source_root='.', should_cache=True, cache_backend='sqlite')
+
+
+if __name__ == '__main__':
+  unittest.main()
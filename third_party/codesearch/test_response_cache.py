@@ -0,0 +1,70 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import time
+import unittest
+
+from .cache_key import RequestCacheKey
+from .response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+  def test_lru(self):
+    cache = ResponseCache(max_entries=2)
+    a, b, c = [RequestCacheKey(k, []) for k in 'abc']
+    cache.put(a, 'A', 1)
+    cache.put(b, 'B', 1)
+    self.assertEqual('A', cache.get(a))
+    cache.put(c, 'C', 1)
+    self.assertIsNone(cache.get(b))
+    self.assertEqual('A', cache.get(a))
+    self.assertEqual('C', cache.get(c))
+
+  def test_max_bytes(self):
+    cache = ResponseCache(max_bytes=10)
+    a, b = [RequestCacheKey(k, []) for k in 'ab']
+    cache.put(a, 'A', 6)
+    cache.put(b, 'B', 6)
+    self.assertIsNone(cache.get(a))
+    self.assertEqual('B', cache.get(b))
+    self.assertEqual(6, cache.total_bytes)
+
+  def test_limits(self):
+    cache = ResponseCache()
+    cache.put(RequestCacheKey('a', [100]), 'A', 1)
+    self.assertEqual('A', cache.get(RequestCacheKey('a', [100])))
+    self.assertIsNone(cache.get(RequestCacheKey('a', [10])))
+    self.assertIsNone(cache.get(RequestCacheKey('a', [200])))
+
+  def test_limits_mismatch_keeps_lru_position(self):
+    cache = ResponseCache(max_entries=2)
+    a, b, c = [RequestCacheKey(k, [100]) for k in 'abc']
+    cache.put(a, 'A', 1)
+    cache.put(b, 'B', 1)
+    self.assertIsNone(cache.get(RequestCacheKey('a', [10])))
+    cache.put(c, 'C', 1)
+    self.assertIsNone(cache.get(a))
+    self.assertEqual('B', cache.get(b))
+
+  def test_timestamp(self):
+    cache = ResponseCache(expiration_in_seconds=60)
+    a = RequestCacheKey('a', [])
+    cache.put(a, 'A', 1, time.time() - 61)
+    self.assertIsNone(cache.get(a))
+
+  def test_expiration(self):
+    cache = ResponseCache(expiration_in_seconds=-1)
+    a = RequestCacheKey('a', [])
+    cache.put(a, 'A', 1)
+    self.assertIsNone(cache.get(a))
+    self.assertEqual(0, cache.total_bytes)
+
+
+if __name__ == '__main__':
+  unittest.main()
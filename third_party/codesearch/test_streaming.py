@@ -0,0 +1,91 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+from __future__ import absolute_import
+
+import io
+import json
+import os
+import unittest
+
+from .streaming import ArrayElementDecoder
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+def Decode(document, field_name, chunk_size):
+  decoder = ArrayElementDecoder(field_name)
+  elements = []
+  for i in range(0, len(document), chunk_size):
+    elements.extend(decoder.Feed(document[i:i + chunk_size]))
+  decoder.Close()
+  return elements
+
+
+class TestArrayElementDecoder(unittest.TestCase):
+
+  def test_elements_are_returned_as_they_complete(self):
+    decoder = ArrayElementDecoder('search_result')
+    self.assertEqual([], decoder.Feed('{"status": 0, "search_res'))
+    self.assertEqual([], decoder.Feed('ult": [ {"a": "x]'))
+    self.assertEqual([{'a': 'x]'}], decoder.Feed('"}, 1'))
+    self.assertEqual([12, [3]], decoder.Feed('2, [3] ]'))
+    self.assertEqual([], decoder.Feed(', "search_result": [4]}'))
+    decoder.Close()
+
+  def test_escapes_split_across_pieces(self):
+    document = '{"r": ["a\\\\", "b\\"]", {"c": "\\\\\\"}"}, -1.5e3]}'
+    expected = json.loads(document)['r']
+    for chunk_size in [1, 2, 3]:
+      self.assertEqual(expected, Decode(document, 'r', chunk_size))
+
+  def test_each_element_is_decoded_once(self):
+    decoder = ArrayElementDecoder('r')
+    decoded = []
+    decode = decoder.decoder.decode
+
+    def CountingDecode(s):
+      decoded.append(s)
+      return decode(s)
+
+    decoder.decoder.decode = CountingDecode
+    element = json.dumps({'x': ['y' * 10] * 100})
+    document = '{"r": [' + element + ', ' + element + ']}'
+    for i in range(0, len(document), 10):
+      decoder.Feed(document[i:i + 10])
+    decoder.Close()
+    self.assertEqual([element, element], decoded)
+
+  def test_ignores_field_name_inside_strings(self):
+    document = '{"a": "\\"search_result\\": [1]", "search_result": [2]}'
+    self.assertEqual([2], Decode(document, 'search_result', 3))
+
+  def test_missing_and_truncated_arrays(self):
+    self.assertEqual([], Decode('{"status": 0}', 'search_result', 4))
+    with self.assertRaises(ValueError):
+      Decode('{"search_result": [{}, {', 'search_result', 4)
+
+  def test_recorded_responses(self):
+    responses_dir = os.path.join(SCRIPT_DIR, 'testdata', 'responses')
+    checked = 0
+    for name in sorted(os.listdir(responses_dir)):
+      if not name.endswith('.json'):
+        continue
+      with io.open(os.path.join(responses_dir, name), encoding='utf-8') as f:
+        document = f.read()
+      responses = json.loads(document).get('xref_search_response')
+      if not responses:
+        continue
+      expected = responses[0].get('search_result', [])
+      for chunk_size in [1, 7, 4096]:
+        self.assertEqual(expected,
+                         Decode(document, 'search_result', chunk_size))
+      checked += 1
+    self.assertGreater(checked, 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,68 @@
+# Copyright 2017 The Chromium Authors.
+#
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file or at
+# https://developers.google.com/open-source/licenses/bsd.
+
+import unittest
+
+from .client_api import CodeSearch
+from .language_utils import SymbolSuffixMatcher
+from .messages import KytheNodeKind
+from .testing_support import InstallTestRequestHandler
+
+TARGET_FILE = '/src/chrome/src/base/metrics/field_trial.h'
+
+
+class TestSymbolIndex(unittest.TestCase):
+
+  def setUp(self):
+    InstallTestRequestHandler()
+    cs = CodeSearch(source_root='/src/chrome/')
+    self.cs_file = cs.GetFileInfo(TARGET_FILE)
+    self.annotations = [
+        annotation for annotation in self.cs_file.GetAnnotations()
+        if annotation.HasSignature()
+    ]
+    self.index = self.cs_file.GetSymbolIndex()
+
+  def test_is_cached(self):
+    self.assertIs(self.index, self.cs_file.GetSymbolIndex())
+
+  def test_annotations_matching_symbol(self):
+    for symbol in ['FieldTrial', 'base::FieldTrial', 'FieldTrial::group',
+                   'Pickle', 'nope']:
+      matcher = SymbolSuffixMatcher(symbol)
+      self.assertEqual([
+          a for a in self.annotations
+          if matcher.Match(self.cs_file.Text(a.range))
+      ], self.index.AnnotationsMatchingSymbol(symbol))
+      self.assertEqual([
+          a for a in self.annotations
+          if matcher.Match(self.cs_file.Text(a.range)) and
+          a.kythe_xref_kind == KytheNodeKind.FUNCTION
+      ], self.index.AnnotationsMatchingSymbol(symbol, KytheNodeKind.FUNCTION))
+
+  def test_annotations_containing(self):
+    for s in ['FieldTrial', 'pickle_size', 'size', 'nope']:
+      self.assertEqual(
+          [a for a in self.annotations if s in self.cs_file.Text(a.range)],
+          self.index.AnnotationsContaining(s))
+
+  def test_xref_signatures_containing(self):
+    for s in ['/field_trial.h#', 'field_trial.h', 'lang=c%2B%2B#', 'nope(']:
+      for kind in [None, KytheNodeKind.FUNCTION]:
+        expected = []
+        for annotation in self.cs_file.GetAnnotations():
+          if not hasattr(annotation, 'xref_signature'):
+            continue
+          if kind is not None and annotation.kythe_xref_kind != kind:
+            continue
+          signature = annotation.xref_signature.signature
+          if s in signature and signature not in expected:
+            expected.append(signature)
+        self.assertEqual(expected, self.index.XrefSignaturesContaining(s, kind))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -94,6 +94,33 @@ class TestXrefNode(unittest.TestCase):
     self.assertIsInstance(decl, list)
     self.assertEqual(1, len(decl))
 
+  def test_traverse_incrementally(self):
+    sig = None
+    for should_cache in [False, True]:
+      cs = CodeSearch(source_root='/chrome/', should_cache=should_cache)
+      try:
+        if sig is None:
+          sig = cs.GetSignatureForSymbol(
+              '/chrome/src/net/http/http_network_transaction.cc',
+              'HttpNetworkTransaction')
+        node = XrefNode.FromSignature(cs, sig)
+
+        for kinds in [None, KytheXrefKind.EXTENDS, [KytheXrefKind.REFERENCE]]:
+          expected = node.Traverse(kinds)
+          # Once from the network (or disk cache) and once from the decoded
+          # response cache.
+          for _ in range(2):
+            actual = list(node.TraverseIncrementally(kinds))
+            self.assertEqual(len(expected), len(actual))
+            for e, a in zip(expected, actual):
+              self.assertIsInstance(a, XrefNode)
+              self.assertEqual(e.filespec.name, a.filespec.name)
+              self.assertEqual(e.GetSignature(), a.GetSignature())
+              self.assertEqual(e.single_match.line_number,
+                               a.single_match.line_number)
+      finally:
+        cs.TeardownCache()
+
 
 if __name__ == '__main__':
   unittest.main()
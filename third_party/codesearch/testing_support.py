@@ -11,6 +11,8 @@ import inspect
 import json
 import os
 import sys
+import threading
+import time
 
 from email.message import Message
 
@@ -19,9 +21,13 @@ try:
   from urllib.response import addinfourl
   from urllib.error import URLError
   from urllib.parse import urlparse, parse_qsl
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
 except ImportError:
   from urllib2 import urlopen, Request, HTTPSHandler, install_opener, build_opener, addinfourl, URLError
   from urlparse import urlparse, parse_qsl, parse_qs
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
 
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 TEST_DATA_DIR = os.path.join(SCRIPT_DIR, 'testdata')
@@ -184,6 +190,108 @@ def InstallTestRequestHandler(test_data_dir=None):
   install_opener(build_opener(TestHttpHandler()))
 
 
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class RecordedResponseServer(object):
+  """A local HTTP server that replays recorded responses.
+
+  Useful for testing clients that don't go through the URL opener installed by
+  InstallTestRequestHandler(). Point the client's |codesearch_host| at Host().
+  Requests are matched against the recorded responses as if they had been made
+  to |recorded_host|.
+
+  Only responses that already exist are served. Unknown requests result in a
+  404 response and a missing request record, just like TestHttpHandler. The
+  records are written to |missing_dir|, which defaults to the directory
+  holding the recorded responses.
+
+  Each response is delayed by |latency_in_seconds| in order to simulate the
+  round trip to the real server.
+  """
+
+  def __init__(self, recorded_host='https://cs.chromium.org',
+               latency_in_seconds=0, missing_dir=None):
+    server = self
+
+    self.latency_in_seconds = latency_in_seconds
+    self.missing_dir = missing_dir or RESPONSE_DATA_DIR
+
+    # Protects the counters below.
+    self.lock = threading.Lock()
+
+    # Number of requests served, number of bytes in the response bodies that
+    # were served and the digests of requests that had no recorded response.
+    self.request_count = 0
+    self.bytes_served = 0
+    self.missing = set()
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def log_message(self, *args):
+        pass
+
+      def _Respond(self, data):
+        url = recorded_host + self.path
+        b = bytearray(url.encode('utf-8'))
+        b.extend(data)
+        digest = hashlib.sha1(b).hexdigest()
+        response_file_path = os.path.join(RESPONSE_DATA_DIR, digest + '.json')
+        with server.lock:
+          server.request_count += 1
+
+        if server.latency_in_seconds > 0:
+          time.sleep(server.latency_in_seconds)
+
+        if not os.path.exists(response_file_path):
+          with server.lock:
+            server.missing.add(digest)
+          with open(
+              os.path.join(server.missing_dir, '{}.missing'.format(digest)),
+              mode='wb') as f:
+            f.write(
+                json.dumps({
+                    "url": url,
+                    "data": StringFromBytes(bytes(data)),
+                    "filename": digest + '.json',
+                }).encode('utf-8'))
+          self.send_response(404)
+          self.send_header('Content-Length', '0')
+          self.end_headers()
+          return
+
+        with open(response_file_path, 'rb') as f:
+          content = f.read()
+        with server.lock:
+          server.bytes_served += len(content)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+      def do_GET(self):
+        self._Respond(bytes())
+
+      def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self._Respond(self.rfile.read(length))
+
+    self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.thread = threading.Thread(target=self.httpd.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Host(self):
+    return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+  def Stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+
 def DumpCallers(callers_file=None):
   """\
   DumpCallers writes a trace of callers to a file named `callers.json`. The